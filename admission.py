@@ -0,0 +1,220 @@
+"""
+全域准入控制模組
+依 CPU 核心數、可用記憶體與每個瀏覽器的預估記憶體用量，限制同時執行的 agent 數量；
+超過上限的任務依優先順序在有上限的佇列中等待，佇列已滿或等待逾時時拒絕
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:  # psutil 為選用依賴，未安裝時改讀 /proc/meminfo
+    psutil = None
+
+# 優先順序：數字越小越先執行
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+class AdmissionRejected(Exception):
+    """系統忙碌，任務未被接受"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def available_memory() -> Optional[int]:
+    """可用記憶體（bytes），容器內另以 cgroup 上限計算；無法取得時回傳 None"""
+    available = None
+    if psutil is not None:
+        available = psutil.virtual_memory().available
+    else:
+        try:
+            with open('/proc/meminfo') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        available = int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+
+    # cgroup v2 的記憶體上限（Docker 設定 mem_limit 時）
+    try:
+        with open('/sys/fs/cgroup/memory.max') as f:
+            limit = f.read().strip()
+        with open('/sys/fs/cgroup/memory.current') as f:
+            current = int(f.read().strip())
+        if limit != 'max':
+            headroom = int(limit) - current
+            available = headroom if available is None else min(available, headroom)
+    except (OSError, ValueError):
+        pass
+    return available
+
+
+class AdmissionController:
+    """
+    同時執行的 agent 數量上限
+
+    上限 = min(CPU 核心數 × 每核心任務數, 執行中任務數 + 剩餘記憶體可再容納的瀏覽器數)，
+    設定 ADMISSION_MAX_CONCURRENCY 時改用固定上限。
+
+    Args:
+        max_concurrency: 固定上限（0 表示自動計算）
+        max_waiters: 等待佇列上限
+        wait_timeout: 最長等待秒數
+        browser_rss_mb: 每個瀏覽器（含 agent）的預估記憶體用量
+        memory_reserve_mb: 保留給服務本身與系統的記憶體
+        runs_per_cpu: 每個 CPU 核心可同時執行的任務數
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_waiters: Optional[int] = None,
+        wait_timeout: Optional[float] = None,
+        browser_rss_mb: Optional[float] = None,
+        memory_reserve_mb: Optional[float] = None,
+        runs_per_cpu: Optional[float] = None,
+    ):
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(os.getenv('ADMISSION_MAX_CONCURRENCY', '0'))
+        self.max_waiters = max_waiters if max_waiters is not None else int(os.getenv('ADMISSION_MAX_WAITERS', '50'))
+        self.wait_timeout = wait_timeout or float(os.getenv('ADMISSION_WAIT_TIMEOUT', '120'))
+        self.browser_rss = (browser_rss_mb or float(os.getenv('ADMISSION_BROWSER_RSS_MB', '400'))) * 1024 * 1024
+        self.memory_reserve = (memory_reserve_mb or float(os.getenv('ADMISSION_MEMORY_RESERVE_MB', '512'))) * 1024 * 1024
+        self.runs_per_cpu = runs_per_cpu or float(os.getenv('ADMISSION_RUNS_PER_CPU', '1'))
+
+        self._active = 0
+        self._memory_cache = (0.0, None)
+        self._waiters: List = []  # (優先順序, 序號, future)
+        self._recheck_handle: Optional[asyncio.TimerHandle] = None
+        self._sequence = itertools.count()
+        self._durations: deque = deque(maxlen=50)
+        self._stats = {'admitted': 0, 'rejected': 0, 'timeouts': 0, 'completed': 0}
+
+    def limit(self) -> int:
+        """目前的同時執行上限"""
+        if self.max_concurrency > 0:
+            return self.max_concurrency
+        cpu_limit = max(1, int((os.cpu_count() or 1) * self.runs_per_cpu))
+        available = self._available_memory()
+        if available is None:
+            return cpu_limit
+        memory_slots = int(max(0, available - self.memory_reserve) // self.browser_rss)
+        # 執行中的瀏覽器已計入記憶體用量，剩餘空間只決定還能再加幾個
+        return max(1, min(cpu_limit, self._active + memory_slots))
+
+    def _available_memory(self) -> Optional[int]:
+        # 每秒最多讀取一次，避免每次喚醒等待者都讀檔
+        checked_at, value = self._memory_cache
+        now = time.monotonic()
+        if now - checked_at > 1:
+            value = available_memory()
+            self._memory_cache = (now, value)
+        return value
+
+    def retry_after(self) -> int:
+        """依近期任務耗時估計多久後會有空位（秒）"""
+        if not self._durations:
+            return int(min(self.wait_timeout, 30))
+        average = sum(self._durations) / len(self._durations)
+        rounds = (len(self._waiters) + 1) / max(1, self.limit())
+        return max(1, min(300, math.ceil(average * rounds)))
+
+    def check(self):
+        """不佔位地檢查是否還能接受任務，等待佇列已滿時拋出 AdmissionRejected"""
+        if self._active < self.limit() and not self._waiters:
+            return
+        if len(self._waiters) >= self.max_waiters:
+            self._stats['rejected'] += 1
+            raise AdmissionRejected(
+                f"系統忙碌：{self._active} 個任務執行中、{len(self._waiters)} 個等待中",
+                self.retry_after()
+            )
+
+    @asynccontextmanager
+    async def slot(self, priority: str = 'normal'):
+        """取得執行名額，結束時釋放並喚醒下一個等待者"""
+        await self._acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._durations.append(time.monotonic() - start)
+            self._active -= 1
+            self._stats['completed'] += 1
+            self._wake()
+
+    async def _acquire(self, priority: str):
+        if self._active < self.limit() and not self._waiters:
+            self._active += 1
+            self._stats['admitted'] += 1
+            return
+
+        self.check()
+        future = asyncio.get_running_loop().create_future()
+        entry = (PRIORITIES.get(priority, PRIORITIES['normal']), next(self._sequence), future)
+        heapq.heappush(self._waiters, entry)
+        self._schedule_recheck()
+        try:
+            # 名額由 _wake 轉交（_active 已先加一）
+            await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+            self._stats['admitted'] += 1
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 已拿到名額但自己被取消或逾時，歸還名額
+                self._active -= 1
+                self._wake()
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            if isinstance(e, asyncio.TimeoutError):
+                self._stats['timeouts'] += 1
+                raise AdmissionRejected(f"等待執行名額逾時（{self.wait_timeout:.0f} 秒）", self.retry_after())
+            raise
+
+    def _wake(self):
+        while self._waiters and self._active < self.limit():
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+    def _schedule_recheck(self):
+        # 有等待者時每秒重新計算上限：可用記憶體增加時不必等到有任務結束才放行
+        if self._recheck_handle is None:
+            self._recheck_handle = asyncio.get_running_loop().call_later(1, self._recheck)
+
+    def _recheck(self):
+        self._recheck_handle = None
+        self._wake()
+        if any(not future.done() for _, _, future in self._waiters):
+            self._schedule_recheck()
+
+    def get_metrics(self) -> Dict:
+        queued = {name: 0 for name in PRIORITIES}
+        names = {value: name for name, value in PRIORITIES.items()}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queued[names[priority]] += 1
+        available = self._available_memory()
+        return {
+            'limit': self.limit(),
+            'active': self._active,
+            'queued': sum(queued.values()),
+            'queued_by_priority': queued,
+            'max_waiters': self.max_waiters,
+            'available_memory_mb': round(available / 1024 / 1024) if available is not None else None,
+            'retry_after': self.retry_after(),
+            **self._stats,
+        }
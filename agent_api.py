@@ -1,31 +1,184 @@
-from fastapi import FastAPI
+# 盡早建立，以量測之後匯入各模組的耗時
+from startup import StartupReport
+startup_report = StartupReport()
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 import uvicorn
 import os
-from browser_use.llm import ChatAzureOpenAI
-from browser_use import Agent
 from dotenv import load_dotenv
 import asyncio
+import importlib
 import random
-import httpx
+import base64
 import json
-from typing import Optional
-from stealth_config import StealthConfig, HumanBehavior, get_enhanced_config
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from stealth_config import StealthConfig, get_enhanced_config, split_browser_config
+from admission import AdmissionController, AdmissionRejected, available_memory
+from browser_pool import BrowserPool
+from resource_blocking import ResourceBlocker, ResourceStats
+from state_cache import NETWORK_USAGE_SCRIPT, BrowserStateCache, sites_in_task
+from pacing import Pacer, SiteRateLimiter, resolve_profile, slow_mo_for
+from vision import VisionPipeline, resolve_vision_mode
+from context_compaction import ContextCompactor
+from checkpoint_store import CheckpointRecorder, CheckpointStore, restore_agent_state, restore_history
+from task_queue import TaskQueue, QueueFullError, STATUS_CANCELLED, STATUS_QUEUED, STATUS_TIMEOUT
+from retry_policy import (
+    DEFAULT_RULES, AttemptFailed, RetryBudget, build_resume_point, classify, parse_retry_after
+)
+from task_control import REASON_CANCELLED, REASON_MAX_STEPS, TaskControlRegistry, TaskInterrupted
+from batch_runner import BatchStats, iter_batch
+from callback_dispatcher import CallbackDispatcher
+from result_serializer import dumps, serialize_result
+from llm_cache import LLMCallCache
+from metrics import (
+    ACTIVE_BROWSERS, ATTEMPT_FAILURES, ATTEMPTS, AVAILABLE_MEMORY, BROWSER_FDS, BROWSER_MEMORY, LLM_CALLS, LLM_CONTEXT, LLM_TOKENS, OPENMETRICS_CONTENT_TYPE,
+    PHASE_SECONDS, PROMETHEUS_CONTENT_TYPE, QUEUE_DEPTH, REGISTRY, RETRIES, RUNNING_AGENTS, SERVICE_READY, STEPS,
+    TASK_LLM_TOKENS, TASKS, VISION_IMAGES, VISION_SAVINGS
+)
+from result_cache import CacheMiss, ResultCache, SOURCE_RUN, make_cache_key
+from artifact_store import ArtifactNotFound, artifact_blob_sink, create_artifact_store, parse_range
+from worker_pool import RemoteTaskError, WorkerPool
+from task_events import TaskEventBus, build_result_event, build_step_event, format_sse
+from tracing import (
+    Trace, TaskProfiler, TraceExporter, activate, current_context, current_trace, deactivate, record_span, span
+)
 
 # 在 API 啟動時讀取一次 .env
 load_dotenv()
 
-# 初始化 Azure OpenAI LLM 模型
-# 建議在全域範圍初始化一次，避免每次請求都重新建立
-llm = ChatAzureOpenAI(
-    model="gpt-4.1",
-)
+# Azure OpenAI LLM 模型：全服務共用一個，在預熱或第一次使用時才建立，
+# 匯入 browser-use 約需數秒，延後到服務開始監聽之後
+llm = None
+
+def get_llm():
+    global llm
+    if llm is None:
+        from browser_use.llm import ChatAzureOpenAI
+        llm = ChatAzureOpenAI(
+            model="gpt-4.1",
+        )
+    return llm
+
+# LLM 呼叫快取與全域限流（LLM_CACHE_MODE=off|on|record|replay），各 Agent 共用
+llm_call_cache = LLMCallCache()
+
+# 同時執行的 agent 數量上限（依 CPU 與記憶體自動計算）
+admission_controller = AdmissionController()
+
+# 全服務共用的重試預算
+retry_budget = RetryBudget()
+
+# 執行中任務的取消與時間預算控制
+task_controls = TaskControlRegistry()
+
+# 多行程模式（AGENT_WORKERS > 0）：agent 在 worker 行程中執行，主行程只負責 API 與排程
+worker_pool = WorkerPool()
+
+# 預熱瀏覽器池（BROWSER_POOL_SIZE=0 可停用，改回每次冷啟動）
+browser_pool = BrowserPool()
+BROWSER_ORPHAN_SWEEP_INTERVAL = float(os.getenv('BROWSER_ORPHAN_SWEEP_INTERVAL', '60'))
+
+# 任務追蹤匯出（request.trace 或依 TRACE_SAMPLE_RATE 抽樣，寫入 TRACE_DIR 並可送到 TRACE_EXPORT_URL）
+trace_exporter = TraceExporter()
+
+# 啟動預熱：匯入 browser-use、建立 LLM 客戶端並確認瀏覽器可以啟動，完成後 /readyz 才回報就緒
+STARTUP_PREWARM = os.getenv('STARTUP_PREWARM', 'true').lower() == 'true'
+PREWARM_CHECKS = ["llm", "browser"] if STARTUP_PREWARM else []
+
+async def prewarm():
+    """預熱：STARTUP_PREWARM 關閉時只啟動瀏覽器池，不列入就緒條件"""
+    if STARTUP_PREWARM:
+        with startup_report.phase("import_browser_use"):
+            await asyncio.to_thread(importlib.import_module, "browser_use")
+        try:
+            with startup_report.phase("llm_init"):
+                await asyncio.to_thread(get_llm)
+            startup_report.check("llm")
+        except Exception as e:
+            startup_report.check("llm", f"LLM 客戶端建立失敗: {e}")
+    if browser_pool.enabled:
+        try:
+            with startup_report.phase("browser_pool"):
+                await browser_pool.start()
+        except Exception as e:
+            print(f"瀏覽器池啟動失敗，改用冷啟動模式: {e}")
+    if not STARTUP_PREWARM:
+        return
+    if browser_pool.get_metrics()["idle"]:
+        startup_report.check("browser")
+        return
+    # 未使用瀏覽器池（或池中瀏覽器都啟動失敗）時，實際啟動一次瀏覽器確認冷啟動可用
+    try:
+        with startup_report.phase("browser_probe"):
+            await browser_pool.probe()
+        startup_report.check("browser")
+    except Exception as e:
+        startup_report.check("browser", f"瀏覽器啟動失敗: {e}")
+
+def warm_workers() -> List[dict]:
+    """已就緒且預熱成功的 worker（多行程模式下由 worker 各自預熱）"""
+    return [
+        worker for worker in worker_pool.get_metrics()["workers"]
+        if worker["ready"] and (worker["startup"] or {}).get("ready", True)
+    ]
+
+def is_ready() -> bool:
+    if not startup_report.ready:
+        return False
+    # worker 崩潰重啟期間可能暫時沒有可用的 worker
+    return not worker_pool.enabled or bool(warm_workers())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    服務啟動時啟動任務佇列並在背景預熱，關閉時依序釋放
+
+    預熱在開始監聽之後才進行：/livez 立即可用，/readyz 在預熱完成後才回報就緒。
+    多行程模式下 worker 在回報就緒前已各自完成預熱。
+    """
+    warmup = None
+    if worker_pool.enabled:
+        startup_report.require(["workers"])
+        with startup_report.phase("workers"):
+            await worker_pool.start()
+        if warm_workers():
+            startup_report.check("workers")
+        else:
+            checks = (worker_pool.get_metrics()["workers"][0]["startup"] or {}).get("checks", {})
+            failed = {name: status for name, status in checks.items() if status != "ok"}
+            startup_report.check("workers", f"沒有預熱成功的 worker: {failed}")
+    else:
+        startup_report.require(PREWARM_CHECKS)
+        warmup = asyncio.create_task(prewarm())
+    await callback_dispatcher.start()
+    await task_queue.start()
+    eviction = asyncio.create_task(evict_artifacts_periodically())
+    sweeper = asyncio.create_task(sweep_orphan_browsers_periodically())
+    startup_report.mark("serving")
+    yield
+    startup_report.shutdown()
+    if warmup:
+        warmup.cancel()
+    eviction.cancel()
+    sweeper.cancel()
+    await task_queue.stop()
+    await worker_pool.stop()
+    await callback_dispatcher.stop()
+    await browser_pool.stop()
+    await llm_call_cache.close()
+    await trace_exporter.close()
 
 # 建立 FastAPI app
 app = FastAPI(
     title="Browser Use Agent API",
     description="透過 API 調用 browser-use 代理來執行瀏覽器自動化任務（帶反檢測功能）",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # 定義 API 請求的資料結構
@@ -35,37 +188,124 @@ class AgentTaskRequest(BaseModel):
     use_stealth: bool = True  # 是否使用隱身模式
     use_proxy: bool = False  # 是否使用代理
     headless: bool = False  # 是否使用無頭模式
-    delay_range: tuple = (1, 3)  # 動作間延遲範圍（秒）
+    delay_range: tuple = (1, 3)  # 動作間延遲範圍（秒，paced 節奏時這個任務每個步驟的間隔）
+    execution_profile: Optional[Literal["fast", "balanced", "paced"]] = Field(
+        None,
+        description="執行節奏：fast 不限速、balanced 依網站限制每秒步驟數、paced 任務每步間隔 delay_range 並加上 slow_mo；"
+                    "未指定時為 balanced"
+    )
+    vision: Optional[Literal["off", "low", "high", "auto"]] = Field(
+        None,
+        description="截圖送進 LLM 的方式：off 不送截圖、low 低解析度、high 高解析度、auto 平時低解析度，步驟出錯後改送高解析度；"
+                    "未指定時依 VISION_MODE（預設 auto）"
+    )
     max_retries: int = 3  # 最大重試次數
+    max_duration: Optional[float] = Field(None, gt=0, description="整個任務（含重試）的時間上限（秒），超過時中止並回傳部分結果")
+    max_steps: int = Field(100, ge=1, description="agent 最多執行的步驟數")
     callback_timeout: int = Field(30, description="回調請求超時時間（秒）")
     callback_retries: int = Field(3, description="回調重試次數")
+    result_exclude: List[str] = Field(
+        default_factory=list,
+        description="結果中不輸出的欄位名稱，或預設組合 no_screenshots / no_dom / steps"
+    )
+    priority: Literal["high", "normal", "low"] = Field("normal", description="系統忙碌時的執行優先順序")
+    cache: Literal["bypass", "refresh", "prefer", "only"] = Field(
+        "bypass",
+        description="結果快取模式：bypass 不使用快取、refresh 執行後覆寫快取、prefer 優先使用快取、only 只讀快取不執行"
+    )
+    resume_from: Optional[str] = Field(None, description="從先前失敗或中止任務的檢查點（checkpoint_id）繼續執行")
+    state_profile: Optional[str] = Field(
+        None,
+        pattern=r"^[A-Za-z0-9_-]{1,64}$",
+        description="沿用此 profile 保存的各網站 cookie、localStorage 與 HTTP 快取（依租戶或用途區分）"
+    )
+    resource_profile: Literal["full", "no-media", "text-only"] = Field(
+        "full",
+        description="資源攔截：full 全部載入、no-media 不載入圖片與影音、text-only 另外不載入字型；後兩者也攔截廣告與分析追蹤"
+    )
+    block_domains: List[str] = Field(default_factory=list, description="額外攔截的網域（含子網域）")
+    trace: bool = Field(False, description="匯出此任務的追蹤（OpenTelemetry JSON），可由 GET /api/traces/{trace_id} 取得")
+    profile: Optional[Literal["sampling", "cprofile"]] = Field(
+        None,
+        description="剖析此任務的 agent 執行與序列化：sampling 為取樣式（輸出 flamegraph 用的 folded 檔）、cprofile 輸出 pstats 檔"
+    )
 
-def serialize_result(obj):
-    """
-    將複雜對象序列化為可JSON化的格式
-    """
-    if hasattr(obj, '__dict__'):
-        # 對於有__dict__屬性的對象，轉換為字典
-        result = {}
-        for key, value in obj.__dict__.items():
-            result[key] = serialize_result(value)
-        return result
-    elif isinstance(obj, list):
-        # 對於列表，遞歸處理每個元素
-        return [serialize_result(item) for item in obj]
-    elif isinstance(obj, dict):
-        # 對於字典，遞歸處理每個值
-        return {key: serialize_result(value) for key, value in obj.items()}
-    elif isinstance(obj, (str, int, float, bool, type(None))):
-        # 基本類型直接返回
-        return obj
-    else:
-        # 其他類型轉換為字符串
-        return str(obj)
+# 會影響任務結果、需納入快取鍵的欄位（回調與重試設定不影響結果）
+CACHE_KEY_FIELDS = (
+    "use_stealth", "use_proxy", "headless", "result_exclude", "state_profile", "resource_profile", "block_domains",
+    "vision"
+)
+
+# 批次請求的並行上限，避免單一批次佔滿所有資源
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+
+class BatchTaskRequest(BaseModel):
+    tasks: List[AgentTaskRequest] = Field(..., min_length=1, description="要執行的任務列表")
+    concurrency: int = Field(4, ge=1, description="同時執行的任務數")
+    stream: bool = Field(False, description="是否以 NDJSON 串流逐筆回傳完成的任務")
+    callback_url: Optional[str] = Field(None, description="整批完成後彙總回調的URL")
+    callback_timeout: int = Field(30, description="回調請求超時時間（秒）")
+    callback_retries: int = Field(3, description="回調重試次數")
+
+class FastJSONResponse(Response):
+    """以 orjson（若已安裝）編碼的 JSON 回應，避免大型結果經過 jsonable_encoder"""
+    media_type = "application/json"
+    
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+# 相同任務的結果快取（需在請求中指定 cache=prefer 或 only 才會讀取）
+result_cache = ResultCache()
+
+# 截圖等二進位資料存入內容定址的產出物儲存，結果與回調只保留雜湊與 URL
+artifact_store = create_artifact_store()
+result_blob_sink = artifact_blob_sink(artifact_store, os.getenv('ARTIFACT_PUBLIC_URL', ''))
+ARTIFACT_EVICT_INTERVAL = float(os.getenv('ARTIFACT_EVICT_INTERVAL', '600'))
+
+# 每個成功步驟的檢查點，重試或 resume_from 時從最後成功的步驟繼續
+checkpoint_store = CheckpointStore()
+
+# 依 state_profile 保存的各網站瀏覽器狀態
+state_cache = BrowserStateCache()
+
+# 資源攔截的跨任務統計（估計省下的位元組與載入時間）
+resource_stats = ResourceStats()
+
+# 各網站的操作速率上限（同一行程內的任務共用，PACING_SITE_RATES 可個別設定）
+site_limiter = SiteRateLimiter()
+
+async def evict_artifacts_periodically():
+    """定期依保存期限與總大小淘汰產出物、過期的檢查點與瀏覽器狀態快取"""
+    while True:
+        await asyncio.sleep(ARTIFACT_EVICT_INTERVAL)
+        try:
+            removed = await asyncio.to_thread(artifact_store.evict)
+            if removed:
+                print(f"已淘汰 {removed} 個產出物")
+            removed = await asyncio.to_thread(checkpoint_store.evict)
+            if removed:
+                print(f"已刪除 {removed} 個過期的檢查點")
+            removed = await asyncio.to_thread(state_cache.evict)
+            if removed:
+                print(f"已淘汰 {removed} 個瀏覽器狀態快取")
+        except Exception as e:
+            print(f"淘汰產出物失敗: {e}")
+
+async def sweep_orphan_browsers_periodically():
+    """定期清除崩潰的任務或 worker 行程遺留的 Chromium 行程"""
+    while True:
+        await asyncio.sleep(BROWSER_ORPHAN_SWEEP_INTERVAL)
+        try:
+            await asyncio.to_thread(browser_pool.watchdog.sweep, browser_pool.browser_ids())
+        except Exception as e:
+            print(f"清除孤兒瀏覽器行程失敗: {e}")
+
+# 回調派送器：每個主機共用長連線，背景重試，失敗的回調寫入磁碟
+callback_dispatcher = CallbackDispatcher()
 
 async def send_callback(callback_url: str, data: dict, timeout: int = 30, max_retries: int = 3):
     """
-    發送回調請求到指定URL
+    將回調排入背景派送佇列後立即返回，不會因接收端緩慢而延遲 API 回應
     
     Args:
         callback_url: 回調URL
@@ -76,51 +316,439 @@ async def send_callback(callback_url: str, data: dict, timeout: int = 30, max_re
     if not callback_url:
         return
     
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "AutoPageAudit-BrowserUse/2.0.0"
-    }
+    with span("callback.enqueue"):
+        delivery_id = await callback_dispatcher.enqueue(callback_url, data, timeout, max_retries)
+    print(f"回調已排入派送佇列: {callback_url} ({delivery_id})")
+    return delivery_id
+
+# 任務進度事件（SSE 串流使用）
+task_events = TaskEventBus()
+
+def make_step_hook(task_id: str, publish):
+    """建立 agent 的 on_step_end hook，每完成一步就以 publish(event_type, data) 發佈進度事件"""
+    async def on_step_end(agent):
+        history = agent.state.history.history
+        if not history:
+            return
+        item = history[-1]
+        event = build_step_event(task_id, item)
+        if item.state.screenshot:
+            try:
+                event["screenshot"] = await asyncio.to_thread(
+                    result_blob_sink, base64.b64decode(item.state.screenshot), "screenshot"
+                )
+            except Exception as e:
+                print(f"儲存步驟截圖失敗: {e}")
+        publish("step", event)
+    return on_step_end
+
+async def run_agent(
+    request: AgentTaskRequest,
+    browser_config: dict,
+    on_step_end=None,
+    resume: Optional[dict] = None,
+    blocker: Optional[ResourceBlocker] = None,
+    chat_model=None,
+    on_step_start=None
+):
+    """
+    執行一次 agent
+
+    瀏覽器池可用時從池中借出已啟動的瀏覽器並建立獨立 context，
+    否則沿用原本每次冷啟動瀏覽器的方式。
+    resume 帶有檢查點時還原 agent 的記憶、步驟紀錄與 cookie/localStorage 並回到最後成功的頁面；
+    只有進度摘要時先回到最後成功的頁面，並告知 agent 已完成的步驟。
+    blocker 在第一次導航前安裝到 context 上，攔截不需要的資源並統計用量。
+    chat_model 為這次執行使用的 LLM 包裝（未指定時另建）；on_step_start 在每個步驟開始前呼叫（網站限速）。
+    """
+    from browser_use import Agent, BrowserProfile, BrowserSession
+
+    agent_options = {}
+    checkpoint = None
+    if resume and resume.get("checkpoint"):
+        checkpoint = await asyncio.to_thread(checkpoint_store.load, resume["checkpoint"])
+    if checkpoint:
+        print(f"從檢查點 {resume['checkpoint']} 繼續：已完成 {checkpoint['steps']} 個步驟，回到 {checkpoint['url']}")
+        agent_options["injected_agent_state"] = restore_agent_state(checkpoint)
+        agent_options["initial_actions"] = [{"go_to_url": {"url": checkpoint["url"], "new_tab": False}}]
+    elif resume and resume.get("url"):
+        agent_options["initial_actions"] = [{"go_to_url": {"url": resume["url"], "new_tab": False}}]
+        agent_options["message_context"] = (
+            "這是重試的任務。先前的嘗試已完成以下步驟，目前已回到最後成功的頁面，"
+            "請從這裡繼續，不要重複已完成的步驟：\n" + "\n".join(resume["summary"])
+        )
+    if checkpoint and checkpoint.get("storage_state"):
+        browser_config = {**browser_config, "storage_state": checkpoint["storage_state"]}
+    max_steps = max(1, request.max_steps - checkpoint["steps"]) if checkpoint else request.max_steps
+    
+    def create_agent(**options) -> Agent:
+        agent = Agent(
+            task=request.task,
+            llm=chat_model or llm_call_cache.wrap(get_llm()),
+            use_vision=resolve_vision_mode(request.vision) != "off",
+            **options,
+            **agent_options
+        )
+        if checkpoint:
+            restore_history(agent, checkpoint)
+        return agent
     
-    for attempt in range(max_retries):
+    launch_options, context_options = split_browser_config(browser_config)
+    launch_started = time.time()
+    if browser_pool.accepts(request.headless):
+        async with browser_pool.lease(context_options) as lease:
+            record_span("browser.launch", launch_started, time.time(), pooled=True)
+            if blocker:
+                await blocker.install(lease.context)
+            browser_session = BrowserSession(
+                browser=lease.browser,
+                browser_context=lease.context,
+                keep_alive=True
+            )
+            agent = create_agent(browser_session=browser_session)
+            return await agent.run(max_steps=max_steps, on_step_start=on_step_start, on_step_end=on_step_end)
+    
+    # 冷啟動時以 BrowserProfile 帶入 cookie/localStorage 與保留 HTTP 快取的使用者資料目錄
+    profile_options = {}
+    if context_options.get("storage_state"):
+        profile_options["storage_state"] = context_options["storage_state"]
+    if launch_options.get("user_data_dir"):
+        profile_options["user_data_dir"] = launch_options["user_data_dir"]
+    if profile_options:
+        agent = create_agent(browser_config=browser_config, browser_profile=BrowserProfile(**profile_options))
+    else:
+        agent = create_agent(browser_config=browser_config)
+    if blocker:
+        # 先啟動瀏覽器取得 context 以安裝攔截，agent.run 會沿用已啟動的 session
         try:
-            print(f"發送回調到 {callback_url} (第 {attempt + 1} 次嘗試)")
-            
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                response = await client.post(
-                    callback_url,
-                    json=data,
-                    headers=headers
-                )
-                
-                print(f"回調響應狀態: {response.status_code}")
-                
-                if response.status_code == 200:
-                    print(f"回調成功發送到 {callback_url}")
-                    return True
-                else:
-                    print(f"回調失敗，狀態碼: {response.status_code}, 響應: {response.text}")
-                    
-        except httpx.TimeoutException:
-            print(f"回調超時 (第 {attempt + 1} 次嘗試)")
-        except Exception as e:
-            print(f"回調發送失敗 (第 {attempt + 1} 次嘗試): {e}")
-        
-        if attempt < max_retries - 1:
-            # 指數退避重試
-            wait_time = (2 ** attempt) * 2  # 2, 4, 8 秒
-            print(f"等待 {wait_time} 秒後重試回調...")
-            await asyncio.sleep(wait_time)
+            await agent.browser_session.start()
+            record_span("browser.launch", launch_started, time.time(), pooled=False)
+            await blocker.install(agent.browser_session.browser_context)
+        except BaseException:
+            await agent.close()
+            raise
+    return await agent.run(max_steps=max_steps, on_step_start=on_step_start, on_step_end=on_step_end)
+
+async def run_and_serialize(
+    request: AgentTaskRequest,
+    browser_config: dict,
+    task_id: Optional[str],
+    publish,
+    resume: Optional[dict] = None,
+    checkpoint_id: Optional[str] = None,
+    trace_context: Optional[dict] = None
+) -> dict:
+    """
+    執行一次 agent 並序列化結果，同時記錄 span（多行程模式下隨結果帶回主行程）
+
+    trace_context 為主行程的 trace_id 與父 span；request.profile 有設定時剖析這次執行。
+    """
+    trace = Trace(trace_context["trace_id"], trace_context["parent_id"]) if trace_context else Trace()
+    token = activate(trace)
+    profiler = TaskProfiler(request.profile, trace.trace_id) if request.profile else None
+    if profiler:
+        profiler.start()
+    try:
+        with trace.span("agent.run"):
+            run = await execute_and_serialize(request, browser_config, task_id, publish, resume, checkpoint_id)
+    finally:
+        deactivate(token)
+        profile = profiler.stop() if profiler else None
+        if profile and profile.get("file"):
+            print(f"效能剖析已寫入 {profile['file']}")
+    return {**run, "spans": trace.export_spans(), "profile": profile}
+
+async def execute_and_serialize(
+    request: AgentTaskRequest,
+    browser_config: dict,
+    task_id: Optional[str],
+    publish,
+    resume: Optional[dict] = None,
+    checkpoint_id: Optional[str] = None
+) -> dict:
+    """
+    執行一次 agent，並在同一個行程內把結果序列化（截圖存入產出物儲存）
+
+    每個成功的步驟都寫入 checkpoint_id 的檢查點。
+    被取消時不往上拋出，而是回傳目前為止的部分結果（interrupted=True）；
+    失敗或 agent 連續失敗後放棄時拋出 AttemptFailed，附上可接續的進度。
+    """
+    step_hook = make_step_hook(task_id, publish) if task_id else None
+    latest = {}
+    restored_steps = 0
+    network = {"transferred_bytes": 0, "cached_bytes": 0}
+    blocker = ResourceBlocker(request.resource_profile, request.block_domains)
+    chat_model = llm_call_cache.wrap(get_llm())
+    vision = VisionPipeline(resolve_vision_mode(request.vision))
+    context = ContextCompactor()
+    pacer = Pacer(
+        resolve_profile(request.execution_profile),
+        site_limiter,
+        request.delay_range,
+        sites_in_task(request.task)
+    )
+    
+    if checkpoint_id and not (resume and resume.get("checkpoint")):
+        # 從頭開始的嘗試不沿用先前的檢查點
+        await asyncio.to_thread(checkpoint_store.delete, checkpoint_id)
+    recorder = CheckpointRecorder(checkpoint_store, checkpoint_id) if checkpoint_id else None
+    
+    async def on_step_end(agent):
+        nonlocal restored_steps
+        if "agent" not in latest:
+            # 第一個步驟結束前已存在的紀錄來自檢查點
+            restored_steps = len(agent.state.history.history) - 1
+        latest["agent"] = agent
+        if agent.state.history.history:
+            record_step_spans(agent.state.history.history[-1], chat_model.calls)
+            vision.observe_step(agent.state.history.history[-1])
+        with span("step.hooks"):
+            if step_hook:
+                await step_hook(agent)
+            if recorder:
+                try:
+                    await recorder.capture(agent, request.task, restored_steps)
+                except Exception as e:
+                    print(f"寫入檢查點失敗: {e}")
+            if request.state_profile:
+                await record_profile_state(agent, request.state_profile, network)
+    
+    async def on_step_start(agent):
+        page = agent.browser_session.agent_current_page if agent.browser_session else None
+        started = time.time()
+        if await pacer.before_step(page.url if page else None):
+            record_span("pacing", started, time.time(), profile=pacer.profile)
+    
+    interrupted = False
+    try:
+        result = await run_agent(
+            request,
+            browser_config,
+            on_step_end=on_step_end,
+            resume=resume,
+            blocker=blocker,
+            chat_model=context.wrap(vision.wrap(chat_model)),
+            on_step_start=on_step_start
+        )
+    except asyncio.CancelledError:
+        # run_agent 結束時已關閉 context 並歸還瀏覽器，這裡只收集已完成的步驟
+        interrupted = True
+        result = latest["agent"].state.history if "agent" in latest else None
+    except Exception as e:
+        history = latest["agent"].state.history if "agent" in latest else None
+        raise AttemptFailed(
+            type(e).__name__,
+            str(e),
+            resume=build_resume_point(history) or resume,
+            retry_after=parse_retry_after(e),
+            status_code=getattr(e, "status_code", None)
+        ) from e
     
-    print(f"回調最終失敗，已重試 {max_retries} 次")
-    return False
+    # 未完成、也沒用完步驟數就結束，表示 agent 連續失敗後放棄
+    steps = len(getattr(result, 'history', None) or [])
+    if not interrupted and result is not None and not result.is_done() and steps < request.max_steps:
+        errors = [error for error in result.errors() if error]
+        if errors:
+            raise AttemptFailed(
+                "AgentGaveUp",
+                errors[-1],
+                resume=build_resume_point(result) or resume,
+                retry_after=parse_retry_after(Exception(errors[-1]))
+            )
+    
+    with span("serialize"):
+        serialized = await asyncio.to_thread(
+            serialize_result,
+            result,
+            exclude=request.result_exclude,
+            blob_sink=result_blob_sink
+        )
+    
+    return {
+        "steps": steps,
+        "result": serialized,
+        "summary": build_result_event(task_id, result),
+        "interrupted": interrupted,
+        "restored_steps": restored_steps,
+        "network": network if request.state_profile else None,
+        "resources": blocker.report(),
+        "llm_usage": chat_model.usage,
+        "pacing": pacer.report(),
+        "vision": vision.report(),
+        "context": context.report(),
+    }
 
-async def setup_stealth_environment():
-    """設置隱身環境"""
-    # 添加啟動前的隨機延遲
-    await HumanBehavior.random_delay(0.5, 2.0)
+def record_step_spans(item, llm_calls: list):
+    """
+    由步驟紀錄與 LLM 呼叫時間還原步驟內的 span：取得頁面狀態 → LLM 決定動作 → 執行動作
+    （動作中的 LLM 呼叫，例如擷取頁面內容，記在執行動作底下）
+    """
+    metadata = item.metadata
+    if metadata is None:
+        return
+    start, end = metadata.step_start_time, metadata.step_end_time
+    actions = []
+    for action in (item.model_output.action if item.model_output else []):
+        actions.extend(name for name, params in action.model_dump(exclude_unset=True).items() if params is not None)
+    step = record_span("agent.step", start, end, step=metadata.step_number)
+    calls = [(started, seconds) for started, seconds in llm_calls if start <= started <= end]
+    if step is None or not calls:
+        return
+    first_started, first_seconds = calls[0]
+    record_span("browser.state", start, first_started, step.span_id)
+    record_span("llm.call", first_started, first_started + first_seconds, step.span_id)
+    executed = record_span(
+        "browser.actions", first_started + first_seconds, end, step.span_id, actions=", ".join(actions)
+    )
+    for started, seconds in calls[1:]:
+        record_span("llm.call", started, started + seconds, executed.span_id)
+
+# 對應到 agent_phase_seconds 的 span
+METRIC_PHASES = {"browser.launch": "browser_launch", "agent.step": "step", "llm.call": "llm_call", "serialize": "serialize"}
+
+def record_run_metrics(run: dict):
+    """把一次執行（可能在 worker 行程中）的各階段耗時與 LLM 用量計入指標"""
+    for item in run.get("spans") or []:
+        phase = METRIC_PHASES.get(item["name"])
+        if phase is None or item["end"] is None:
+            continue
+        PHASE_SECONDS.labels(phase).observe((item["end"] - item["start"]) / 1e9)
+        if phase == "step":
+            STEPS.inc()
+        elif phase == "llm_call":
+            LLM_CALLS.inc()
+    
+    if run.get("pacing"):
+        PHASE_SECONDS.labels("pacing").observe(run["pacing"]["paced_seconds"])
+    
+    vision = run.get("vision")
+    if vision:
+        VISION_IMAGES.labels("sent").inc(vision["sent"])
+        VISION_IMAGES.labels("deduped").inc(vision["deduped"])
+        VISION_SAVINGS.labels("bytes").inc(max(0, vision["saved_bytes"]))
+        VISION_SAVINGS.labels("image_tokens").inc(max(0, vision["saved_tokens"]))
+    
+    context = run.get("context")
+    if context:
+        LLM_CONTEXT.labels("before").inc(context["tokens_before"])
+        LLM_CONTEXT.labels("after").inc(context["tokens_after"])
+    
+    usage = run.get("llm_usage")
+    if usage:
+        LLM_TOKENS.labels("prompt").inc(usage["prompt_tokens"])
+        LLM_TOKENS.labels("completion").inc(usage["completion_tokens"])
+        TASK_LLM_TOKENS.observe(usage["total_tokens"])
+
+async def record_profile_state(agent, profile: str, network: dict):
+    """累計頁面傳輸量；任務完成時把 cookie 與 localStorage 存入 profile 供之後的任務沿用"""
+    session = agent.browser_session
+    try:
+        page = await session.get_current_page()
+        transferred, cached = await page.evaluate(NETWORK_USAGE_SCRIPT)
+        network["transferred_bytes"] += transferred
+        network["cached_bytes"] += cached
+        if agent.state.history.is_done():
+            storage_state = await session.browser_context.storage_state()
+            await asyncio.to_thread(state_cache.save, profile, storage_state)
+    except Exception as e:
+        print(f"記錄瀏覽器狀態失敗: {e}")
+
+async def execute_run(
+    request: AgentTaskRequest,
+    browser_config: dict,
+    task_id: Optional[str] = None,
+    resume: Optional[dict] = None,
+    checkpoint_id: Optional[str] = None
+) -> dict:
+    """
+    執行一次 agent 並取得序列化後的結果
+
+    多行程模式（AGENT_WORKERS > 0）交給負載最低的 worker 行程執行，
+    步驟事件由 worker 轉發回主行程發佈。
+    """
+    def publish(event_type: str, data: dict):
+        task_events.publish(task_id, event_type, data)
     
-    # 模擬人類行為 - 隨機等待
-    await HumanBehavior.random_mouse_movement()
+    if worker_pool.enabled:
+        try:
+            return await worker_pool.run(
+                {
+                    "request": request.model_dump(),
+                    "browser_config": browser_config,
+                    "task_id": task_id,
+                    "resume": resume,
+                    "checkpoint_id": checkpoint_id,
+                    "trace": current_context(),
+                },
+                on_event=publish if task_id else None
+            )
+        except RemoteTaskError as e:
+            raise AttemptFailed(e.error_type, e.message, **e.details) from e
+    return await run_and_serialize(
+        request, browser_config, task_id, publish, resume, checkpoint_id, current_context()
+    )
+
+async def run_in_worker(payload: dict, emit) -> dict:
+    """worker 行程中執行任務的函數（見 worker_pool.py）"""
+    return await run_and_serialize(
+        AgentTaskRequest(**payload["request"]),
+        payload["browser_config"],
+        payload["task_id"],
+        emit,
+        payload.get("resume"),
+        payload.get("checkpoint_id"),
+        payload.get("trace")
+    )
+
+@asynccontextmanager
+async def worker_lifespan():
+    """worker 行程啟動時預熱（LLM 客戶端與瀏覽器池），完成後才回報就緒，結束時釋放"""
+    startup_report.require(PREWARM_CHECKS)
+    await prewarm()
+    yield startup_report.report()
+    await browser_pool.stop()
+    await llm_call_cache.close()
+
+async def run_queued_task(task_id: str, request: dict) -> dict:
+    """任務佇列 worker 的執行函數"""
+    try:
+        return await execute_agent_task(AgentTaskRequest(**request), task_id=task_id)
+    finally:
+        # 請求無法解析等未進入 execute_agent_task 的情況，移除取出時登錄的 TaskControl
+        control = task_controls.get(task_id)
+        if control is not None:
+            task_controls.unregister(control)
+
+def register_queued_task(task_id: str, request: dict):
+    """佇列取出任務時先登錄 TaskControl，標記為 running 後即可取消"""
+    task_controls.register(task_id, request.get("max_duration"))
+
+# 非同步任務佇列（TASK_QUEUE_BACKEND=memory|sqlite）
+task_queue = TaskQueue(executor=run_queued_task, on_start=register_queued_task)
+
+def pool_browser_counts() -> dict:
+    pool = browser_pool.get_metrics()
+    return {("idle",): pool["idle"], ("busy",): pool["busy"], ("launching",): pool["launching"]}
+
+def queue_depths() -> dict:
+    return {
+        ("tasks",): task_queue.get_metrics()["queued"],
+        ("admission",): admission_controller.get_metrics()["queued"],
+        ("browser_pool",): browser_pool.get_metrics()["waiting"],
+        ("callbacks",): callback_dispatcher.get_metrics()["queued"],
+    }
+
+def browser_usage(field: str) -> dict:
+    return {(browser_id,): usage[field] for browser_id, usage in browser_pool.browser_usage().items()}
+
+# 狀態類指標在 GET /metrics 擷取時才計算
+ACTIVE_BROWSERS.set_function(pool_browser_counts)
+BROWSER_MEMORY.set_function(lambda: browser_usage("rss_bytes"))
+BROWSER_FDS.set_function(lambda: browser_usage("fds"))
+RUNNING_AGENTS.set_function(lambda: admission_controller.get_metrics()["active"])
+QUEUE_DEPTH.set_function(queue_depths)
+AVAILABLE_MEMORY.set_function(available_memory)
+SERVICE_READY.set_function(lambda: int(is_ready()))
 
 @app.get("/")
 async def root():
@@ -133,6 +761,110 @@ async def root():
         "features": ["反檢測配置", "代理支援", "人類行為模擬"]
     }
 
+@app.get("/livez")
+async def livez():
+    """
+    存活檢查：事件迴圈能回應即為存活，不檢查瀏覽器與 LLM，預熱期間也不會被判定為異常而重啟
+    """
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    就緒檢查：LLM 客戶端已建立且瀏覽器已實際啟動成功才回 200，否則 503；附啟動各階段耗時
+    """
+    report = startup_report.report()
+    report["ready"] = is_ready()
+    return FastJSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/metrics")
+async def prometheus_metrics(accept: Optional[str] = Header(None)):
+    """
+    Prometheus 擷取端點：各階段耗時分布、嘗試/重試/失敗次數、瀏覽器與佇列狀態、記憶體與 LLM 用量
+    （Accept 含 application/openmetrics-text 時以 OpenMetrics 格式輸出）
+    """
+    openmetrics = "application/openmetrics-text" in (accept or "")
+    return Response(
+        REGISTRY.render(openmetrics),
+        media_type=OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE
+    )
+
+@app.get("/api/pool/metrics")
+async def pool_metrics():
+    """
+    瀏覽器池指標：閒置/忙碌/啟動中數量、啟動延遲與各瀏覽器的記憶體用量
+    """
+    return browser_pool.get_metrics()
+
+def admission_rejected(e: AdmissionRejected) -> HTTPException:
+    """系統忙碌時的 429 回應，讓客戶端依 Retry-After 稍後重試"""
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def check_admission(request: AgentTaskRequest):
+    """等待佇列已滿時直接回應 429，讓客戶端稍後重試"""
+    try:
+        admission_controller.check()
+    except AdmissionRejected as e:
+        raise admission_rejected(e)
+
+def check_resume_from(request: AgentTaskRequest):
+    """resume_from 指定的檢查點不存在（已完成、已過期或 ID 錯誤）時回應 404"""
+    if request.resume_from and not checkpoint_store.exists(request.resume_from):
+        raise HTTPException(status_code=404, detail=f"找不到檢查點: {request.resume_from}")
+
+@app.get("/api/resources/metrics")
+async def resource_metrics():
+    """
+    各資源 profile 的任務數、攔截請求數、放行位元組、估計省下的位元組與平均頁面載入時間
+    """
+    return resource_stats.get_metrics()
+
+@app.get("/api/pacing/metrics")
+async def pacing_metrics():
+    """
+    網站限速指標：個別網站的速率設定、追蹤中的網站數與累計等待（多行程模式下只含主行程）
+    """
+    return site_limiter.get_metrics()
+
+@app.get("/api/state-cache/metrics")
+async def state_cache_metrics():
+    """
+    瀏覽器狀態快取：profile 與網站數、大小，以及沿用狀態與否的平均步驟數與傳輸量
+    """
+    return await asyncio.to_thread(state_cache.get_metrics)
+
+@app.get("/api/checkpoints/metrics")
+async def checkpoint_metrics():
+    """
+    檢查點數量與大小，以及從檢查點繼續的次數與省下的步驟數
+    """
+    return await asyncio.to_thread(checkpoint_store.get_metrics)
+
+@app.get("/api/workers/metrics")
+async def worker_metrics():
+    """
+    多行程模式下各 worker 的負載、完成數與重啟次數
+    """
+    return worker_pool.get_metrics()
+
+@app.get("/api/retry/metrics")
+async def retry_metrics():
+    """
+    重試預算與各失敗類型的次數
+    """
+    return retry_budget.get_metrics()
+
+@app.get("/api/admission/metrics")
+async def admission_metrics():
+    """
+    准入控制指標：目前上限、執行中/等待中/拒絕數
+    """
+    return admission_controller.get_metrics()
+
 @app.post("/api/run-agent")
 async def run_agent_task(request: AgentTaskRequest):
     """
@@ -140,88 +872,419 @@ async def run_agent_task(request: AgentTaskRequest):
     包含完整的反檢測和reCAPTCHA避免功能。
     任務完成後會自動回調到指定URL（如果提供）。
     """
-    print(f"接收到任務: {request.task}")
-    print(f"配置: 隱身={request.use_stealth}, 代理={request.use_proxy}, 無頭={request.headless}")
-    if request.callback_url:
-        print(f"回調URL: {request.callback_url}")
+    check_resume_from(request)
+    check_admission(request)
+    try:
+        return FastJSONResponse(await execute_agent_task(request))
+    except AdmissionRejected as e:
+        # 等待執行名額逾時
+        raise admission_rejected(e)
+
+@app.post("/api/tasks", status_code=202)
+async def submit_task(request: AgentTaskRequest):
+    """
+    將任務排入非同步佇列並立即回傳 task_id，
+    之後可透過 GET /api/tasks/{task_id} 查詢狀態與結果。
+    """
+    check_resume_from(request)
+    try:
+        record = await task_queue.submit(request.model_dump())
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     
-    response_data = None
+    print(f"任務已排入佇列: {record['task_id']}")
+    return {
+        "task_id": record["task_id"],
+        "status": record["status"],
+        "status_url": f"/api/tasks/{record['task_id']}"
+    }
+
+@app.get("/api/tasks/{task_id}")
+async def get_task(task_id: str):
+    """
+    查詢非同步任務的狀態與結果
+    """
+    record = await task_queue.get(task_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="找不到此任務")
+    return FastJSONResponse(record)
+
+@app.delete("/api/tasks/{task_id}")
+async def cancel_task(task_id: str):
+    """
+    取消任務：排隊中的任務直接標記為 cancelled；
+    執行中的任務會中止 agent、關閉瀏覽器 context 並釋放名額，回傳清理耗時
+    """
+    control = task_controls.get(task_id)
+    if control is not None:
+        control.cancel(REASON_CANCELLED)
+        try:
+            await asyncio.wait_for(control.finished.wait(), 60)
+        except asyncio.TimeoutError:
+            pass
+        response = control.response or {}
+        return {
+            "task_id": task_id,
+            "status": response.get("status", STATUS_CANCELLED),
+            "cleanup_seconds": round(control.cleanup_seconds, 3) if control.cleanup_seconds is not None else None,
+            "steps": response.get("steps"),
+        }
+    
+    record = await task_queue.get(task_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="找不到此任務")
+    was_queued = record["status"] == STATUS_QUEUED
+    if was_queued:
+        record = await task_queue.cancel(task_id)
+    if not was_queued or record["status"] != STATUS_CANCELLED:
+        raise HTTPException(status_code=409, detail=f"任務狀態為 {record['status']}，無法取消")
+    
+    callback_url = record["request"].get("callback_url")
+    if callback_url:
+        await send_callback(
+            callback_url,
+            record["result"],
+            record["request"].get("callback_timeout", 30),
+            record["request"].get("callback_retries", 3)
+        )
+    task_events.publish(task_id, STATUS_CANCELLED, record["result"])
+    task_events.close(task_id)
+    return {"task_id": task_id, "status": STATUS_CANCELLED, "cleanup_seconds": 0.0, "steps": 0}
+
+@app.get("/api/tasks/{task_id}/events")
+async def stream_task_events(task_id: str):
+    """
+    以 Server-Sent Events 串流非同步任務的進度，
+    每完成一個步驟推送一次 step 事件，最後推送 result 或 error 事件。
+    """
+    if await task_queue.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="找不到此任務")
+    
+    async def event_stream():
+        async for event in task_events.subscribe(task_id):
+            yield format_sse(event)
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/api/artifacts/metrics")
+async def artifact_metrics():
+    """
+    產出物儲存指標：存入次數、去重命中數與壓縮前後大小
+    """
+    return artifact_store.get_metrics()
+
+@app.get("/api/artifacts/{digest}")
+async def get_artifact(digest: str, range_header: Optional[str] = Header(None, alias="Range")):
+    """
+    依內容雜湊下載截圖或頁面快照，支援單一區段的 Range 請求
+    """
+    try:
+        data, meta = await asyncio.to_thread(artifact_store.get, digest)
+    except ArtifactNotFound:
+        raise HTTPException(status_code=404, detail="找不到此產出物")
     
-    for attempt in range(request.max_retries):
+    headers = {
+        "ETag": f'"{digest}"',
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    try:
+        byte_range = parse_range(range_header, len(data))
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+    
+    if byte_range is None:
+        return Response(content=data, media_type=meta["content_type"], headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(content=data[start:end + 1], status_code=206, media_type=meta["content_type"], headers=headers)
+
+@app.get("/api/traces/metrics")
+async def trace_metrics():
+    """
+    追蹤匯出指標：抽樣率、已匯出與匯出失敗的 trace 數
+    """
+    return trace_exporter.get_metrics()
+
+@app.get("/api/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """
+    取得已匯出的 trace（OTLP/JSON 格式，可匯入 Jaeger、Tempo 等工具）
+    """
+    try:
+        trace = await asyncio.to_thread(trace_exporter.load, trace_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="不合法的 trace ID")
+    if trace is None:
+        raise HTTPException(status_code=404, detail="找不到此 trace（未匯出或仍在寫入）")
+    return trace
+
+@app.post("/api/run-agent/stream")
+async def run_agent_stream(request: AgentTaskRequest):
+    """
+    執行任務並以 Server-Sent Events 即時推送每個步驟，
+    客戶端中途斷線時會取消任務，節省 LLM 與瀏覽器資源。
+    """
+    check_resume_from(request)
+    check_admission(request)
+    task_id = uuid.uuid4().hex
+    
+    async def event_stream():
+        run = asyncio.create_task(execute_agent_task(request, task_id=task_id))
+
+        def close_on_error(task: asyncio.Task):
+            # 任務在發佈結束事件前就拋出例外時，補送錯誤事件並結束串流，避免客戶端只收到心跳
+            if task.cancelled() or task.exception() is None or task_events.is_closed(task_id):
+                return
+            print(f"串流任務 {task_id} 發生未處理的錯誤: {task.exception()}")
+            task_events.publish(task_id, "error", {
+                "task_id": task_id,
+                "status": "error",
+                "message": str(task.exception()),
+                "timestamp": asyncio.get_event_loop().time()
+            })
+            task_events.close(task_id)
+
+        run.add_done_callback(close_on_error)
         try:
-            print(f"嘗試執行任務 (第 {attempt + 1} 次)")
-            
-            # 設置隱身環境
-            if request.use_stealth:
-                await setup_stealth_environment()
-            
-            # 獲取增強配置
-            browser_config = get_enhanced_config(
-                use_proxy=request.use_proxy,
-                headless=request.headless
+            async for event in task_events.subscribe(task_id):
+                yield format_sse(event)
+        finally:
+            if not run.done():
+                print(f"串流客戶端已斷線，取消任務 {task_id}")
+                run.cancel()
+                task_events.close(task_id)
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/api/callbacks/metrics")
+async def callback_metrics():
+    """
+    回調派送指標：延遲、嘗試次數與 dead letter 數量
+    """
+    return callback_dispatcher.get_metrics()
+
+@app.post("/api/callbacks/replay")
+async def replay_callbacks(delivery_id: Optional[str] = None):
+    """
+    重新派送寫入 dead letter 的回調（未指定 delivery_id 則全部重送）
+    """
+    replayed = await callback_dispatcher.replay_dead_letters(delivery_id)
+    return {"replayed": replayed}
+
+@app.get("/api/cache/metrics")
+async def cache_metrics():
+    """
+    結果快取指標：命中/未命中/合併次數與容量
+    """
+    return result_cache.get_metrics()
+
+@app.get("/api/llm/metrics")
+async def llm_metrics():
+    """
+    LLM 呼叫快取與限流指標
+    """
+    return await llm_call_cache.get_metrics()
+
+@app.get("/api/queue/metrics")
+async def task_queue_metrics():
+    """
+    任務佇列指標：排隊中/執行中任務數，以及取消/逾時次數與清理耗時
+    """
+    return {**task_queue.get_metrics(), "cancellation": task_controls.get_metrics()}
+
+@app.post("/api/run-batch")
+async def run_batch_task(batch: BatchTaskRequest):
+    """
+    批次執行多個任務，共用瀏覽器池與 LLM 客戶端。
+    stream=true 時每完成一個任務就以 NDJSON 輸出一行，最後一行為統計資料；
+    否則等整批完成後一次回傳。提供 callback_url 時整批只回調一次。
+    """
+    batch_id = uuid.uuid4().hex
+    concurrency = min(batch.concurrency, BATCH_MAX_CONCURRENCY)
+    print(f"接收到批次 {batch_id}: {len(batch.tasks)} 個任務，並行數 {concurrency}")
+    
+    async def run_item(index: int, request: AgentTaskRequest) -> dict:
+        return await execute_agent_task(request, task_id=f"{batch_id}-{index}")
+    
+    async def finish(results: list, stats: BatchStats) -> dict:
+        summary = {
+            "batch_id": batch_id,
+            "status": "completed",
+            "results": results,
+            "stats": stats.summary(),
+        }
+        if batch.callback_url:
+            await send_callback(
+                batch.callback_url,
+                summary,
+                batch.callback_timeout,
+                batch.callback_retries
             )
-            
-            print(f"使用瀏覽器配置: {browser_config}")
-            
-            agent = Agent(
-                task=request.task,
-                llm=llm,
-                use_vision=True,
-                browser_config=browser_config
+        return summary
+    
+    if batch.stream:
+        async def stream_results():
+            results = [None] * len(batch.tasks)
+            stats = BatchStats(len(batch.tasks))
+            async for item in iter_batch(batch.tasks, run_item, concurrency):
+                stats.record(item)
+                results[item["index"]] = item
+                yield dumps({"batch_id": batch_id, **item}) + b"\n"
+            summary = await finish(results, stats)
+            yield dumps({"batch_id": batch_id, "stats": summary["stats"]}) + b"\n"
+        
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+    
+    results = [None] * len(batch.tasks)
+    stats = BatchStats(len(batch.tasks))
+    async for item in iter_batch(batch.tasks, run_item, concurrency):
+        stats.record(item)
+        results[item["index"]] = item
+    
+    return FastJSONResponse(await finish(results, stats))
+
+async def execute_agent_task(request: AgentTaskRequest, task_id: Optional[str] = None) -> dict:
+    """
+    執行任務（含結果快取、重試與回調），同步 API、佇列 worker 與批次共用
+    
+    Args:
+        request: 任務請求
+        task_id: 非同步任務的 ID，會一併放入結果與回調中
+    """
+    cache_key = make_cache_key(
+        request.task,
+        {field: getattr(request, field) for field in CACHE_KEY_FIELDS}
+    )
+    # 等待快取或共用進行中的結果時也能取消；自己執行時由 run_with_retries 接手同一個 TaskControl
+    control = task_controls.register(task_id, request.max_duration)
+    control.waiter = asyncio.current_task()
+    response_data = None
+    
+    try:
+        try:
+            response_data, source = await result_cache.get_or_run(
+                cache_key,
+                request.cache,
+                lambda: run_with_retries(request, task_id, control)
             )
-            
-            # 添加執行前延遲
-            if request.use_stealth:
-                await HumanBehavior.random_delay(
-                    request.delay_range[0], 
-                    request.delay_range[1]
-                )
-            
-            result = await agent.run()
-            print(f"任務完成，結果: {result}")
-            
-            response_data = {
-                "status": "success", 
-                "task": request.task, 
-                "result": serialize_result(result),
-                "attempt": attempt + 1,
-                "config_used": {
-                    "stealth": request.use_stealth,
-                    "proxy": request.use_proxy,
-                    "headless": request.headless
-                },
+        except CacheMiss:
+            response_data, source = {
+                "task_id": task_id,
+                "status": "error",
+                "message": "快取中沒有此任務的結果（cache=only）",
                 "timestamp": asyncio.get_event_loop().time()
-            }
-            
-            # 發送回調（如果有指定URL）
-            if request.callback_url:
-                await send_callback(
-                    request.callback_url, 
-                    response_data,
-                    request.callback_timeout,
-                    request.callback_retries
-                )
-            
+            }, "miss"
+        except asyncio.CancelledError:
+            if not control.waiter_cancelled():
+                raise
+            response_data = await finish_interrupted(request, task_id, control, TaskInterrupted(REASON_CANCELLED), 0)
             return response_data
-            
-        except Exception as e:
-            print(f"第 {attempt + 1} 次嘗試失敗: {e}")
-            
-            if attempt < request.max_retries - 1:
-                # 重試前等待更長時間
-                wait_time = (attempt + 1) * 5  # 5, 10, 15 秒
-                print(f"等待 {wait_time} 秒後重試...")
-                await asyncio.sleep(wait_time)
-            else:
+        finally:
+            control.waiter = None
+        
+        if source == SOURCE_RUN:
+            return response_data
+        
+        # 快取命中或共用進行中的結果：換上本次的 task_id，並照常發送事件與回調
+        print(f"任務結果來自快取 ({source}): {request.task}")
+        response_data = {**response_data, "task_id": task_id, "cache": source}
+        if task_id:
+            task_events.publish(task_id, "result" if response_data["status"] == "success" else "error", response_data)
+            task_events.close(task_id)
+        if request.callback_url:
+            await send_callback(
+                request.callback_url,
+                response_data,
+                request.callback_timeout,
+                request.callback_retries
+            )
+        return response_data
+    finally:
+        if not control.finished.is_set():
+            task_controls.unregister(control, response_data)
+
+async def run_with_retries(request: AgentTaskRequest, task_id: Optional[str] = None, control=None) -> dict:
+    """
+    實際執行任務（含重試與回調）
+    
+    Args:
+        request: 任務請求
+        task_id: 非同步任務的 ID，會一併放入結果與回調中
+        control: 已登錄的 TaskControl（未指定時另行登錄）
+    """
+    print(f"接收到任務: {request.task}")
+    print(f"配置: 隱身={request.use_stealth}, 代理={request.use_proxy}, 無頭={request.headless}")
+    if request.callback_url:
+        print(f"回調URL: {request.callback_url}")
+    
+    if control is None:
+        control = task_controls.register(task_id, request.max_duration)
+    control.waiter = None
+    retry_budget.record_request()
+    task_started = time.perf_counter()
+    response_data = None
+    # 同步 API 的任務沒有 task_id，另外產生檢查點 ID
+    checkpoint_id = task_id or uuid.uuid4().hex
+    resume = {"checkpoint": request.resume_from} if request.resume_from else None
+    trace = Trace()
+    trace_token = activate(trace)
+    task_span = trace.start_span("task", task_id=checkpoint_id)
+    export_trace = request.trace or random.random() < trace_exporter.sample_rate
+    
+    try:
+        for attempt in range(request.max_retries):
+            try:
+                print(f"嘗試執行任務 (第 {attempt + 1} 次)")
+                if task_id:
+                    task_events.publish(task_id, "attempt", {"task_id": task_id, "attempt": attempt + 1})
+                
+                ATTEMPTS.inc()
+                attempt_started = time.perf_counter()
+                try:
+                    with trace.span("attempt", attempt=attempt + 1):
+                        run = await control.run(run_attempt(request, task_id, resume, checkpoint_id))
+                finally:
+                    PHASE_SECONDS.labels("attempt").observe(time.perf_counter() - attempt_started)
+                print(f"任務完成，共 {run['steps']} 個步驟")
+                if run.get("restored_steps"):
+                    checkpoint_store.record_resume(run["restored_steps"])
+                
+                # 用完步驟預算仍未完成，視同逾時
+                if not run["summary"].get("is_done") and run["steps"] >= request.max_steps:
+                    raise TaskInterrupted(REASON_MAX_STEPS, run)
+                
                 response_data = {
-                    "status": "error", 
-                    "message": str(e),
-                    "attempts": request.max_retries,
-                    "suggestion": "建議檢查網路連線、代理設定或增加延遲時間",
+                    "task_id": task_id,
+                    "status": "success", 
+                    "task": request.task, 
+                    "result": run["result"],
+                    "attempt": attempt + 1,
+                    "restored_steps": run.get("restored_steps", 0),
+                    "resources": run.get("resources"),
+                    "pacing": run.get("pacing"),
+                    "vision": run.get("vision"),
+                    "context": run.get("context"),
+                    "config_used": {
+                        "stealth": request.use_stealth,
+                        "proxy": request.use_proxy,
+                        "headless": request.headless
+                    },
+                    **trace_fields(trace, export_trace),
+                    "profile": run.get("profile"),
                     "timestamp": asyncio.get_event_loop().time()
                 }
                 
-                # 發送錯誤回調（如果有指定URL）
+                if task_id:
+                    task_events.publish(task_id, "result", {**run["summary"], "attempt": attempt + 1})
+                    task_events.close(task_id)
+                # 任務已完成，檢查點不再需要
+                await asyncio.to_thread(checkpoint_store.delete, checkpoint_id)
+                if request.resume_from:
+                    await asyncio.to_thread(checkpoint_store.delete, request.resume_from)
+                
+                # 發送回調（如果有指定URL）
                 if request.callback_url:
                     await send_callback(
                         request.callback_url, 
@@ -231,8 +1294,189 @@ async def run_agent_task(request: AgentTaskRequest):
                     )
                 
                 return response_data
+            
+            except TaskInterrupted as e:
+                response_data = await finish_interrupted(
+                    request, task_id, control, e, attempt, checkpoint_id, export_trace
+                )
+                return response_data
+                
+            except Exception as e:
+                rejected = isinstance(e, AdmissionRejected)
+                if rejected and task_id is None:
+                    # 同步 API 等待執行名額逾時：與佇列已滿時一樣回應 429，由客戶端稍後重試
+                    raise
+                failure = classify(e)
+                rule = DEFAULT_RULES[failure]
+                retry_budget.record_failure(failure)
+                ATTEMPT_FAILURES.labels(failure).inc()
+                print(f"第 {attempt + 1} 次嘗試失敗 ({failure}): {e}")
+                
+                # 等待名額逾時不在服務內退避重試（只會讓任務繼續佔著等待佇列），結果附上 retry_after
+                can_retry = not rejected and attempt < min(request.max_retries, rule.max_attempts) - 1
+                budget_exhausted = can_retry and not retry_budget.try_spend()
+                if budget_exhausted:
+                    print("全域重試預算已用完，不再重試")
+                
+                if can_retry and not budget_exhausted:
+                    RETRIES.labels(failure).inc()
+                    # 依失敗類型退避（含隨機抖動），LLM 要求的 Retry-After 優先
+                    wait_time = rule.delay(attempt + 1, parse_retry_after(e))
+                    if rule.resume:
+                        resume = {**(getattr(e, "resume", None) or resume or {}), "checkpoint": checkpoint_id}
+                    else:
+                        resume = None
+                    print(f"等待 {wait_time:.1f} 秒後重試..." + ("（從檢查點繼續）" if resume else ""))
+                    if await control.sleep(wait_time):
+                        response_data = await finish_interrupted(
+                            request, task_id, control, TaskInterrupted(control.reason), attempt, checkpoint_id,
+                            export_trace
+                        )
+                        return response_data
+                else:
+                    response_data = {
+                        "task_id": task_id,
+                        "status": "error", 
+                        "message": str(e),
+                        "failure": failure,
+                        "attempts": attempt + 1,
+                        "retry_budget_exhausted": budget_exhausted,
+                        **({"retry_after": e.retry_after} if rejected else {}),
+                        "checkpoint_id": checkpoint_id if checkpoint_store.exists(checkpoint_id) else None,
+                        "suggestion": "建議檢查網路連線、代理設定或增加延遲時間",
+                        **trace_fields(trace, export_trace),
+                        "timestamp": asyncio.get_event_loop().time()
+                    }
+                    
+                    if task_id:
+                        task_events.publish(task_id, "error", response_data)
+                        task_events.close(task_id)
+                    
+                    # 發送錯誤回調（如果有指定URL）
+                    if request.callback_url:
+                        await send_callback(
+                            request.callback_url, 
+                            response_data,
+                            request.callback_timeout,
+                            request.callback_retries
+                        )
+                    
+                    return response_data
+    finally:
+        task_controls.unregister(control, response_data)
+        TASKS.labels(response_data["status"] if response_data else "error").inc()
+        PHASE_SECONDS.labels("task").observe(time.perf_counter() - task_started)
+        task_span.finish()
+        deactivate(trace_token)
+        if export_trace:
+            trace_exporter.submit(trace)
+
+
+def trace_fields(trace: Trace, exported: bool) -> dict:
+    """回應中的追蹤欄位：各階段耗時彙整、trace ID，匯出時另附查詢網址"""
+    fields = {"timings": trace.timings(), "trace_id": trace.trace_id}
+    if exported:
+        fields["trace_url"] = f"/api/traces/{trace.trace_id}"
+    return fields
+
+async def run_attempt(
+    request: AgentTaskRequest,
+    task_id: Optional[str],
+    resume: Optional[dict] = None,
+    checkpoint_id: Optional[str] = None
+) -> dict:
+    """單次嘗試：準備瀏覽器配置，取得執行名額後執行 agent（節奏由各步驟前的網站限速控制）"""
+    # 沿用 state_profile 保存的瀏覽器狀態
+    profile_state = None
+    if request.state_profile:
+        # 預熱池的瀏覽器只注入 cookie 與 localStorage，不保留也不計入使用者資料目錄的 HTTP 快取
+        profile_state = await asyncio.to_thread(
+            state_cache.prepare, request.state_profile, request.task, not browser_pool.accepts(request.headless)
+        )
+    
+    try:
+        # 獲取增強配置
+        browser_config = get_enhanced_config(
+            use_proxy=request.use_proxy,
+            headless=request.headless,
+            storage_state=profile_state["storage_state"] if profile_state else None,
+            user_data_dir=profile_state["user_data_dir"] if profile_state else None,
+            slow_mo=slow_mo_for(resolve_profile(request.execution_profile))
+        )
+    
+        # cookie 內容不寫入記錄
+        print(f"使用瀏覽器配置: { {key: value for key, value in browser_config.items() if key != 'storage_state'} }")
+    
+        admission_started = time.time()
+        async with admission_controller.slot(request.priority):
+            admitted = time.time()
+            record_span("admission_wait", admission_started, admitted)
+            PHASE_SECONDS.labels("admission_wait").observe(admitted - admission_started)
+            run = await execute_run(request, browser_config, task_id, resume, checkpoint_id)
+    finally:
+        if profile_state:
+            state_cache.release(profile_state["user_data_dir"])
+    trace = current_trace()
+    if trace is not None and run.get("spans"):
+        trace.merge(run["spans"])
+    record_run_metrics(run)
+    if run.get("resources"):
+        run["resources"] = resource_stats.annotate(run["resources"])
+    if profile_state and not run["interrupted"]:
+        state_cache.record_run(
+            profile_state["warm"],
+            run["steps"],
+            run["network"]["transferred_bytes"],
+            run["network"]["cached_bytes"]
+        )
+    return run
+
+async def finish_interrupted(
+    request: AgentTaskRequest,
+    task_id: Optional[str],
+    control,
+    interrupted: TaskInterrupted,
+    attempt: int,
+    checkpoint_id: Optional[str] = None,
+    export_trace: bool = False
+) -> dict:
+    """任務被取消或超過預算：回傳部分結果，並照常發送事件與回調"""
+    status = STATUS_CANCELLED if interrupted.reason == REASON_CANCELLED else STATUS_TIMEOUT
+    partial = interrupted.partial
+    print(f"任務已中止 ({interrupted.reason})，已完成 {partial['steps'] if partial else 0} 個步驟")
+    
+    response_data = {
+        "task_id": task_id,
+        "status": status,
+        "reason": interrupted.reason,
+        "task": request.task,
+        "partial": True,
+        "result": partial["result"] if partial else None,
+        "steps": partial["steps"] if partial else 0,
+        "attempt": attempt + 1,
+        "cleanup_seconds": round(control.cleanup_seconds, 3) if control.cleanup_seconds is not None else None,
+        "checkpoint_id": checkpoint_id if checkpoint_id and checkpoint_store.exists(checkpoint_id) else None,
+        **(trace_fields(current_trace(), export_trace) if current_trace() else {}),
+        "timestamp": asyncio.get_event_loop().time()
+    }
+    
+    if task_id:
+        task_events.publish(task_id, status, response_data)
+        task_events.close(task_id)
+    
+    if request.callback_url:
+        await send_callback(
+            request.callback_url,
+            response_data,
+            request.callback_timeout,
+            request.callback_retries
+        )
+    
+    return response_data
+
 
 
+startup_report.mark("import")
 
 # 如果您想直接運行這個 API 檔案
 if __name__ == "__main__":
@@ -0,0 +1,296 @@
+"""
+內容定址的產出物儲存模組
+截圖與頁面快照以 SHA-256 雜湊去重後存放（本地磁碟或 S3 相容儲存），
+結果與回調中只保留雜湊與下載 URL
+"""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+import zlib
+from typing import Dict, Optional, Tuple
+
+# 已壓縮過的格式不再重複壓縮
+COMPRESSED_TYPES = ('image/png', 'image/jpeg', 'image/webp', 'image/gif', 'application/gzip')
+
+
+def sniff_content_type(data: bytes) -> str:
+    """由檔頭判斷內容類型"""
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    if data.startswith(b'\x1f\x8b'):
+        return 'application/gzip'
+    head = data[:64].lstrip()
+    if head.startswith((b'{', b'[')):
+        return 'application/json'
+    if head.startswith(b'<'):
+        return 'text/html'
+    return 'application/octet-stream'
+
+
+class ArtifactNotFound(Exception):
+    """找不到指定雜湊的產出物"""
+
+
+class LocalArtifactStore:
+    """
+    本地磁碟產出物儲存
+
+    檔案依雜湊前兩碼分目錄存放，旁邊的 .json 記錄內容類型、原始大小與是否壓縮；
+    .json 在內容就位後才寫入，有 .json 即表示產出物完整可讀。
+    每次讀取會更新檔案修改時間，淘汰時依最久未使用的順序刪除。
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None, max_age: Optional[float] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+        self._stats = {'puts': 0, 'dedup_hits': 0, 'stored_bytes': 0, 'raw_bytes': 0, 'evicted': 0}
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes, content_type: Optional[str] = None) -> Dict:
+        """存入產出物，內容相同時直接沿用既有檔案"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        self._stats['puts'] += 1
+        try:
+            meta = self._meta(digest)
+            os.utime(path)
+            self._stats['dedup_hits'] += 1
+            return meta
+        except FileNotFoundError:
+            pass
+
+        content_type = content_type or sniff_content_type(data)
+        payload, compressed = data, False
+        if content_type not in COMPRESSED_TYPES:
+            packed = zlib.compress(data, 6)
+            if len(packed) < len(data) * 0.9:
+                payload, compressed = packed, True
+
+        meta = {
+            'hash': digest,
+            'content_type': content_type,
+            'size': len(data),
+            'stored_size': len(payload),
+            'compressed': compressed,
+            'created_at': time.time(),
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 暫存檔名各自獨立，多個執行緒同時存入相同內容時不會互相覆寫或搬走對方的暫存檔
+        suffix = f"{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        with open(f"{path}.{suffix}", 'wb') as f:
+            f.write(payload)
+        os.replace(f"{path}.{suffix}", path)
+        with open(f"{path}.json.{suffix}", 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.json.{suffix}", f"{path}.json")
+
+        self._stats['stored_bytes'] += len(payload)
+        self._stats['raw_bytes'] += len(data)
+        return meta
+
+    def get(self, digest: str) -> Tuple[bytes, Dict]:
+        """讀取產出物（已解壓縮）與其中繼資料"""
+        path = self._path(digest)
+        if not _is_hex_digest(digest):
+            raise ArtifactNotFound(digest)
+        try:
+            meta = self._meta(digest)
+            with open(path, 'rb') as f:
+                payload = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            raise ArtifactNotFound(digest)
+        return (zlib.decompress(payload) if meta['compressed'] else payload), meta
+
+    def _meta(self, digest: str) -> Dict:
+        with open(f"{self._path(digest)}.json", encoding='utf-8') as f:
+            return json.load(f)
+
+    def evict(self) -> int:
+        """刪除超過保存期限的產出物，並依最久未使用順序刪到總大小低於上限"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if _is_hex_digest(name):
+                    stat = os.stat(os.path.join(dirpath, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, digest in entries:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            oversize = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or oversize):
+                continue
+            # 先刪 .json，讀取端不會看到有中繼資料卻沒有內容的產出物
+            for path in (f"{self._path(digest)}.json", self._path(digest)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+
+        self._stats['evicted'] += removed
+        return removed
+
+    def get_metrics(self) -> Dict:
+        return {'backend': 'local', 'root': self.root, **self._stats}
+
+
+class S3ArtifactStore:
+    """
+    S3 相容儲存（例如 MinIO）
+
+    保存期限請以 bucket 的 lifecycle 規則設定，evict() 不做任何事。
+    """
+
+    def __init__(self, bucket: str, prefix: str = 'artifacts/', endpoint_url: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = boto3.client('s3', endpoint_url=endpoint_url)
+        self._stats = {'puts': 0, 'dedup_hits': 0, 'stored_bytes': 0, 'raw_bytes': 0, 'evicted': 0}
+
+    def _key(self, digest: str) -> str:
+        return f"{self.prefix}{digest}"
+
+    def put(self, data: bytes, content_type: Optional[str] = None) -> Dict:
+        digest = hashlib.sha256(data).hexdigest()
+        self._stats['puts'] += 1
+        try:
+            head = self._client.head_object(Bucket=self.bucket, Key=self._key(digest))
+            self._stats['dedup_hits'] += 1
+            return self._meta_from_head(digest, head)
+        except self._client.exceptions.ClientError:
+            pass
+
+        content_type = content_type or sniff_content_type(data)
+        payload, compressed = data, False
+        if content_type not in COMPRESSED_TYPES:
+            packed = zlib.compress(data, 6)
+            if len(packed) < len(data) * 0.9:
+                payload, compressed = packed, True
+
+        self._client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(digest),
+            Body=payload,
+            ContentType=content_type,
+            Metadata={'size': str(len(data)), 'compressed': '1' if compressed else '0'},
+        )
+        self._stats['stored_bytes'] += len(payload)
+        self._stats['raw_bytes'] += len(data)
+        return {'hash': digest, 'content_type': content_type, 'size': len(data),
+                'stored_size': len(payload), 'compressed': compressed}
+
+    def get(self, digest: str) -> Tuple[bytes, Dict]:
+        if not _is_hex_digest(digest):
+            raise ArtifactNotFound(digest)
+        try:
+            obj = self._client.get_object(Bucket=self.bucket, Key=self._key(digest))
+        except self._client.exceptions.NoSuchKey:
+            raise ArtifactNotFound(digest)
+        meta = self._meta_from_head(digest, obj)
+        payload = obj['Body'].read()
+        return (zlib.decompress(payload) if meta['compressed'] else payload), meta
+
+    def _meta_from_head(self, digest: str, head: Dict) -> Dict:
+        metadata = head.get('Metadata', {})
+        return {
+            'hash': digest,
+            'content_type': head.get('ContentType', 'application/octet-stream'),
+            'size': int(metadata.get('size', head.get('ContentLength', 0))),
+            'compressed': metadata.get('compressed') == '1',
+        }
+
+    def evict(self) -> int:
+        return 0
+
+    def get_metrics(self) -> Dict:
+        return {'backend': 's3', 'bucket': self.bucket, **self._stats}
+
+
+def _is_hex_digest(value: str) -> bool:
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def create_artifact_store():
+    """依環境變數建立產出物儲存（ARTIFACT_BACKEND=local|s3）"""
+    backend = os.getenv('ARTIFACT_BACKEND', 'local')
+    if backend == 's3':
+        return S3ArtifactStore(
+            bucket=os.environ['ARTIFACT_S3_BUCKET'],
+            prefix=os.getenv('ARTIFACT_S3_PREFIX', 'artifacts/'),
+            endpoint_url=os.getenv('ARTIFACT_S3_ENDPOINT'),
+        )
+    if backend == 'local':
+        max_mb = os.getenv('ARTIFACT_MAX_MB', '2048')
+        max_age_hours = os.getenv('ARTIFACT_MAX_AGE_HOURS', '72')
+        return LocalArtifactStore(
+            root=os.getenv('ARTIFACT_DIR', 'artifacts'),
+            max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else None,
+            max_age=float(max_age_hours) * 3600 if max_age_hours else None,
+        )
+    raise ValueError(f"不支援的產出物儲存後端: {backend}")
+
+
+def artifact_blob_sink(store, base_url: str = ''):
+    """
+    建立給 ResultSerializer 使用的 blob_sink，二進位資料存入產出物儲存並回傳參照
+
+    Args:
+        store: 產出物儲存
+        base_url: 下載 URL 前綴（例如對外的服務網址），預設為相對路徑
+    """
+    def sink(data: bytes, field: str) -> Dict:
+        meta = store.put(data)
+        return {
+            '$artifact': meta['hash'],
+            'content_type': meta['content_type'],
+            'size': meta['size'],
+            'url': f"{base_url}/api/artifacts/{meta['hash']}",
+        }
+    return sink
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析單一區段的 HTTP Range 標頭
+
+    Returns:
+        (start, end) 含兩端；標頭不存在回傳 None；區段無效時拋出 ValueError
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        raise ValueError(header)
+    start_text, _, end_text = spec.strip().partition('-')
+    if start_text:
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    else:
+        # bytes=-N 表示最後 N 個位元組
+        start = max(0, size - int(end_text))
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
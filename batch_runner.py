@@ -0,0 +1,87 @@
+"""
+批次任務執行模組
+在並行上限內排程多個任務，依完成順序逐一產出結果並統計吞吐量
+"""
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Sequence
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """計算百分位數（最近排名法），values 為空時回傳 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+async def iter_batch(
+    items: Sequence[Any],
+    executor: Callable[[int, Any], Awaitable[Dict]],
+    concurrency: int,
+) -> AsyncIterator[Dict]:
+    """
+    以有上限的並行度執行批次任務，依完成順序產出結果
+
+    Args:
+        items: 任務列表
+        executor: 執行單一任務的協程函數，接收 (index, item) 並回傳結果字典
+        concurrency: 同時執行的任務數上限
+
+    Yields:
+        {'index': 原始順序, 'duration': 執行秒數, 'result': 結果字典}
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(index: int, item: Any) -> Dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await executor(index, item)
+            except Exception as e:
+                result = {'status': 'error', 'message': str(e)}
+            return {
+                'index': index,
+                'duration': round(time.perf_counter() - start, 3),
+                'result': result,
+            }
+
+    tasks = [asyncio.create_task(run_one(i, item)) for i, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # 呼叫端中途停止迭代（例如串流客戶端斷線）時取消剩餘任務
+        for task in tasks:
+            task.cancel()
+
+
+class BatchStats:
+    """批次吞吐量統計"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.started_at = time.perf_counter()
+        self.durations: List[float] = []
+        self.status_counts: Dict[str, int] = {}
+
+    def record(self, item: Dict):
+        self.durations.append(item['duration'])
+        status = item['result'].get('status', 'error')
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def summary(self) -> Dict:
+        elapsed = time.perf_counter() - self.started_at
+        completed = len(self.durations)
+        return {
+            'total': self.total,
+            'completed': completed,
+            'status_counts': dict(self.status_counts),
+            'wall_seconds': round(elapsed, 3),
+            'tasks_per_minute': round(completed / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            'duration_p50': percentile(self.durations, 50),
+            'duration_p95': percentile(self.durations, 95),
+            'duration_avg': round(sum(self.durations) / completed, 3) if completed else 0.0,
+        }
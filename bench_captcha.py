@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+驗證碼檢測效能測試
+
+在本地產生的測試頁（一般頁面與含驗證碼元素的挑戰頁）上比較
+舊版逐一 page.query_selector_all 的檢測與新版單次 page.evaluate 的檢測延遲，
+並量測監看模式從元素出現到收到回報的時間
+
+用法:
+    python bench_captcha.py [次數]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from playwright.async_api import async_playwright
+
+from captcha_handler import CaptchaHandler
+
+# 一般頁面：約 2000 個元素，沒有驗證碼
+PLAIN_PAGE = '<html><body>' + ''.join(
+    f'<div class="item item-{i}"><a href="/item/{i}">商品 {i}</a><span class="price">{i * 10}</span></div>'
+    for i in range(700)
+) + '</body></html>'
+
+# 挑戰頁：一般頁面加上 reCAPTCHA 與 Cloudflare 挑戰元素
+CHALLENGE_PAGE = PLAIN_PAGE.replace(
+    '<body>',
+    '<body><div id="cf-challenge-running"></div><div class="g-recaptcha" data-sitekey="x"></div>',
+)
+
+
+async def legacy_detect(handler: CaptchaHandler, page):
+    """舊版 detect_captcha：每個 selector 一次 CDP 往返"""
+    detected = []
+    for challenge_type, selector in handler.registry.entries:
+        elements = await page.query_selector_all(selector)
+        if elements:
+            detected.append({'type': challenge_type, 'selector': selector, 'count': len(elements)})
+    return {'has_captcha': bool(detected), 'captchas': detected}
+
+
+async def measure(func, iterations: int):
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'median_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)], 3),
+    }
+
+
+async def measure_watch(handler: CaptchaHandler, page, iterations: int):
+    """監看模式：插入挑戰元素到收到回報的延遲（含 50 毫秒的合併等待）"""
+    received = asyncio.Queue()
+    await handler.watch(page, lambda result: received.put_nowait(time.perf_counter()))
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await page.evaluate(
+            "(i) => { const el = document.createElement('div'); el.className = 'h-captcha'; el.id = 'c' + i; document.body.appendChild(el); }",
+            i,
+        )
+        latencies.append((await asyncio.wait_for(received.get(), 5) - start) * 1000)
+    return {'median_ms': round(statistics.median(latencies), 3), 'max_ms': round(max(latencies), 3)}
+
+
+async def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    handler = CaptchaHandler()
+    print(f"selector 數: {len(handler.registry.entries)}，每種情境 {iterations} 次")
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(headless=True)
+        page = await browser.new_page()
+        for label, html in (('一般頁面', PLAIN_PAGE), ('挑戰頁', CHALLENGE_PAGE)):
+            await page.set_content(html)
+            legacy = await legacy_detect(handler, page)
+            batched = await handler.detect_captcha(page)
+            assert legacy['captchas'] == batched['captchas'], (legacy, batched)
+            legacy_stats = await measure(lambda: legacy_detect(handler, page), iterations)
+            batched_stats = await measure(lambda: handler.detect_captcha(page), iterations)
+            print(f"{label}: 偵測到 {len(batched['captchas'])} 種元素")
+            print(f"  逐一查詢  中位數 {legacy_stats['median_ms']:8.3f} ms   p95 {legacy_stats['p95_ms']:8.3f} ms")
+            print(f"  單次比對  中位數 {batched_stats['median_ms']:8.3f} ms   p95 {batched_stats['p95_ms']:8.3f} ms")
+            print(f"  加速 {legacy_stats['median_ms'] / batched_stats['median_ms']:.1f}x")
+
+        watch_page = await browser.new_page()
+        await watch_page.set_content(PLAIN_PAGE)
+        watch_stats = await measure_watch(handler, watch_page, min(iterations, 50))
+        print(f"監看模式: 元素出現到回報 中位數 {watch_stats['median_ms']:.3f} ms，最大 {watch_stats['max_ms']:.3f} ms")
+        await browser.close()
+
+    print(f"累計指標: {handler.get_metrics()}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
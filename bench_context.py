@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+上下文壓縮效能測試
+
+以 browser-use 的訊息格式產生 N 個步驟的長任務（系統提示、逐步成長的 <agent_history>、
+頁面元素清單、每隔幾步一次的大段擷取內容，以及目前的截圖；與 agent_api 建立的 Agent 相同，
+images_per_step 為 1，每步只送目前的截圖），
+送進只計算 token 並依 token 數延遲的假 LLM，比較不壓縮與壓縮後每一步的輸入 token 與延遲
+
+用法:
+    python bench_context.py [--steps 步驟數] [--ms-per-1k 每千 token 延遲毫秒]
+"""
+
+import argparse
+import asyncio
+import base64
+import statistics
+import struct
+import time
+
+from browser_use.agent.message_manager.views import HistoryItem
+from browser_use.llm.messages import ContentPartImageParam, ContentPartTextParam, ImageURL, SystemMessage, UserMessage
+
+from context_compaction import ContextCompactor
+from llm_cache import estimate_tokens
+
+# Agent 預設的 max_history_items：超過時保留第一項與最近的項目，中間直接省略
+MAX_HISTORY_ITEMS = 40
+
+SYSTEM_PROMPT = 'You are a browser automation agent. ' + 'Follow the rules for each action carefully. ' * 250
+
+# 頁面元素清單（約 4000 token）
+BROWSER_STATE = 'Current tab: 0\nAvailable tabs:\nTab 0: https://shop.example.com/list\n' + '\n'.join(
+    f'[{i}]<a href="/item/{i}">商品 {i} 價格 {i * 10} 元 /></a>' for i in range(400)
+)
+
+# 只有標頭的假 PNG（1280x1100），估算時以實際尺寸計算影像 token
+SCREENSHOT = base64.b64encode(b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\rIHDR' + struct.pack('>II', 1280, 1100)).decode()
+
+
+def history_item(step: int) -> HistoryItem:
+    if step % 7 == 0:
+        return HistoryItem(step_number=step, error='Failed to click element: element is not visible')
+    if step % 5 == 0:
+        results = 'Action 1/1: Extracted page content:\n' + '\n'.join(
+            f'商品 {step}-{i}: 規格說明與評價摘要，價格 {i * 10} 元' for i in range(120)
+        ) + '\n'
+    else:
+        results = f'Action 1/2: Clicked button with index {step}\nAction 2/2: Scrolled down the page by one page\n'
+    return HistoryItem(
+        step_number=step,
+        evaluation_previous_goal=f'Success - step {step - 1} reached the expected page.',
+        memory=f'Visited {step} pages so far; collected prices for {step * 3} items; next check page {step + 1}.',
+        next_goal=f'Open listing page {step + 1} and collect the remaining prices.',
+        action_results=f'Action Results:\n{results}',
+    )
+
+
+def build_history(items: list) -> str:
+    """與 browser-use MessageManager 相同的 max_history_items 處理"""
+    if len(items) <= MAX_HISTORY_ITEMS:
+        return '\n'.join(item.to_string() for item in items)
+    recent = items[-(MAX_HISTORY_ITEMS - 1):]
+    omitted = len(items) - MAX_HISTORY_ITEMS
+    return '\n'.join(
+        [items[0].to_string(), f'<sys>[... {omitted} previous steps omitted...]</sys>']
+        + [item.to_string() for item in recent]
+    )
+
+
+def build_messages(items: list, step: int) -> list:
+    state = (
+        f'<agent_history>\n{build_history(items)}\n</agent_history>\n'
+        f'<agent_state>\n<user_request>\n收集所有商品價格\n</user_request>\n<step_info>\nStep {step} of 100\n</step_info>\n</agent_state>\n'
+        f'<browser_state>\n{BROWSER_STATE}\n</browser_state>\n'
+        '<read_state>\n\n</read_state>\n'
+    )
+    image = ContentPartImageParam(image_url=ImageURL(url=f'data:image/png;base64,{SCREENSHOT}', media_type='image/png'))
+    content = [ContentPartTextParam(text=state), ContentPartTextParam(text='Current screenshot:'), image]
+    return [SystemMessage(content=SYSTEM_PROMPT), UserMessage(content=content)]
+
+
+class StubLLM:
+    """只計算輸入 token，並依 token 數延遲（模擬 prefill 時間）的假 LLM"""
+
+    model = 'stub'
+    provider = 'stub'
+    name = 'stub'
+
+    def __init__(self, ms_per_1k: float):
+        self.ms_per_1k = ms_per_1k
+        self.tokens = []
+
+    async def ainvoke(self, messages, output_format=None):
+        tokens = estimate_tokens(messages)
+        self.tokens.append(tokens)
+        await asyncio.sleep(tokens / 1000 * self.ms_per_1k / 1000)
+        return None
+
+
+async def run(steps: int, ms_per_1k: float, compactor: ContextCompactor):
+    llm = StubLLM(ms_per_1k)
+    model = compactor.wrap(llm)
+    items = [HistoryItem(step_number=0, system_message='Agent initialized')]
+    latencies = []
+    for step in range(1, steps + 1):
+        messages = build_messages(items, step)
+        start = time.perf_counter()
+        await model.ainvoke(messages)
+        latencies.append((time.perf_counter() - start) * 1000)
+        items.append(history_item(step))
+    return llm.tokens, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='上下文壓縮效能測試')
+    parser.add_argument('--steps', type=int, default=60, help='模擬的步驟數')
+    parser.add_argument('--ms-per-1k', type=float, default=5.0, help='假 LLM 每千 token 的延遲毫秒')
+    args = parser.parse_args()
+    steps, ms_per_1k = args.steps, args.ms_per_1k
+    print(f"{steps} 個步驟，假 LLM 每千 token 延遲 {ms_per_1k} ms")
+
+    baseline = ContextCompactor(enabled=False, max_tokens=0)
+    compacted = ContextCompactor()
+    base_tokens, base_latency = await run(steps, ms_per_1k, baseline)
+    new_tokens, new_latency = await run(steps, ms_per_1k, compacted)
+
+    print(f"{'步驟':>6} {'不壓縮 token':>14} {'壓縮 token':>12} {'不壓縮 ms':>11} {'壓縮 ms':>9}")
+    checkpoints = sorted({1, 5, 10, 20, 30, 40, 50, steps} | set(range(75, steps, 25)))
+    for step in (s for s in checkpoints if s <= steps):
+        i = step - 1
+        print(f"{step:>6} {base_tokens[i]:>14} {new_tokens[i]:>12} {base_latency[i]:>11.1f} {new_latency[i]:>9.1f}")
+
+    report = compacted.report()
+    print(f"總 token: 不壓縮 {sum(base_tokens)}，壓縮 {sum(new_tokens)}（減少 {1 - sum(new_tokens) / sum(base_tokens):.1%}）")
+    print(f"單步最大 token: 不壓縮 {max(base_tokens)}，壓縮 {max(new_tokens)}（上限 {report['max_tokens']}）")
+    print(f"後半段每步延遲中位數: 不壓縮 {statistics.median(base_latency[steps // 2:]):.1f} ms，"
+          f"壓縮 {statistics.median(new_latency[steps // 2:]):.1f} ms")
+    print(f"壓縮處理: 共 {report['processing_ms']} ms，平均每次 {report['processing_ms'] / steps:.2f} ms")
+    print(f"壓縮統計: {report}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
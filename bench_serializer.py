@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+結果序列化效能測試
+
+以模擬的大型 agent 執行紀錄（每步含 base64 截圖與 DOM 元素樹）比較
+舊版遞迴 serialize_result 與新版 ResultSerializer 從結果物件到 JSON 回應內容
+的總耗時與記憶體峰值
+
+用法:
+    python bench_serializer.py [--steps 步驟數]
+"""
+
+import argparse
+import base64
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+try:
+    from fastapi.encoders import jsonable_encoder
+except ImportError:
+    jsonable_encoder = None
+
+from artifact_store import LocalArtifactStore, artifact_blob_sink
+from result_serializer import dumps, serialize_result
+
+
+def legacy_serialize_result(obj):
+    """舊版 agent_api.serialize_result（逐層遞迴 __dict__）"""
+    if hasattr(obj, '__dict__'):
+        return {key: legacy_serialize_result(value) for key, value in obj.__dict__.items()}
+    elif isinstance(obj, list):
+        return [legacy_serialize_result(item) for item in obj]
+    elif isinstance(obj, dict):
+        return {key: legacy_serialize_result(value) for key, value in obj.items()}
+    elif isinstance(obj, (str, int, float, bool, type(None))):
+        return obj
+    else:
+        return str(obj)
+
+
+class Node:
+    """模擬 DOM 元素節點"""
+
+    def __init__(self, tag, depth, parent=None, fanout=3):
+        self.tag_name = tag
+        self.xpath = f"html/body/{'div/' * depth}{tag}"
+        self.attributes = {'class': f'item-{depth}', 'data-id': str(depth)}
+        self.parent = parent
+        self.children = [] if depth >= 4 else [Node('div', depth + 1, self, fanout) for _ in range(fanout)]
+
+
+class Step:
+    """模擬 AgentHistory"""
+
+    def __init__(self, index, screenshot, cyclic):
+        root = Node('body', 0)
+        if not cyclic:
+            _strip_parents(root)
+        self.model_output = {'action': [{'click_element_by_index': {'index': index}}]}
+        self.result = [{'is_done': False, 'extracted_content': f'step {index} ' * 20}]
+        self.state = {
+            'url': f'https://example.com/page/{index}',
+            'title': f'Page {index}',
+            'screenshot': screenshot,
+            'interacted_element': [root],
+        }
+        self.metadata = {'step_start_time': 1.0 * index, 'step_end_time': 1.0 * index + 0.5, 'step_number': index}
+
+
+class History:
+    def __init__(self, steps):
+        self.history = steps
+
+
+def _strip_parents(node):
+    node.parent = None
+    for child in node.children:
+        _strip_parents(child)
+
+
+def build_history(steps, cyclic):
+    # 每一步的截圖內容不同，模擬真實執行
+    return History([
+        Step(i, base64.b64encode(os.urandom(150_000)).decode(), cyclic) for i in range(steps)
+    ])
+
+
+def legacy_response_body(obj):
+    """舊版流程：遞迴轉換後再經 FastAPI 預設的 jsonable_encoder 與 json.dumps 編碼"""
+    data = legacy_serialize_result(obj)
+    if jsonable_encoder is not None:
+        data = jsonable_encoder(data)
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def measure(label, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        size = len(func())
+        error = None
+    except RecursionError:
+        size, error = 0, 'RecursionError'
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    status = error or f"{size / 1024 / 1024:.2f} MB"
+    print(f"{label:<42} {elapsed * 1000:>9.1f} ms {peak / 1024 / 1024:>9.1f} MB   {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='結果序列化效能測試')
+    parser.add_argument('--steps', type=int, default=30, help='模擬執行紀錄的步驟數')
+    steps = parser.parse_args().steps
+    print(f"模擬 {steps} 個步驟的執行紀錄")
+    print(f"{'情境':<40} {'耗時':>12} {'記憶體峰值':>10}   回應大小")
+
+    history = build_history(steps, cyclic=False)
+    with tempfile.TemporaryDirectory() as blob_dir:
+        sink = artifact_blob_sink(LocalArtifactStore(blob_dir))
+        measure("舊版 serialize_result", lambda: legacy_response_body(history))
+        measure("新版（截圖只保留摘要）", lambda: dumps(serialize_result(history)))
+        measure("新版（截圖寫到外部儲存）", lambda: dumps(serialize_result(history, blob_sink=sink)))
+        measure("新版 exclude=steps", lambda: dumps(serialize_result(history, exclude=['steps'])))
+
+        cyclic = build_history(steps, cyclic=True)
+        measure("舊版 serialize_result（含循環參照）", lambda: legacy_response_body(cyclic))
+        measure("新版（含循環參照）", lambda: dumps(serialize_result(cyclic, blob_sink=sink)))
+
+
+if __name__ == "__main__":
+    main()
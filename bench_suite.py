@@ -0,0 +1,686 @@
+#!/usr/bin/env python3
+"""
+端對端效能測試套件
+
+在本機啟動模擬網站（靜態頁面、延遲回應的搜尋頁、由 JavaScript 載入內容的動態頁與回調接收端），
+並以固定劇本的 ScriptedLLM 取代 Azure OpenAI 啟動 API 服務，不需外部網站與 LLM 即可量測
+從 API 請求到結果的完整流程（含瀏覽器池、agent 步驟、序列化與回調派送）。
+
+每個情境各自啟動一個 API 服務行程，回報延遲 p50/p95/p99、每分鐘完成任務數、
+服務行程樹（含 Chromium）的 RSS 峰值與 Chromium 行程數峰值，並與基準檔比較，
+任一指標退步超過容許範圍時以結束碼 1 結束。
+
+情境:
+    cold_start       不使用瀏覽器池，每個任務冷啟動瀏覽器（另回報服務啟動秒數）
+    warm_pool        預熱瀏覽器池，依序執行任務
+    concurrency      瀏覽器池大小與同時任務數 1、2、4、8 的掃描
+    large_results    步驟多、結果文字大的任務（另回報平均回應大小）
+    callback_storm   大量非同步任務同時回調，接收端每 N 次回傳一次 500（另回報回調送達率與延遲）
+
+用法:
+    python bench_suite.py [情境 ...] [--quick] [--baseline bench_baseline.json] [--update-baseline]
+                          [--tolerance 0.2] [--output 結果.json]
+
+第一次執行（或環境變更後）以 --update-baseline 建立基準檔，之後的執行會與其比較。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from batch_runner import percentile
+
+try:
+    import psutil
+except ImportError:  # psutil 為選用依賴，未安裝時改讀 /proc
+    psutil = None
+
+BASELINE_PATH = 'bench_baseline.json'
+
+# 指標方向與忽略的絕對差距（差距小於此值時不視為退步，避免極小數值的雜訊）
+METRICS: Dict[str, tuple] = {
+    'p50_s': ('lower', 0.05),
+    'p95_s': ('lower', 0.05),
+    'p99_s': ('lower', 0.05),
+    'tasks_per_min': ('higher', 0.5),
+    'success_rate': ('higher', 0.01),
+    'peak_rss_mb': ('lower', 20),
+    'peak_chromium': ('lower', 1),
+    'startup_s': ('lower', 0.2),
+    'ready_s': ('lower', 0.2),
+    'avg_response_kb': ('lower', 1),
+    'delivered_rate': ('higher', 0.01),
+    'callbacks_per_min': ('higher', 1),
+}
+
+SCENARIOS: Dict[str, Dict] = {
+    'cold_start': {'pool': 0, 'tasks': 5, 'concurrency': 1, 'pages': 2, 'scrolls': 1},
+    'warm_pool': {'pool': 2, 'tasks': 5, 'concurrency': 1, 'pages': 2, 'scrolls': 1},
+    'concurrency': {'levels': [1, 2, 4, 8], 'tasks_per_level': 2, 'pages': 2, 'scrolls': 1},
+    'large_results': {'pool': 2, 'tasks': 3, 'concurrency': 1, 'pages': 6, 'scrolls': 6, 'result_kb': 256},
+    'callback_storm': {'pool': 2, 'tasks': 100, 'fail_every': 10, 'pages': 1, 'scrolls': 0},
+}
+
+# --quick 時各情境的任務數上限
+QUICK_TASKS = 2
+
+
+# ---------------------------------------------------------------------------
+# 模擬網站
+# ---------------------------------------------------------------------------
+
+FIXTURE_CSS = ("body{font-family:bench,sans-serif;margin:0 auto;max-width:960px}"
+               ".card{border:1px solid #ccc;padding:8px;margin:8px 0}" * 20).encode('utf-8')
+FIXTURE_JS = b"""
+fetch('/api/items?page=1').then(r => r.json()).then(data => {
+    const feed = document.getElementById('feed');
+    for (const item of data.items) {
+        const div = document.createElement('div');
+        div.className = 'card';
+        div.innerHTML = `<a href="/item/${item.id}">${item.title}</a><p>${item.summary}</p>`;
+        feed.appendChild(div);
+    }
+    document.cookie = 'bench_seen=1; path=/';
+    localStorage.setItem('bench_feed', String(data.items.length));
+});
+"""
+FIXTURE_TRACKER_JS = b"window.dataLayer = window.dataLayer || [];"
+# 內容不具意義，只用來產生與真實網站相近的傳輸量
+FIXTURE_IMAGE = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 80
+FIXTURE_FONT = b'wOF2' + bytes(range(256)) * 120
+
+
+def _page(title: str, body: str) -> bytes:
+    images = ''.join(f'<img src="/static/img/{i}.png" alt="圖片 {i}" width="120">' for i in range(4))
+    return (
+        f'<!DOCTYPE html><html lang="zh-Hant"><head><meta charset="utf-8"><title>{title}</title>'
+        f'<link rel="stylesheet" href="/static/site.css">'
+        f'<link rel="preload" href="/static/bench.woff2" as="font" crossorigin>'
+        f'<script async src="/gtag/js?id=bench"></script></head><body>'
+        f'<nav><a href="/">首頁</a> <a href="/search?q=bench">搜尋</a></nav>'
+        f'<h1>{title}</h1>{images}{body}</body></html>'
+    ).encode('utf-8')
+
+
+def _item_body(item_id: int) -> str:
+    return ''.join(
+        f'<div class="card" id="c{i}"><h2>段落 {i}</h2><p>{f"項目 {item_id} 的說明文字 " * 30}</p>'
+        f'<button data-id="{i}">加入</button></div>'
+        for i in range(40)
+    )
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """模擬網站與回調接收端"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path, query = url.path, parse_qs(url.query)
+        static = {'Cache-Control': 'public, max-age=3600'}
+
+        if path == '/':
+            links = ''.join(f'<li><a href="/item/{i}">項目 {i}</a></li>' for i in range(1, 21))
+            body = _page('效能測試首頁', f'<ul>{links}</ul><div id="feed"></div><script src="/static/app.js"></script>')
+            self._send(200, body, 'text/html; charset=utf-8', {'Set-Cookie': 'bench_consent=1; Path=/; Max-Age=86400'})
+        elif path.startswith('/item/'):
+            item_id = int(path.rsplit('/', 1)[-1] or 0)
+            self._send(200, _page(f'項目 {item_id}', _item_body(item_id)), 'text/html; charset=utf-8')
+        elif path == '/search':
+            # 動態頁面：模擬後端查詢的延遲
+            time.sleep(self.server.search_delay)
+            keyword = query.get('q', [''])[0]
+            results = ''.join(f'<div class="card"><a href="/item/{i}">{keyword} 結果 {i}</a></div>' for i in range(1, 31))
+            self._send(200, _page(f'搜尋: {keyword}', results), 'text/html; charset=utf-8', {'Cache-Control': 'no-store'})
+        elif path == '/api/items':
+            page = int(query.get('page', ['1'])[0])
+            items = [
+                {'id': i, 'title': f'動態項目 {i}', 'summary': '由 JavaScript 載入的內容 ' * 5}
+                for i in range((page - 1) * 20 + 1, page * 20 + 1)
+            ]
+            self._send(200, json.dumps({'items': items}, ensure_ascii=False).encode('utf-8'), 'application/json')
+        elif path == '/static/site.css':
+            self._send(200, FIXTURE_CSS, 'text/css', static)
+        elif path == '/static/app.js':
+            self._send(200, FIXTURE_JS, 'application/javascript', static)
+        elif path.startswith('/static/img/'):
+            self._send(200, FIXTURE_IMAGE, 'image/png', static)
+        elif path == '/static/bench.woff2':
+            self._send(200, FIXTURE_FONT, 'font/woff2', {**static, 'Access-Control-Allow-Origin': '*'})
+        elif path == '/gtag/js':
+            self._send(200, FIXTURE_TRACKER_JS, 'application/javascript')
+        else:
+            self._send(404, b'not found', 'text/plain')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if urlsplit(self.path).path != '/callback':
+            self._send(404, b'not found', 'text/plain')
+            return
+        server = self.server
+        with server.lock:
+            server.callback_requests += 1
+            failing = server.fail_every and server.callback_requests % server.fail_every == 0
+            if not failing:
+                try:
+                    task_id = json.loads(body).get('task_id')
+                except ValueError:
+                    task_id = None
+                server.callbacks.setdefault(task_id, time.perf_counter())
+        if failing:
+            self._send(500, b'{"error": "simulated failure"}', 'application/json')
+        else:
+            self._send(200, b'{"ok": true}', 'application/json')
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fixture_site(search_delay: float = 0.3) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    server.daemon_threads = True
+    server.search_delay = search_delay
+    server.fail_every = 0
+    server.lock = threading.Lock()
+    server.callbacks = {}
+    server.callback_requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# 固定劇本的 LLM
+# ---------------------------------------------------------------------------
+
+_STEP_PATTERN = re.compile(r'Step (\d+) of \d+ max possible steps')
+_MARKER_PATTERN = re.compile(r'\[bench pages=(\d+) scrolls=(\d+) result_kb=(\d+)\]')
+_URL_PATTERN = re.compile(r'https?://[^\s<>"\]]+')
+
+
+def bench_task(base_url: str, pages: int = 2, scrolls: int = 1, result_kb: int = 0) -> str:
+    """ScriptedLLM 看得懂的任務描述"""
+    return f"稽核 {base_url} 的頁面 [bench pages={pages} scrolls={scrolls} result_kb={result_kb}]"
+
+
+def script_for(task: str) -> List[Dict]:
+    """
+    依任務描述產生每個步驟的動作：開啟首頁與 pages-1 個項目頁、開啟搜尋頁（動態）、
+    捲動 scrolls 次，最後以 done 回傳 result_kb KB 的結果文字
+    """
+    marker = _MARKER_PATTERN.search(task)
+    pages, scrolls, result_kb = (int(value) for value in marker.groups()) if marker else (1, 0, 0)
+    base = _URL_PATTERN.search(task).group(0).rstrip('/') if _URL_PATTERN.search(task) else 'about:blank'
+    actions = [{'go_to_url': {'url': f'{base}/', 'new_tab': False}}]
+    actions += [{'go_to_url': {'url': f'{base}/item/{i}', 'new_tab': False}} for i in range(1, pages)]
+    actions.append({'go_to_url': {'url': f'{base}/search?q=bench', 'new_tab': False}})
+    actions += [{'scroll': {'down': True, 'num_pages': 1.0}}] * scrolls
+    text = '稽核完成。' + '頁面內容摘要 ' * (result_kb * 1024 // 19)
+    actions.append({'done': {'text': text, 'success': True, 'files_to_display': []}})
+    return actions
+
+
+class ScriptedLLM:
+    """
+    符合 browser-use BaseChatModel 介面、不呼叫任何外部服務的 LLM
+
+    依提示中的 "Step N of M" 與任務描述中的 [bench ...] 標記決定第 N 步的動作，
+    同一個任務每次執行的步驟完全相同；不需要結構化輸出的呼叫（例如擷取頁面內容）回傳固定文字。
+    """
+
+    _verified_api_keys: bool = True
+
+    def __init__(self, think_time: float = 0.0):
+        self.model = 'scripted-bench'
+        self.think_time = think_time
+
+    @property
+    def provider(self) -> str:
+        return 'bench'
+
+    @property
+    def name(self) -> str:
+        return self.model
+
+    @property
+    def model_name(self) -> str:
+        return self.model
+
+    async def ainvoke(self, messages, output_format=None):
+        from browser_use.llm.views import ChatInvokeCompletion
+
+        if self.think_time:
+            await asyncio.sleep(self.think_time)
+        text = '\n'.join(str(getattr(message, 'text', '') or '') for message in messages)
+        if output_format is None:
+            return ChatInvokeCompletion(completion='模擬擷取的頁面內容', usage=None)
+
+        steps = _STEP_PATTERN.findall(text)
+        step = int(steps[-1]) if steps else 1
+        request = re.findall(r'<user_request>\s*(.*?)\s*</user_request>', text, re.S)
+        actions = script_for(request[-1] if request else text)
+        action = actions[min(step, len(actions)) - 1]
+        output = {
+            'evaluation_previous_goal': 'Success',
+            'memory': f'第 {step} 步，共 {len(actions)} 步',
+            'next_goal': next(iter(action)),
+            'action': [action],
+        }
+        if 'thinking' in output_format.model_fields:
+            output['thinking'] = ''
+        return ChatInvokeCompletion(completion=output_format.model_validate(output), usage=None)
+
+
+def serve(port: int):
+    """以 ScriptedLLM 啟動 API 服務（由 ServerProcess 在子行程中呼叫）"""
+    os.environ.setdefault('AZURE_OPENAI_API_KEY', 'bench')
+    os.environ.setdefault('AZURE_OPENAI_ENDPOINT', 'http://127.0.0.1')
+    import uvicorn
+    import agent_api
+
+    agent_api.llm = ScriptedLLM(float(os.getenv('BENCH_THINK_TIME', '0')))
+    uvicorn.run(agent_api.app, host='127.0.0.1', port=port, log_level='warning')
+
+
+# ---------------------------------------------------------------------------
+# 服務行程與資源取樣
+# ---------------------------------------------------------------------------
+
+def _process_tree(pid: int) -> List[tuple]:
+    """(名稱, RSS 位元組) 列表，含 pid 本身與所有子孫行程"""
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+        tree = []
+        for process in processes:
+            try:
+                tree.append((process.name(), process.memory_info().rss))
+            except psutil.Error:
+                pass
+        return tree
+
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+            except (OSError, ValueError, IndexError):
+                pass
+    tree, pending = [], [pid]
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/comm') as f:
+                name = f.read().strip()
+            with open(f'/proc/{current}/statm') as f:
+                rss = int(f.read().split()[1]) * page_size
+        except (OSError, ValueError, IndexError):
+            continue
+        tree.append((name, rss))
+        pending.extend(children.get(current, []))
+    return tree
+
+
+class ResourceSampler:
+    """背景執行緒定期取樣服務行程樹的 RSS 總和與 Chromium 行程數，保留峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_chromium = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            tree = _process_tree(self.pid)
+            self.peak_rss = max(self.peak_rss, sum(rss for _, rss in tree))
+            self.peak_chromium = max(
+                self.peak_chromium,
+                sum(1 for name, _ in tree if 'chrom' in name.lower() or 'headless_shell' in name.lower()),
+            )
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class ServerProcess:
+    """
+    在子行程中以 ScriptedLLM 啟動 API 服務，資料目錄放在暫存目錄，結束時一併清除
+
+    Args:
+        env: 覆寫的環境變數（例如 BROWSER_POOL_SIZE）
+    """
+
+    def __init__(self, env: Dict[str, str]):
+        self.env = env
+        self.port = None
+        self.process = None
+        self.sampler = None
+        self.startup_seconds = None
+        self.ready_seconds = None
+        self._workdir = None
+
+    def __enter__(self) -> 'ServerProcess':
+        self._workdir = tempfile.TemporaryDirectory(prefix='bench_')
+        work = self._workdir.name
+        env = {
+            **os.environ,
+            'AGENT_WORKERS': '0',
+            'BROWSER_POOL_HEADLESS': 'true',
+            'LLM_CACHE_MODE': 'off',
+            'TASK_QUEUE_BACKEND': 'memory',
+            'ARTIFACT_DIR': os.path.join(work, 'artifacts'),
+            'CALLBACK_SPOOL_DIR': os.path.join(work, 'callback_spool'),
+            'CHECKPOINT_DIR': os.path.join(work, 'checkpoints'),
+            'STATE_CACHE_DIR': os.path.join(work, 'browser_state'),
+            'PYTHONPATH': os.path.dirname(os.path.abspath(__file__)),
+            **self.env,
+        }
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+
+        started = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', str(self.port)],
+            env=env, cwd=work, stdout=subprocess.DEVNULL,
+        )
+        self.sampler = ResourceSampler(self.process.pid)
+        self.sampler.start()
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"API 服務啟動失敗（結束碼 {self.process.returncode}）")
+            # startup_s：開始監聽（/livez）；ready_s：預熱完成（/readyz）
+            try:
+                if self.startup_seconds is None and httpx.get(f'{self.url}/livez', timeout=1).status_code == 200:
+                    self.startup_seconds = time.perf_counter() - started
+                if self.startup_seconds is not None and httpx.get(f'{self.url}/readyz', timeout=1).status_code == 200:
+                    self.ready_seconds = time.perf_counter() - started
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError("API 服務在 120 秒內沒有就緒")
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.sampler.stop()
+        self._workdir.cleanup()
+
+
+# ---------------------------------------------------------------------------
+# 情境
+# ---------------------------------------------------------------------------
+
+def task_body(site_url: str, scenario: Dict, **overrides) -> Dict:
+    return {
+        'task': bench_task(site_url, scenario['pages'], scenario['scrolls'], scenario.get('result_kb', 0)),
+        'use_stealth': False,
+        'execution_profile': 'fast',
+        'headless': True,
+        'max_retries': 1,
+        'max_steps': scenario['pages'] + scenario['scrolls'] + 4,
+        'cache': 'bypass',
+        **overrides,
+    }
+
+
+async def run_tasks(server_url: str, body: Dict, tasks: int, concurrency: int) -> Dict:
+    """以 concurrency 個並行請求呼叫 /api/run-agent，回傳延遲與成功數"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, sizes, ok = [], [], 0
+
+    async def one(client):
+        nonlocal ok
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(f'{server_url}/api/run-agent', json=body)
+            latencies.append(time.perf_counter() - started)
+            sizes.append(len(response.content))
+            if response.status_code == 200 and response.json().get('status') == 'success':
+                ok += 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=None) as client:
+        await asyncio.gather(*(one(client) for _ in range(tasks)))
+    elapsed = time.perf_counter() - started
+    return {
+        'tasks': tasks,
+        'success_rate': round(ok / tasks, 3),
+        'p50_s': round(percentile(latencies, 50), 3),
+        'p95_s': round(percentile(latencies, 95), 3),
+        'p99_s': round(percentile(latencies, 99), 3),
+        'tasks_per_min': round(tasks / elapsed * 60, 2),
+        'avg_response_kb': round(sum(sizes) / len(sizes) / 1024, 1),
+    }
+
+
+def _with_resources(result: Dict, server: ServerProcess) -> Dict:
+    return {
+        **result,
+        'peak_rss_mb': round(server.sampler.peak_rss / 1024 / 1024, 1),
+        'peak_chromium': server.sampler.peak_chromium,
+    }
+
+
+def scenario_simple(name: str, scenario: Dict, site_url: str, quick: bool) -> Dict[str, Dict]:
+    tasks = min(scenario['tasks'], QUICK_TASKS) if quick else scenario['tasks']
+    with ServerProcess({'BROWSER_POOL_SIZE': str(scenario['pool'])}) as server:
+        result = asyncio.run(run_tasks(server.url, task_body(site_url, scenario), tasks, scenario['concurrency']))
+        result = _with_resources(result, server)
+        if name == 'cold_start':
+            result['startup_s'] = round(server.startup_seconds, 2)
+            result['ready_s'] = round(server.ready_seconds, 2)
+    return {name: result}
+
+
+def scenario_concurrency(scenario: Dict, site_url: str, quick: bool) -> Dict[str, Dict]:
+    results = {}
+    levels = scenario['levels'][:3] if quick else scenario['levels']
+    for level in levels:
+        env = {'BROWSER_POOL_SIZE': str(level), 'ADMISSION_MAX_CONCURRENCY': str(level)}
+        tasks = level * (1 if quick else scenario['tasks_per_level'])
+        with ServerProcess(env) as server:
+            result = asyncio.run(run_tasks(server.url, task_body(site_url, scenario), tasks, level))
+            results[f'concurrency_{level}'] = _with_resources(result, server)
+    return results
+
+
+async def _callback_storm(server_url: str, site, body: Dict, tasks: int) -> Dict:
+    async with httpx.AsyncClient(timeout=None) as client:
+        # 先執行一次讓結果進入快取，之後的任務由快取回應，壓力集中在回調派送
+        await client.post(f'{server_url}/api/run-agent', json=body)
+        callback_url = f'http://127.0.0.1:{site.server_address[1]}/callback'
+        submitted: Dict[str, float] = {}
+        started = time.perf_counter()
+        for _ in range(tasks):
+            response = await client.post(
+                f'{server_url}/api/tasks',
+                json={**body, 'callback_url': callback_url, 'callback_timeout': 5, 'callback_retries': 3},
+            )
+            if response.status_code == 202:
+                submitted[response.json()['task_id']] = time.perf_counter()
+
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            with site.lock:
+                if all(task_id in site.callbacks for task_id in submitted):
+                    break
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        dispatcher = (await client.get(f'{server_url}/api/callbacks/metrics')).json()
+
+    with site.lock:
+        delays = [site.callbacks[task_id] - at for task_id, at in submitted.items() if task_id in site.callbacks]
+        attempts = site.callback_requests
+    return {
+        'tasks': tasks,
+        'success_rate': round(len(submitted) / tasks, 3),
+        'delivered_rate': round(len(delays) / tasks, 3),
+        'p50_s': round(percentile(delays, 50), 3),
+        'p95_s': round(percentile(delays, 95), 3),
+        'p99_s': round(percentile(delays, 99), 3),
+        'callbacks_per_min': round(len(delays) / elapsed * 60, 1),
+        'callback_requests': attempts,
+        'dispatcher': dispatcher,
+    }
+
+
+def scenario_callback_storm(scenario: Dict, site, quick: bool) -> Dict[str, Dict]:
+    tasks = 20 if quick else scenario['tasks']
+    site.fail_every = scenario['fail_every']
+    with site.lock:
+        site.callbacks.clear()
+        site.callback_requests = 0
+    site_url = f'http://127.0.0.1:{site.server_address[1]}'
+    env = {'BROWSER_POOL_SIZE': str(scenario['pool']), 'TASK_QUEUE_WORKERS': '8', 'TASK_QUEUE_MAX_SIZE': str(tasks * 2)}
+    try:
+        with ServerProcess(env) as server:
+            body = task_body(site_url, scenario, cache='prefer')
+            result = asyncio.run(_callback_storm(server.url, site, body, tasks))
+            result = _with_resources(result, server)
+    finally:
+        site.fail_every = 0
+    return {'callback_storm': result}
+
+
+# ---------------------------------------------------------------------------
+# 基準比較
+# ---------------------------------------------------------------------------
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """回傳退步超過 tolerance（相對比例）的指標說明"""
+    regressions = []
+    for scenario, metrics in results.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        for metric, (direction, min_delta) in METRICS.items():
+            current, previous = metrics.get(metric), base.get(metric)
+            if current is None or previous is None:
+                continue
+            delta = current - previous if direction == 'lower' else previous - current
+            if delta > min_delta and delta > abs(previous) * tolerance:
+                regressions.append(f"{scenario}.{metric}: {previous} -> {current}")
+    return regressions
+
+
+def print_results(results: Dict[str, Dict], baseline: Dict[str, Dict]):
+    print(f"{'情境':<18} {'指標':<18} {'本次':>12} {'基準':>12}")
+    for scenario, metrics in results.items():
+        for metric in METRICS:
+            if metric not in metrics:
+                continue
+            previous = baseline.get(scenario, {}).get(metric)
+            print(f"{scenario:<20} {metric:<18} {metrics[metric]:>12} {'-' if previous is None else previous:>12}")
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--serve':
+        serve(int(sys.argv[2]))
+        return
+
+    parser = argparse.ArgumentParser(description='端對端效能測試套件')
+    parser.add_argument('scenarios', nargs='*', help=f"要執行的情境：{'、'.join(SCENARIOS)}（預設全部）")
+    parser.add_argument('--quick', action='store_true', help='縮小任務數，快速檢查')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='基準檔路徑')
+    parser.add_argument('--update-baseline', action='store_true', help='以本次結果覆寫基準檔中執行過的情境')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='容許的退步比例')
+    parser.add_argument('--output', help='另外將本次結果寫入此 JSON 檔')
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"不支援的情境: {', '.join(unknown)}")
+
+    site = start_fixture_site()
+    site_url = f'http://127.0.0.1:{site.server_address[1]}'
+    print(f"模擬網站: {site_url}，CPU 核心數 {os.cpu_count()}，psutil {'可用' if psutil else '未安裝（改讀 /proc）'}")
+
+    results: Dict[str, Dict] = {}
+    for name in args.scenarios or list(SCENARIOS):
+        scenario = SCENARIOS[name]
+        print(f"執行情境: {name}")
+        if name == 'concurrency':
+            results.update(scenario_concurrency(scenario, site_url, args.quick))
+        elif name == 'callback_storm':
+            results.update(scenario_callback_storm(scenario, site, args.quick))
+        else:
+            results.update(scenario_simple(name, scenario, site_url, args.quick))
+    site.shutdown()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({**baseline, **results}, f, ensure_ascii=False, indent=2)
+        print(f"已更新基準檔: {args.baseline}")
+        return
+
+    if not baseline:
+        print("沒有基準檔，略過比較（以 --update-baseline 建立）")
+        return
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"效能退步超過 {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("與基準相比沒有退步")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+多行程 worker 效能測試
+
+在本機啟動一個模擬網站，以 1 到 N 個 worker 行程執行相同數量的模擬任務，
+比較每分鐘完成的任務數。模擬任務不啟動瀏覽器也不呼叫 LLM，
+只重現每個步驟在 Python 端的工作：取得頁面、解析 DOM、序列化結果。
+
+用法:
+    python bench_workers.py [最多 worker 數] [任務數] [每個任務的步驟數]
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from result_serializer import dumps, serialize_result
+from worker_pool import WorkerPool
+
+MOCK_PAGE = ("<html><body>" + "".join(
+    f'<div class="card" id="c{i}"><a href="/item/{i}">項目 {i}</a><p>{"內容 " * 20}</p>'
+    f'<button data-id="{i}">加入</button></div>'
+    for i in range(300)
+) + "</body></html>").encode('utf-8')
+
+
+class MockSiteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(MOCK_PAGE)))
+        self.end_headers()
+        self.wfile.write(MOCK_PAGE)
+
+    def log_message(self, *args):
+        pass
+
+
+class DomBuilder(HTMLParser):
+    """把頁面解析成巢狀節點，模擬 DOM 處理"""
+
+    def __init__(self):
+        super().__init__()
+        self.root = {'tag': 'document', 'attrs': {}, 'children': []}
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        node = {'tag': tag, 'attrs': dict(attrs), 'children': []}
+        self.stack[-1]['children'].append(node)
+        self.stack.append(node)
+
+    def handle_endtag(self, tag):
+        if len(self.stack) > 1:
+            self.stack.pop()
+
+    def handle_data(self, data):
+        if data.strip():
+            self.stack[-1]['children'].append({'text': data.strip()})
+
+
+async def mock_run(payload: dict, emit) -> dict:
+    """worker 中執行的模擬任務"""
+    steps = []
+    async with httpx.AsyncClient() as client:
+        for step in range(payload['steps']):
+            html = (await client.get(payload['url'])).text
+            builder = DomBuilder()
+            builder.feed(html)
+            steps.append({'step': step, 'url': payload['url'], 'dom': builder.root})
+            emit('step', {'step': step})
+    return {'steps': len(steps), 'size': len(dumps(serialize_result(steps, exclude=['dom'])))}
+
+
+async def run_batch(workers: int, tasks: int, steps: int, url: str) -> float:
+    pool = WorkerPool(workers=workers, runner='bench_workers:mock_run', lifespan=None)
+    await pool.start()
+    try:
+        payload = {'url': url, 'steps': steps}
+        start = time.perf_counter()
+        await asyncio.gather(*(pool.run(payload) for _ in range(tasks)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await pool.stop()
+    return elapsed
+
+
+async def run_in_process(tasks: int, steps: int, url: str) -> float:
+    payload = {'url': url, 'steps': steps}
+    start = time.perf_counter()
+    await asyncio.gather(*(mock_run(payload, lambda *args: None) for _ in range(tasks)))
+    return time.perf_counter() - start
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    tasks = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    steps = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockSiteHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    print(f"模擬網站: {url}，{tasks} 個任務 × {steps} 個步驟，CPU 核心數 {os.cpu_count()}")
+    print(f"{'模式':<16} {'耗時':>10} {'任務/分鐘':>12} {'加速比':>8}")
+
+    baseline = asyncio.run(run_in_process(tasks, steps, url))
+    print(f"{'單一行程':<14} {baseline:>10.2f}s {tasks / baseline * 60:>12.1f} {1:>8.2f}")
+
+    workers = 1
+    while workers <= max_workers:
+        elapsed = asyncio.run(run_batch(workers, tasks, steps, url))
+        print(f"{f'{workers} 個 worker':<14} {elapsed:>10.2f}s {tasks / elapsed * 60:>12.1f} {baseline / elapsed:>8.2f}")
+        workers *= 2
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
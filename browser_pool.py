@@ -0,0 +1,431 @@
+"""
+瀏覽器預熱池模組
+預先啟動 Chromium，為每個任務提供獨立的 BrowserContext，
+避免每次請求都要付出完整的瀏覽器冷啟動成本
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from browser_watchdog import BROWSER_SWITCH, BrowserWatchdog
+from metrics import BROWSER_RECYCLES
+from stealth_config import StealthConfig, browser_process_model
+
+
+class PoolExhaustedError(Exception):
+    """瀏覽器池已滿且等待隊列也已滿（或等待逾時）"""
+
+
+class PooledBrowser:
+    """池中的單一瀏覽器實例"""
+
+    def __init__(self, browser, launch_latency: float, browser_id: Optional[str] = None):
+        self.id = browser_id or uuid.uuid4().hex[:8]
+        self.browser = browser
+        self.launch_latency = launch_latency
+        self.launched_at = time.time()
+        self.task_count = 0
+        # 記憶體監控：主行程 PID、啟動後的 RSS 基準、最近一次取樣與待回收的原因
+        self.pid: Optional[int] = None
+        self.baseline_rss: Optional[int] = None
+        self.usage: Optional[Dict] = None
+        self.recycle_reason: Optional[str] = None
+
+    def is_healthy(self) -> bool:
+        """瀏覽器是否仍然連線"""
+        try:
+            return self.browser.is_connected()
+        except Exception:
+            return False
+
+
+class BrowserLease:
+    """借出給單一任務的瀏覽器與其專屬 context"""
+
+    def __init__(self, pooled: PooledBrowser, context):
+        self.pooled = pooled
+        self.browser = pooled.browser
+        self.context = context
+
+
+class BrowserPool:
+    """
+    預先啟動的瀏覽器池
+
+    每個瀏覽器同一時間只服務一個任務，任務結束後關閉其 context；
+    瀏覽器在服務 N 個任務後、崩潰時，或記憶體 / 檔案描述元超過門檻、閒置記憶體持續成長時
+    會在任務之間被回收並重新啟動。
+    """
+
+    def __init__(
+        self,
+        size: Optional[int] = None,
+        max_tasks_per_browser: Optional[int] = None,
+        max_waiters: Optional[int] = None,
+        acquire_timeout: Optional[float] = None,
+        headless: Optional[bool] = None,
+        health_check_interval: Optional[float] = None,
+    ):
+        self.size = size if size is not None else int(os.getenv('BROWSER_POOL_SIZE', '2'))
+        self.max_tasks_per_browser = max_tasks_per_browser or int(os.getenv('BROWSER_POOL_MAX_TASKS', '50'))
+        self.max_waiters = max_waiters if max_waiters is not None else int(os.getenv('BROWSER_POOL_MAX_WAITERS', '20'))
+        self.acquire_timeout = acquire_timeout or float(os.getenv('BROWSER_POOL_ACQUIRE_TIMEOUT', '60'))
+        if headless is None:
+            headless = os.getenv('BROWSER_POOL_HEADLESS', 'false').lower() == 'true'
+        self.headless = headless
+        self.health_check_interval = health_check_interval or float(os.getenv('BROWSER_POOL_HEALTH_INTERVAL', '30'))
+        self.watchdog = BrowserWatchdog()
+
+        self._playwright = None
+        self._idle: deque = deque()
+        self._busy: Dict[str, PooledBrowser] = {}
+        self._launching = 0
+        self._waiters = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._background: set = set()
+        self._started = False
+
+        self._launch_latencies: deque = deque(maxlen=100)
+        self._stats = {
+            'launches': 0,
+            'launch_failures': 0,
+            'recycled': 0,
+            'crashed': 0,
+            'leases': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'memory_recycled': 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def accepts(self, headless: bool) -> bool:
+        """池是否能服務該請求（池內瀏覽器的 headless 模式需一致）"""
+        return self._started and headless == self.headless
+
+    async def start(self):
+        """啟動 Playwright 並預先啟動所有瀏覽器"""
+        if self._started or not self.enabled:
+            return
+
+        from playwright.async_api import async_playwright
+
+        self._cond = asyncio.Condition()
+        # 先清除上次異常結束時遺留的瀏覽器行程
+        await asyncio.to_thread(self.watchdog.sweep)
+        self._playwright = await async_playwright().start()
+        self._started = True
+
+        print(f"預熱瀏覽器池: {self.size} 個瀏覽器 (headless={self.headless})")
+        results = await asyncio.gather(
+            *(self._launch_into_pool() for _ in range(self.size)),
+            return_exceptions=True
+        )
+        failures = [r for r in results if isinstance(r, Exception)]
+        if failures:
+            print(f"瀏覽器池有 {len(failures)} 個瀏覽器啟動失敗: {failures[0]}")
+
+        self._health_task = asyncio.create_task(self._health_check_loop())
+
+    async def stop(self):
+        """關閉所有瀏覽器與 Playwright"""
+        if not self._started:
+            return
+        self._started = False
+
+        if self._health_task:
+            self._health_task.cancel()
+        for task in list(self._background):
+            task.cancel()
+
+        browsers = list(self._idle) + list(self._busy.values())
+        self._idle.clear()
+        self._busy.clear()
+        for pooled in browsers:
+            await self._close_browser(pooled)
+
+        if self._playwright:
+            await self._playwright.stop()
+            self._playwright = None
+
+    @asynccontextmanager
+    async def lease(self, context_options: Dict):
+        """
+        借出一個瀏覽器並建立專屬 context
+
+        Args:
+            context_options: 傳給 browser.new_context() 的參數
+        """
+        pooled = await self._acquire()
+        context = None
+        crashed = False
+        try:
+            context = await pooled.browser.new_context(**context_options)
+            yield BrowserLease(pooled, context)
+        except Exception:
+            crashed = not pooled.is_healthy()
+            raise
+        finally:
+            await self._release(pooled, context, crashed)
+
+    async def probe(self) -> float:
+        """
+        啟動並立即關閉一個瀏覽器，確認這台機器能啟動 Chromium（未使用瀏覽器池時的預熱檢查），
+        同時讓 Chromium 執行檔進入系統快取，回傳啟動耗時（秒）
+        """
+        from playwright.async_api import async_playwright
+
+        launch_config = StealthConfig.get_browser_config(headless=self.headless, slow_mo=0)
+        async with async_playwright() as playwright:
+            start = time.perf_counter()
+            browser = await playwright.chromium.launch(
+                headless=launch_config['headless'],
+                args=launch_config['args'],
+            )
+            latency = time.perf_counter() - start
+            await browser.close()
+        return latency
+
+    def browser_ids(self) -> List[str]:
+        """池中目前的瀏覽器 ID（閒置與使用中）"""
+        return [pooled.id for pooled in self._idle] + list(self._busy)
+
+    def browser_usage(self) -> Dict[str, Dict]:
+        """各瀏覽器最近一次取樣的行程樹用量"""
+        return {
+            pooled.id: pooled.usage
+            for pooled in list(self._idle) + list(self._busy.values()) if pooled.usage is not None
+        }
+
+    def get_metrics(self) -> Dict:
+        """取得瀏覽器池指標"""
+        latencies = sorted(self._launch_latencies)
+        return {
+            'enabled': self.enabled,
+            'started': self._started,
+            'size': self.size,
+            'headless': self.headless,
+            'process_model': browser_process_model(),
+            'idle': len(self._idle),
+            'busy': len(self._busy),
+            'launching': self._launching,
+            'waiting': self._waiters,
+            'max_waiters': self.max_waiters,
+            'launch_latency': {
+                'last': round(self._launch_latencies[-1], 3) if latencies else None,
+                'avg': round(sum(latencies) / len(latencies), 3) if latencies else None,
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None,
+                'max': round(latencies[-1], 3) if latencies else None,
+            },
+            'browsers': [
+                {
+                    'id': pooled.id,
+                    'pid': pooled.pid,
+                    'tasks': pooled.task_count,
+                    'busy': pooled.id in self._busy,
+                    'rss_mb': round(pooled.usage['rss_bytes'] / 1024 / 1024, 1) if pooled.usage else None,
+                    'baseline_rss_mb': round(pooled.baseline_rss / 1024 / 1024, 1) if pooled.baseline_rss else None,
+                    'fds': pooled.usage['fds'] if pooled.usage else None,
+                    'threads': pooled.usage['threads'] if pooled.usage else None,
+                    'processes': pooled.usage['processes'] if pooled.usage else None,
+                }
+                for pooled in list(self._idle) + list(self._busy.values())
+            ],
+            'watchdog': self.watchdog.get_metrics(),
+            **self._stats,
+        }
+
+    async def _acquire(self) -> PooledBrowser:
+        """從池中取得閒置瀏覽器，池滿時進入有上限的等待隊列"""
+        if not self._started:
+            raise PoolExhaustedError("瀏覽器池尚未啟動")
+
+        if not self._idle and self._waiters >= self.max_waiters:
+            self._stats['rejected'] += 1
+            raise PoolExhaustedError(f"瀏覽器池已滿，等待隊列已達上限 ({self.max_waiters})")
+
+        self._waiters += 1
+        try:
+            while True:
+                async with self._cond:
+                    try:
+                        await asyncio.wait_for(
+                            self._cond.wait_for(lambda: len(self._idle) > 0),
+                            timeout=self.acquire_timeout
+                        )
+                    except asyncio.TimeoutError:
+                        self._stats['timeouts'] += 1
+                        raise PoolExhaustedError(f"等待瀏覽器逾時 ({self.acquire_timeout} 秒)")
+                    pooled = self._idle.popleft()
+
+                if pooled.is_healthy():
+                    self._busy[pooled.id] = pooled
+                    self._stats['leases'] += 1
+                    return pooled
+
+                # 閒置時已斷線的瀏覽器，丟棄並補一個新的
+                self._stats['crashed'] += 1
+                self._replace_in_background(pooled)
+        finally:
+            self._waiters -= 1
+
+    async def _release(self, pooled: PooledBrowser, context, crashed: bool):
+        """歸還瀏覽器，必要時回收"""
+        if context is not None:
+            try:
+                await context.close()
+            except Exception as e:
+                print(f"關閉瀏覽器 context 失敗: {e}")
+
+        self._busy.pop(pooled.id, None)
+        pooled.task_count += 1
+
+        if not self._started:
+            await self._close_browser(pooled)
+            return
+
+        if crashed or not pooled.is_healthy():
+            self._stats['crashed'] += 1
+            BROWSER_RECYCLES.labels('crashed').inc()
+            print(f"瀏覽器 {pooled.id} 已崩潰，重新啟動")
+            self._replace_in_background(pooled)
+        elif pooled.task_count >= self.max_tasks_per_browser:
+            self._stats['recycled'] += 1
+            BROWSER_RECYCLES.labels('max_tasks').inc()
+            print(f"瀏覽器 {pooled.id} 已服務 {pooled.task_count} 個任務，回收")
+            self._replace_in_background(pooled)
+        else:
+            usage = await self._sample(pooled)
+            reason = pooled.recycle_reason or (self.watchdog.check(usage, pooled.baseline_rss) if usage else None)
+            if reason:
+                self._recycle_for_memory(pooled, reason)
+            else:
+                await self._put_idle(pooled)
+
+    async def _put_idle(self, pooled: PooledBrowser):
+        async with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def _replace_in_background(self, pooled: PooledBrowser):
+        """在背景關閉舊瀏覽器並啟動新瀏覽器補位"""
+        async def replace():
+            await self._close_browser(pooled)
+            # 崩潰的瀏覽器可能留下 renderer 等子行程
+            killed = await asyncio.to_thread(self.watchdog.kill_browser, pooled.id)
+            if killed:
+                print(f"瀏覽器 {pooled.id} 關閉後仍有 {killed} 個行程，已強制結束")
+            try:
+                await self._launch_into_pool()
+            except Exception as e:
+                print(f"補位瀏覽器啟動失敗: {e}")
+
+        task = asyncio.create_task(replace())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _launch_into_pool(self):
+        pooled = await self._launch()
+        await self._put_idle(pooled)
+
+    async def _launch(self) -> PooledBrowser:
+        """啟動單一瀏覽器並記錄啟動延遲"""
+        # 池中的瀏覽器由各種執行節奏的任務共用，不加 slow_mo，節奏改由各任務的網站限速控制
+        launch_config = StealthConfig.get_browser_config(headless=self.headless, slow_mo=0)
+        browser_id = uuid.uuid4().hex[:8]
+        self._launching += 1
+        start = time.perf_counter()
+        try:
+            browser = await self._playwright.chromium.launch(
+                headless=launch_config['headless'],
+                args=launch_config['args'] + [f'{BROWSER_SWITCH}{browser_id}'],
+                slow_mo=launch_config['slow_mo'],
+            )
+        except Exception:
+            self._stats['launch_failures'] += 1
+            raise
+        finally:
+            self._launching -= 1
+
+        latency = time.perf_counter() - start
+        self._launch_latencies.append(latency)
+        self._stats['launches'] += 1
+        pooled = PooledBrowser(browser, latency, browser_id)
+        try:
+            pooled.pid = await asyncio.to_thread(self.watchdog.locate, browser_id)
+        except Exception as e:
+            print(f"找不到瀏覽器 {pooled.id} 的行程，不監控記憶體: {e}")
+        usage = await self._sample(pooled)
+        if usage:
+            pooled.baseline_rss = usage['rss_bytes']
+        print(f"瀏覽器 {pooled.id} 啟動完成，耗時 {latency:.2f} 秒")
+        return pooled
+
+    async def _sample(self, pooled: PooledBrowser) -> Optional[Dict]:
+        """取樣瀏覽器行程樹的用量（找不到行程時回傳 None）"""
+        if pooled.pid is None:
+            return None
+        try:
+            usage = await asyncio.to_thread(self.watchdog.sample, pooled.pid)
+        except Exception as e:
+            print(f"取樣瀏覽器 {pooled.id} 記憶體失敗: {e}")
+            return None
+        if not usage['processes']:
+            return None
+        pooled.usage = usage
+        return usage
+
+    def _recycle_for_memory(self, pooled: PooledBrowser, reason: str):
+        self._stats['memory_recycled'] += 1
+        BROWSER_RECYCLES.labels(reason).inc()
+        rss_mb = pooled.usage['rss_bytes'] / 1024 / 1024 if pooled.usage else 0
+        print(f"瀏覽器 {pooled.id} 超過記憶體門檻（{reason}，RSS {rss_mb:.0f} MB），回收")
+        self._replace_in_background(pooled)
+
+    async def _watch_memory(self):
+        """取樣所有瀏覽器：閒置的超過門檻立即回收，使用中的標記為任務結束後回收"""
+        for pooled in list(self._idle) + list(self._busy.values()):
+            usage = await self._sample(pooled)
+            if usage is None:
+                continue
+            if pooled.id in self._busy:
+                # 執行中的頁面本來就會佔用記憶體，只檢查絕對上限，不判斷洩漏
+                pooled.recycle_reason = pooled.recycle_reason or self.watchdog.check(usage, None)
+                continue
+            reason = self.watchdog.check(usage, pooled.baseline_rss)
+            if reason is None:
+                continue
+            async with self._cond:
+                if pooled not in self._idle:
+                    continue
+                self._idle.remove(pooled)
+            self._recycle_for_memory(pooled, reason)
+
+    async def _close_browser(self, pooled: PooledBrowser):
+        try:
+            await pooled.browser.close()
+        except Exception:
+            pass
+
+    async def _health_check_loop(self):
+        """定期檢查閒置瀏覽器，替換已斷線的實例，並取樣各瀏覽器的記憶體"""
+        while self._started:
+            await asyncio.sleep(self.health_check_interval)
+            async with self._cond:
+                dead: List[PooledBrowser] = [p for p in self._idle if not p.is_healthy()]
+                for pooled in dead:
+                    self._idle.remove(pooled)
+            for pooled in dead:
+                self._stats['crashed'] += 1
+                BROWSER_RECYCLES.labels('crashed').inc()
+                print(f"健康檢查: 瀏覽器 {pooled.id} 已斷線，重新啟動")
+                self._replace_in_background(pooled)
+            await self._watch_memory()
@@ -0,0 +1,247 @@
+"""
+瀏覽器記憶體監控模組
+取樣每個瀏覽器行程樹的 RSS、檔案描述元與執行緒數，供瀏覽器池在任務之間回收超過門檻或記憶體
+持續成長（疑似洩漏）的瀏覽器；並清除崩潰後遺留的孤兒 Chromium 行程
+"""
+
+import os
+import signal
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from metrics import BROWSER_ORPHANS_KILLED
+
+try:
+    import psutil
+except ImportError:  # psutil 為選用依賴，未安裝時改讀 /proc
+    psutil = None
+
+# 加在 Chromium 命令列上的標記（Chromium 會忽略不認得的參數），用來找出本服務啟動的瀏覽器行程
+OWNER_SWITCH = '--autopageaudit-owner='
+BROWSER_SWITCH = '--autopageaudit-browser='
+
+_PROCESS_ERRORS = (psutil.Error, OSError) if psutil is not None else (OSError, ValueError, IndexError)
+
+
+def owner_args(browser_id: Optional[str] = None) -> List[str]:
+    """標記啟動者（目前行程）與瀏覽器池中的瀏覽器 ID 的 Chromium 參數"""
+    args = [f'{OWNER_SWITCH}{os.getpid()}']
+    if browser_id:
+        args.append(f'{BROWSER_SWITCH}{browser_id}')
+    return args
+
+
+class ProcessInfo(NamedTuple):
+    pid: int
+    ppid: int
+    state: str
+    cmdline: str
+    started: float
+
+
+def _boot_time() -> float:
+    with open('/proc/stat') as f:
+        for line in f:
+            if line.startswith('btime'):
+                return float(line.split()[1])
+    return 0.0
+
+
+def scan_processes() -> Dict[int, ProcessInfo]:
+    """目前所有行程（pid -> ProcessInfo）"""
+    processes = {}
+    if psutil is not None:
+        for process in psutil.process_iter(['pid', 'ppid', 'status', 'cmdline', 'create_time']):
+            info = process.info
+            processes[info['pid']] = ProcessInfo(
+                info['pid'], info['ppid'] or 0, 'Z' if info['status'] == psutil.STATUS_ZOMBIE else 'R',
+                ' '.join(info['cmdline'] or []), info['create_time'] or 0.0
+            )
+        return processes
+
+    boot_time, ticks = _boot_time(), os.sysconf('SC_CLK_TCK')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='replace').strip()
+        except (OSError, IndexError):
+            continue
+        processes[int(entry)] = ProcessInfo(
+            int(entry), int(fields[1]), fields[0], cmdline, boot_time + int(fields[19]) / ticks
+        )
+    return processes
+
+
+def _children(processes: Dict[int, ProcessInfo]) -> Dict[int, List[int]]:
+    children: Dict[int, List[int]] = {}
+    for info in processes.values():
+        children.setdefault(info.ppid, []).append(info.pid)
+    return children
+
+
+def _tree(children: Dict[int, List[int]], root: int) -> List[int]:
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+
+def tree_usage(pids: Iterable[int]) -> Dict:
+    """行程樹的 RSS 總和（共用記憶體會重複計算）、檔案描述元與執行緒數"""
+    usage = {'processes': 0, 'rss_bytes': 0, 'fds': 0, 'threads': 0}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for pid in pids:
+        try:
+            if psutil is not None:
+                process = psutil.Process(pid)
+                rss, fds, threads = process.memory_info().rss, process.num_fds(), process.num_threads()
+            else:
+                with open(f'/proc/{pid}/statm') as f:
+                    rss = int(f.read().split()[1]) * page_size
+                with open(f'/proc/{pid}/stat') as f:
+                    threads = int(f.read().rsplit(')', 1)[1].split()[17])
+                fds = len(os.listdir(f'/proc/{pid}/fd'))
+        except _PROCESS_ERRORS:
+            continue
+        usage['processes'] += 1
+        usage['rss_bytes'] += rss
+        usage['fds'] += fds
+        usage['threads'] += threads
+    return usage
+
+
+def _switch_value(cmdline: str, switch: str) -> Optional[str]:
+    if switch not in cmdline:
+        return None
+    value = cmdline.split(switch, 1)[1].split(' ', 1)[0]
+    return value or None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class BrowserWatchdog:
+    """
+    瀏覽器行程的記憶體門檻、洩漏判斷與孤兒行程清除
+
+    Args:
+        max_rss_mb: 單一瀏覽器行程樹的 RSS 上限
+        max_fds: 單一瀏覽器行程樹的檔案描述元上限
+        leak_mb: 閒置時 RSS 比啟動時多出此值即視為洩漏
+        orphan_grace: 池中已不存在的瀏覽器行程經過此秒數仍在時視為孤兒
+    """
+
+    def __init__(self, max_rss_mb: Optional[float] = None, max_fds: Optional[int] = None,
+                 leak_mb: Optional[float] = None, orphan_grace: Optional[float] = None):
+        self.max_rss = int((max_rss_mb or float(os.getenv('BROWSER_MAX_RSS_MB', '1536'))) * 1024 * 1024)
+        self.max_fds = max_fds or int(os.getenv('BROWSER_MAX_FDS', '4096'))
+        self.leak_bytes = int((leak_mb or float(os.getenv('BROWSER_LEAK_MB', '512'))) * 1024 * 1024)
+        self.orphan_grace = orphan_grace or float(os.getenv('BROWSER_ORPHAN_GRACE', '60'))
+        self._stats = {'samples': 0, 'orphans_killed': 0, 'zombies': 0}
+
+    def locate(self, browser_id: str) -> Optional[int]:
+        """依瀏覽器 ID 標記找出瀏覽器的主行程"""
+        marker = f'{BROWSER_SWITCH}{browser_id}'
+        processes = scan_processes()
+        for info in processes.values():
+            if marker in info.cmdline and marker not in getattr(processes.get(info.ppid), 'cmdline', ''):
+                return info.pid
+        return None
+
+    def sample(self, pid: int) -> Dict:
+        """瀏覽器行程樹目前的用量"""
+        self._stats['samples'] += 1
+        return tree_usage(_tree(_children(scan_processes()), pid))
+
+    def check(self, usage: Dict, baseline_rss: Optional[int]) -> Optional[str]:
+        """超過門檻時回傳回收原因（rss、fds、leak），否則回傳 None"""
+        if usage['rss_bytes'] > self.max_rss:
+            return 'rss'
+        if usage['fds'] > self.max_fds:
+            return 'fds'
+        if baseline_rss is not None and usage['rss_bytes'] - baseline_rss > self.leak_bytes:
+            return 'leak'
+        return None
+
+    def kill_browser(self, browser_id: str) -> int:
+        """關閉後仍殘留的瀏覽器行程（例如崩潰的瀏覽器）全部強制結束，回傳結束的行程數"""
+        marker = f'{BROWSER_SWITCH}{browser_id}'
+        processes = scan_processes()
+        roots = [info.pid for info in processes.values() if marker in info.cmdline]
+        return self._kill_trees(processes, roots)
+
+    def sweep(self, live_browser_ids: Optional[Iterable[str]] = None) -> Dict:
+        """
+        清除孤兒 Chromium 行程：啟動者已結束、父行程已結束（被 init 收養），
+        或屬於本行程的瀏覽器池但已不在池中超過 orphan_grace 秒
+
+        Args:
+            live_browser_ids: 本行程瀏覽器池中目前的瀏覽器 ID（None 表示不檢查這一項）
+
+        Returns:
+            {'killed': 結束的行程數, 'zombies': 瀏覽器底下尚未被回收的殭屍行程數}
+        """
+        processes = scan_processes()
+        live = set(live_browser_ids) if live_browser_ids is not None else None
+        own, now = os.getpid(), time.time()
+        orphans, zombies = [], 0
+        for info in processes.values():
+            parent = processes.get(info.ppid)
+            if info.state == 'Z':
+                # 殭屍行程的命令列已清空，以父行程判斷是否為瀏覽器的子行程；需由父行程回收，無法強制結束
+                if parent is not None and OWNER_SWITCH in parent.cmdline:
+                    zombies += 1
+                continue
+            if OWNER_SWITCH not in info.cmdline:
+                continue
+            if parent is not None and OWNER_SWITCH in parent.cmdline:
+                continue  # 只判斷瀏覽器主行程，子行程隨主行程一起處理
+            owner = _switch_value(info.cmdline, OWNER_SWITCH)
+            browser_id = _switch_value(info.cmdline, BROWSER_SWITCH)
+            if (
+                not (owner and owner.isdigit() and _pid_alive(int(owner)))
+                or parent is None or info.ppid == 1
+                or (owner == str(own) and live is not None and browser_id is not None
+                    and browser_id not in live and now - info.started > self.orphan_grace)
+            ):
+                orphans.append(info.pid)
+        killed = self._kill_trees(processes, orphans)
+        self._stats['orphans_killed'] += killed
+        self._stats['zombies'] = zombies
+        if killed:
+            print(f"已結束 {killed} 個孤兒瀏覽器行程")
+        return {'killed': killed, 'zombies': zombies}
+
+    def _kill_trees(self, processes: Dict[int, ProcessInfo], roots: List[int]) -> int:
+        children = _children(processes)
+        killed = 0
+        for root in roots:
+            for pid in reversed(_tree(children, root)):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    killed += 1
+                except (ProcessLookupError, PermissionError):
+                    pass
+        BROWSER_ORPHANS_KILLED.inc(killed)
+        return killed
+
+    def get_metrics(self) -> Dict:
+        return {
+            'max_rss_mb': round(self.max_rss / 1024 / 1024),
+            'max_fds': self.max_fds,
+            'leak_mb': round(self.leak_bytes / 1024 / 1024),
+            **self._stats,
+        }
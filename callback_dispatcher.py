@@ -0,0 +1,286 @@
+"""
+Webhook 回調派送模組
+以每個目標主機共用的長連線客戶端發送回調，在背景佇列中重試，
+最終失敗的回調寫入磁碟（dead letter），重啟後可重新派送
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import CALLBACK_DEAD_LETTERS, CALLBACK_DELIVERIES, PHASE_SECONDS
+from result_serializer import dumps
+
+CALLBACK_HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "AutoPageAudit-BrowserUse/2.0.0"
+}
+
+
+class CallbackDispatcher:
+    """
+    回調派送器
+
+    每個回調先寫入 spool/pending，成功後刪除；重試用盡後移到 spool/dead。
+    服務重啟時 pending 中的回調會重新排入佇列。
+    """
+
+    def __init__(
+        self,
+        spool_dir: Optional[str] = None,
+        workers: Optional[int] = None,
+        max_connections_per_host: Optional[int] = None,
+    ):
+        self.spool_dir = spool_dir or os.getenv('CALLBACK_SPOOL_DIR', 'callback_spool')
+        self.workers = workers or int(os.getenv('CALLBACK_WORKERS', '4'))
+        self.max_connections_per_host = max_connections_per_host or int(os.getenv('CALLBACK_MAX_CONNECTIONS_PER_HOST', '10'))
+        self._pending_dir = os.path.join(self.spool_dir, 'pending')
+        self._dead_dir = os.path.join(self.spool_dir, 'dead')
+
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._retry_handles: set = set()
+        self._in_flight = 0
+        # spool 中各目錄的回調 ID，寫入與刪除時更新，指標不必每次列出目錄
+        self._spooled: Dict[str, set] = {self._pending_dir: set(), self._dead_dir: set()}
+
+        self._latencies: deque = deque(maxlen=500)
+        self._stats = {
+            'enqueued': 0,
+            'delivered': 0,
+            'failed_attempts': 0,
+            'dead_lettered': 0,
+            'replayed': 0,
+            'total_attempts_delivered': 0,
+        }
+
+    async def start(self):
+        """啟動派送 worker，並重新派送上次未完成的回調"""
+        os.makedirs(self._pending_dir, exist_ok=True)
+        os.makedirs(self._dead_dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+
+        for delivery in await asyncio.to_thread(self._load_dir, self._pending_dir):
+            self._spooled[self._pending_dir].add(delivery['id'])
+            self._queue.put_nowait(delivery)
+        self._spooled[self._dead_dir] = await asyncio.to_thread(self._list_ids, self._dead_dir)
+        if self._queue.qsize():
+            print(f"重新派送 {self._queue.qsize()} 個未完成的回調")
+
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """停止派送，尚未送達的回調保留在 spool 中，下次啟動時繼續"""
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    async def enqueue(self, callback_url: str, data: dict, timeout: int = 30, max_retries: int = 3) -> str:
+        """
+        排入回調並立即返回
+
+        Args:
+            callback_url: 回調URL
+            data: 要發送的數據
+            timeout: 單次請求超時時間
+            max_retries: 最大嘗試次數
+
+        Returns:
+            delivery_id
+        """
+        delivery = {
+            'id': uuid.uuid4().hex,
+            'url': callback_url,
+            'data': data,
+            'timeout': timeout,
+            'max_retries': max(1, max_retries),
+            'attempts': 0,
+            'created_at': time.time(),
+            'last_error': None,
+        }
+        await asyncio.to_thread(self._write, self._pending_dir, delivery)
+        self._stats['enqueued'] += 1
+        self._queue.put_nowait(delivery)
+        return delivery['id']
+
+    async def replay_dead_letters(self, delivery_id: Optional[str] = None) -> int:
+        """
+        重新派送 dead letter 中的回調
+
+        Args:
+            delivery_id: 只重送指定的回調，未指定則全部重送
+
+        Returns:
+            重新排入的回調數
+        """
+        if delivery_id:
+            delivery = await asyncio.to_thread(self._load, self._dead_dir, delivery_id)
+            deliveries = [delivery] if delivery else []
+        else:
+            deliveries = await asyncio.to_thread(self._load_dir, self._dead_dir)
+
+        for delivery in deliveries:
+            delivery['attempts'] = 0
+            await asyncio.to_thread(self._write, self._pending_dir, delivery)
+            await asyncio.to_thread(self._remove, self._dead_dir, delivery['id'])
+            self._queue.put_nowait(delivery)
+        self._stats['replayed'] += len(deliveries)
+        return len(deliveries)
+
+    def get_metrics(self) -> Dict:
+        latencies = sorted(self._latencies)
+        delivered = self._stats['delivered']
+        return {
+            'queued': self._queue.qsize() if self._queue else 0,
+            'in_flight': self._in_flight,
+            'scheduled_retries': len(self._retry_handles),
+            'hosts': len(self._clients),
+            'latency_avg': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'latency_p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else None,
+            'avg_attempts': round(self._stats['total_attempts_delivered'] / delivered, 2) if delivered else None,
+            'pending_count': len(self._spooled[self._pending_dir]),
+            'dead_letter_count': len(self._spooled[self._dead_dir]),
+            **self._stats,
+        }
+
+    def _client_for(self, url: str) -> httpx.AsyncClient:
+        """取得目標主機共用的長連線客戶端"""
+        parts = urlsplit(url)
+        host_key = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(host_key)
+        if client is None:
+            client = httpx.AsyncClient(
+                headers=CALLBACK_HEADERS,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections_per_host,
+                    max_keepalive_connections=self.max_connections_per_host,
+                    keepalive_expiry=60,
+                ),
+            )
+            self._clients[host_key] = client
+        return client
+
+    async def _worker(self):
+        while True:
+            delivery = await self._queue.get()
+            self._in_flight += 1
+            try:
+                await self._attempt(delivery)
+            except Exception as e:
+                print(f"回調派送發生未預期錯誤: {e}")
+            finally:
+                self._in_flight -= 1
+
+    async def _attempt(self, delivery: Dict):
+        delivery['attempts'] += 1
+        url = delivery['url']
+        print(f"發送回調到 {url} (第 {delivery['attempts']} 次嘗試)")
+
+        start = time.perf_counter()
+        try:
+            response = await self._client_for(url).post(
+                url,
+                content=dumps(delivery['data']),
+                timeout=delivery['timeout'],
+            )
+            if 200 <= response.status_code < 300:
+                elapsed = time.perf_counter() - start
+                PHASE_SECONDS.labels('callback_delivery').observe(elapsed)
+                CALLBACK_DELIVERIES.labels('delivered').inc()
+                self._latencies.append(elapsed)
+                self._stats['delivered'] += 1
+                self._stats['total_attempts_delivered'] += delivery['attempts']
+                await asyncio.to_thread(self._remove, self._pending_dir, delivery['id'])
+                print(f"回調成功發送到 {url}")
+                return
+            delivery['last_error'] = f"狀態碼 {response.status_code}: {response.text[:200]}"
+        except httpx.TimeoutException:
+            delivery['last_error'] = "回調超時"
+        except Exception as e:
+            delivery['last_error'] = str(e)
+
+        PHASE_SECONDS.labels('callback_delivery').observe(time.perf_counter() - start)
+        self._stats['failed_attempts'] += 1
+        CALLBACK_DELIVERIES.labels('failed').inc()
+        print(f"回調失敗 (第 {delivery['attempts']} 次嘗試): {delivery['last_error']}")
+
+        if delivery['attempts'] >= delivery['max_retries']:
+            await asyncio.to_thread(self._write, self._dead_dir, delivery)
+            await asyncio.to_thread(self._remove, self._pending_dir, delivery['id'])
+            self._stats['dead_lettered'] += 1
+            CALLBACK_DEAD_LETTERS.inc()
+            print(f"回調最終失敗，已重試 {delivery['attempts']} 次，寫入 dead letter: {delivery['id']}")
+            return
+
+        # 指數退避重試：2, 4, 8 秒...，不佔用 worker
+        await asyncio.to_thread(self._write, self._pending_dir, delivery)
+        wait_time = (2 ** (delivery['attempts'] - 1)) * 2
+        print(f"{wait_time} 秒後重試回調...")
+        self._schedule_retry(delivery, wait_time)
+
+    def _schedule_retry(self, delivery: Dict, delay: float):
+        loop = asyncio.get_running_loop()
+
+        def requeue():
+            self._retry_handles.discard(handle)
+            self._queue.put_nowait(delivery)
+
+        handle = loop.call_later(delay, requeue)
+        self._retry_handles.add(handle)
+
+    def _write(self, directory: str, delivery: Dict):
+        path = os.path.join(directory, f"{delivery['id']}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(delivery, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+        self._spooled[directory].add(delivery['id'])
+
+    def _remove(self, directory: str, delivery_id: str):
+        self._spooled[directory].discard(delivery_id)
+        try:
+            os.remove(os.path.join(directory, f"{delivery_id}.json"))
+        except FileNotFoundError:
+            pass
+
+    def _list_ids(self, directory: str) -> set:
+        return {name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json')}
+
+    def _load(self, directory: str, delivery_id: str) -> Optional[Dict]:
+        if not delivery_id.isalnum():
+            return None  # 只接受 uuid hex，避免組出目錄外的路徑
+        try:
+            with open(os.path.join(directory, f"{delivery_id}.json"), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"讀取回調紀錄失敗 {delivery_id}: {e}")
+            return None
+
+    def _load_dir(self, directory: str) -> List[Dict]:
+        deliveries = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    deliveries.append(json.load(f))
+            except Exception as e:
+                print(f"讀取回調紀錄失敗 {name}: {e}")
+        return sorted(deliveries, key=lambda d: d['created_at'])
@@ -4,67 +4,229 @@ reCAPTCHA 和驗證碼處理模組
 """
 
 import asyncio
+import json
+import os
 import random
-from typing import Dict, Any
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from stealth_config import HumanBehavior
 
+# 內建的驗證碼 / 挑戰頁元素（類型, CSS selector）
+DEFAULT_CHALLENGE_SELECTORS: List[Tuple[str, str]] = [
+    # reCAPTCHA v2
+    ('reCAPTCHA', 'iframe[src*="recaptcha"]'),
+    ('reCAPTCHA', '.g-recaptcha'),
+    ('reCAPTCHA', '#recaptcha'),
+    # reCAPTCHA v3
+    ('reCAPTCHA', '.grecaptcha-badge'),
+    # hCaptcha
+    ('hCaptcha', '.h-captcha'),
+    ('hCaptcha', 'iframe[src*="hcaptcha"]'),
+    # Cloudflare
+    ('Cloudflare', '.cf-browser-verification'),
+    ('Cloudflare', '#cf-challenge-running'),
+    # 通用驗證碼指示器
+    ('Generic', '[data-captcha]'),
+    ('Generic', '.captcha'),
+    ('Generic', '#captcha'),
+]
+
+# 在頁面內一次比對所有 selector：先以合併的 selector 做一次查詢，沒有命中就直接回傳；
+# 有命中（或合併的 selector 因其中一個不合法而失敗）時才逐一計數。回傳 [[索引, 數量], ...]，數量 -1 表示 selector 不合法
+DETECT_FUNCTION = """(selectors, combined) => {
+    try {
+        if (!document.querySelector(combined)) return [];
+    } catch (e) {}
+    const counts = [];
+    for (let i = 0; i < selectors.length; i++) {
+        try {
+            const count = document.querySelectorAll(selectors[i]).length;
+            if (count) counts.push([i, count]);
+        } catch (e) {
+            counts.push([i, -1]);
+        }
+    }
+    return counts;
+}"""
+
+# 監看模式：以 MutationObserver 在新增元素或 class/id/src 變更符合任一 selector 時回報（只在最上層 frame），
+# 同一輪 DOM 變更只比對一次，結果與上次相同時不重複回報
+WATCH_SCRIPT = """((selectors, combined, binding) => {
+    if (window.top !== window || window.__challengeWatch) return;
+    window.__challengeWatch = true;
+    const detect = %s;
+    let scheduled = false, last = '[]';
+    const report = () => {
+        scheduled = false;
+        const counts = detect(selectors, combined);
+        const key = JSON.stringify(counts);
+        if (key !== last && counts.length) window[binding](counts);
+        last = key;
+    };
+    const schedule = () => {
+        if (!scheduled) {
+            scheduled = true;
+            setTimeout(report, 50);
+        }
+    };
+    const hit = (node) => {
+        if (node.nodeType !== 1) return false;
+        try {
+            return node.matches(combined) || !!node.querySelector(combined);
+        } catch (e) {
+            return true;
+        }
+    };
+    new MutationObserver((mutations) => {
+        if (scheduled) return;
+        for (const mutation of mutations) {
+            if (mutation.type === 'attributes' ? hit(mutation.target) : Array.prototype.some.call(mutation.addedNodes, hit)) {
+                schedule();
+                return;
+            }
+        }
+    }).observe(document, {childList: true, subtree: true, attributes: true, attributeFilter: ['class', 'id', 'src', 'data-captcha']});
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', report);
+    } else {
+        report();
+    }
+})(%s, %s, %s)"""
+
+
+class ChallengeRegistry:
+    """
+    驗證碼 / 挑戰頁 selector 登錄表
+
+    除內建項目外，可由 CAPTCHA_SELECTORS_FILE 指定的 JSON 檔（{"類型": ["selector", ...]}）
+    或 register() 追加；合併後的 selector 在第一次使用時才組合並快取。
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str]] = DEFAULT_CHALLENGE_SELECTORS):
+        self.entries: List[Tuple[str, str]] = []
+        self._combined: Optional[str] = None
+        for challenge_type, selector in entries:
+            self.register(challenge_type, selector)
+
+    @classmethod
+    def from_config(cls, path: Optional[str] = None) -> 'ChallengeRegistry':
+        registry = cls()
+        path = path or os.getenv('CAPTCHA_SELECTORS_FILE')
+        if path:
+            registry.load(path)
+        return registry
+
+    def register(self, challenge_type: str, selector: str):
+        if (challenge_type, selector) not in self.entries:
+            self.entries.append((challenge_type, selector))
+            self._combined = None
+
+    def load(self, path: str):
+        """從 JSON 檔追加 selector"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for challenge_type, selectors in data.items():
+            for selector in ([selectors] if isinstance(selectors, str) else selectors):
+                self.register(challenge_type, selector)
+
+    @property
+    def selectors(self) -> List[str]:
+        return [selector for _, selector in self.entries]
+
+    @property
+    def combined(self) -> str:
+        if self._combined is None:
+            self._combined = ', '.join(self.selectors)
+        return self._combined
+
+
 class CaptchaHandler:
-    """驗證碼檢測和處理器"""
-    
+    """
+    驗證碼檢測和處理器
+
+    Args:
+        registry: 要比對的 selector（未指定時為內建項目加上 CAPTCHA_SELECTORS_FILE）
+    """
+
+    binding_name = '__challengeDetected'
+
+    def __init__(self, registry: Optional[ChallengeRegistry] = None):
+        self.registry = registry or ChallengeRegistry.from_config()
+        self._latencies = deque(maxlen=1000)
+        self._stats = {'calls': 0, 'detections': 0, 'watch_events': 0}
+        self._reported_errors = set()
+
     async def detect_captcha(self, page) -> Dict[str, Any]:
-        """檢測頁面中是否有驗證碼"""
-        captcha_indicators = [
-            # reCAPTCHA v2
-            'iframe[src*="recaptcha"]',
-            '.g-recaptcha',
-            '#recaptcha',
-            
-            # reCAPTCHA v3
-            '.grecaptcha-badge',
-            
-            # hCaptcha
-            '.h-captcha',
-            'iframe[src*="hcaptcha"]',
-            
-            # Cloudflare
-            '.cf-browser-verification',
-            '#cf-challenge-running',
-            
-            # 通用驗證碼指示器
-            '[data-captcha]',
-            '.captcha',
-            '#captcha'
-        ]
-        
+        """檢測頁面中是否有驗證碼（一次 page.evaluate 比對所有 selector），latency_ms 為這次檢測的耗時"""
+        start = time.perf_counter()
+        try:
+            counts = await page.evaluate(DETECT_FUNCTION, [self.registry.selectors, self.registry.combined])
+        except Exception as e:
+            print(f"檢測驗證碼時出錯: {e}")
+            counts = []
+        latency = time.perf_counter() - start
+        self._latencies.append(latency)
+        self._stats['calls'] += 1
+        result = self._build_result(counts)
+        if result['has_captcha']:
+            self._stats['detections'] += 1
+        return {**result, 'latency_ms': round(latency * 1000, 2)}
+
+    def _build_result(self, counts: List[List[int]]) -> Dict[str, Any]:
         detected_captchas = []
-        
-        for selector in captcha_indicators:
-            try:
-                elements = await page.query_selector_all(selector)
-                if elements:
-                    detected_captchas.append({
-                        'type': self._identify_captcha_type(selector),
-                        'selector': selector,
-                        'count': len(elements)
-                    })
-            except Exception as e:
-                print(f"檢測驗證碼時出錯 {selector}: {e}")
-        
+        for index, count in counts:
+            challenge_type, selector = self.registry.entries[index]
+            if count < 0:
+                if selector not in self._reported_errors:
+                    self._reported_errors.add(selector)
+                    print(f"檢測驗證碼時出錯 {selector}: 不合法的 selector")
+                continue
+            detected_captchas.append({'type': challenge_type, 'selector': selector, 'count': count})
         return {
             'has_captcha': len(detected_captchas) > 0,
             'captchas': detected_captchas
         }
-    
-    def _identify_captcha_type(self, selector: str) -> str:
-        """識別驗證碼類型"""
-        if 'recaptcha' in selector.lower():
-            return 'reCAPTCHA'
-        elif 'hcaptcha' in selector.lower():
-            return 'hCaptcha'
-        elif 'cf-' in selector.lower():
-            return 'Cloudflare'
-        else:
-            return 'Generic'
+
+    async def watch(self, target, on_challenge: Callable[[Dict[str, Any]], Any]):
+        """
+        監看模式：出現驗證碼元素時呼叫 on_challenge(result)，不需要輪詢
+
+        target 為 BrowserContext（之後開啟的分頁與導航都會監看）或單一 Page；
+        同一個 target 只能安裝一次。result 另附 url 欄位。
+        """
+        async def on_detected(source, counts):
+            self._stats['watch_events'] += 1
+            result = {**self._build_result(counts), 'url': source['frame'].url}
+            outcome = on_challenge(result)
+            if asyncio.iscoroutine(outcome):
+                await outcome
+
+        script = WATCH_SCRIPT % (
+            DETECT_FUNCTION,
+            json.dumps(self.registry.selectors),
+            json.dumps(self.registry.combined),
+            json.dumps(self.binding_name)
+        )
+        await target.expose_binding(self.binding_name, on_detected)
+        await target.add_init_script(script)
+        # 初始化腳本只套用在之後載入的文件，已開啟的頁面直接安裝
+        for page in getattr(target, 'pages', None) or [target]:
+            try:
+                await page.evaluate(script)
+            except Exception as e:
+                print(f"安裝驗證碼監看失敗: {e}")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """檢測次數與最近 1000 次檢測的耗時分布"""
+        latencies = sorted(self._latencies)
+        return {
+            'selectors': len(self.registry.entries),
+            'avg_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2) if latencies else None,
+            'max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+            **self._stats,
+        }
     
     async def handle_recaptcha(self, page, method: str = 'wait_and_retry') -> bool:
         """處理 reCAPTCHA"""
@@ -0,0 +1,247 @@
+"""
+任務檢查點模組
+agent 每完成一個成功的步驟，就把執行狀態（agent 記憶與對話、步驟紀錄、目前網址、cookie 與 localStorage）
+寫入本地檔案；重試或以 resume_from 重新提交時還原這些狀態，從最後成功的步驟繼續，不必從第 1 步重來。
+步驟紀錄只附加新的步驟，每步的寫入量不隨步驟數成長
+"""
+
+import asyncio
+import copy
+import json
+import os
+import re
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from result_serializer import dumps
+
+if TYPE_CHECKING:  # browser-use 匯入較慢，只在還原檢查點時才載入
+    from browser_use.agent.views import AgentState
+
+_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+STEPS_SUFFIX = '.steps.jsonl'
+
+# 另存於步驟檔或每步重建、不寫入狀態檔的 AgentState 欄位
+AGENT_STATE_EXCLUDE = {
+    'history': True,
+    'last_model_output': True,
+    'message_manager_state': {'agent_history_items': True, 'history': {'state_message': True}},
+}
+
+
+class CheckpointStore:
+    """
+    本地磁碟檢查點儲存
+
+    每個任務兩個檔案：<key>.json 為每步覆寫的狀態（agent 記憶與對話、網址、cookie），
+    <key>.steps.jsonl 為只附加的步驟紀錄（每行一個步驟或一個 agent 歷史項目）。
+    狀態檔記錄寫入後的步驟檔長度，讀取時忽略之後寫了一半或未完成的部分。
+    多行程 worker 共用同一個目錄，worker 寫入、下一次嘗試（可能在另一個 worker）讀取。
+
+    Args:
+        root: 存放目錄
+        max_age: 保存秒數，超過的檢查點在 evict() 時刪除
+    """
+
+    def __init__(self, root: Optional[str] = None, max_age: Optional[float] = None):
+        self.root = root or os.getenv('CHECKPOINT_DIR', 'checkpoints')
+        if max_age is None:
+            max_age = float(os.getenv('CHECKPOINT_MAX_AGE_HOURS', '24')) * 3600
+        self.max_age = max_age
+        os.makedirs(self.root, exist_ok=True)
+        self._stats = {'resumed': 0, 'steps_restored': 0, 'evicted': 0}
+
+    def _path(self, key: str) -> str:
+        if not _KEY_PATTERN.match(key):
+            raise ValueError(f"不合法的檢查點 ID: {key}")
+        return os.path.join(self.root, f"{key}.json")
+
+    def _steps_path(self, key: str) -> str:
+        return self._path(key)[:-len('.json')] + STEPS_SUFFIX
+
+    def save(self, key: str, record: Dict, lines: List[bytes], offset: int) -> int:
+        """
+        附加步驟紀錄並覆寫狀態檔（先寫暫存檔再取代，讀取端不會讀到寫一半的檔案）
+
+        Args:
+            lines: 要附加到步驟檔的 JSON 行
+            offset: 上次寫入後的步驟檔長度，之後的內容（上一次嘗試未完成的寫入）先截掉
+
+        Returns:
+            寫入後的步驟檔長度
+        """
+        path = self._path(key)
+        with open(self._steps_path(key), 'ab') as f:
+            if f.tell() > offset:
+                f.truncate(offset)
+            f.write(b''.join(line + b'\n' for line in lines))
+            offset = f.tell()
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, 'wb') as f:
+            f.write(dumps({**record, 'offset': offset}))
+        os.replace(temp, path)
+        return offset
+
+    def load_state(self, key: str) -> Optional[Dict]:
+        """只讀取狀態檔（不含步驟紀錄）"""
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def load(self, key: str) -> Optional[Dict]:
+        """讀取檢查點，步驟紀錄與 agent 歷史項目併回 history 與 agent_state"""
+        record = self.load_state(key)
+        if record is None or 'offset' not in record:
+            return record  # 舊格式的檢查點整份存在狀態檔中
+        history, items = [], []
+        try:
+            with open(self._steps_path(key), 'rb') as f:
+                data = f.read(record['offset'])
+        except FileNotFoundError:
+            return None
+        for line in data.splitlines():
+            entry = json.loads(line)
+            (history if 'history' in entry else items).append(entry.get('history', entry.get('item')))
+        if len(history) != record['steps']:
+            return None
+        record['history'] = {'history': history}
+        record['agent_state']['message_manager_state']['agent_history_items'] = items
+        return record
+
+    def exists(self, key: str) -> bool:
+        try:
+            return os.path.exists(self._path(key))
+        except ValueError:
+            return False
+
+    def delete(self, key: str):
+        for path in (self._path(key), self._steps_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def record_resume(self, steps: int):
+        self._stats['resumed'] += 1
+        self._stats['steps_restored'] += steps
+
+    def evict(self) -> int:
+        """刪除超過保存期限的檢查點"""
+        now = time.time()
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(('.json', STEPS_SUFFIX)) and now - entry.stat().st_mtime > self.max_age:
+                try:
+                    os.remove(entry.path)
+                    removed += entry.name.endswith('.json')
+                except FileNotFoundError:
+                    pass
+        self._stats['evicted'] += removed
+        return removed
+
+    def get_metrics(self) -> Dict:
+        files = [entry for entry in os.scandir(self.root) if entry.name.endswith(('.json', STEPS_SUFFIX))]
+        return {
+            'root': self.root,
+            'checkpoints': sum(entry.name.endswith('.json') for entry in files),
+            'bytes': sum(entry.stat().st_size for entry in files),
+            **self._stats,
+        }
+
+
+def _slim_history_item(item) -> Dict:
+    """步驟紀錄的 dict，不含截圖與互動元素的 DOM 資訊（還原後的 agent 會重新截圖）"""
+    dumped = item.model_dump()
+    state = dumped['state']
+    state['screenshot'] = None
+    state['interacted_element'] = [None] * len(state['interacted_element'] or [])
+    return dumped
+
+
+class CheckpointRecorder:
+    """
+    單一嘗試的檢查點寫入：每個成功的步驟只附加上次寫入之後的新紀錄，序列化在執行緒中進行
+
+    Args:
+        store: 檢查點儲存
+        key: 檢查點 ID
+    """
+
+    def __init__(self, store: CheckpointStore, key: str):
+        self.store = store
+        self.key = key
+        self._position: Optional[Dict] = None
+
+    def _start(self, restored_steps: int) -> Dict:
+        # 由同一個檢查點還原時接在已寫入的紀錄之後，否則（含由其他檢查點還原）從頭寫入
+        record = self.store.load_state(self.key) if restored_steps else None
+        if record and 'offset' in record and record['steps'] == restored_steps:
+            return {'steps': record['steps'], 'items': record['items'], 'offset': record['offset']}
+        return {'steps': 0, 'items': 0, 'offset': 0}
+
+    async def capture(self, agent, task: str, restored_steps: int = 0) -> bool:
+        """
+        寫入 agent 目前的狀態；最後一步失敗時不寫入（保留前一個成功步驟的檢查點），回傳是否有寫入
+
+        Args:
+            restored_steps: 這次嘗試開始時由檢查點還原的步驟數
+        """
+        history = agent.state.history
+        if not history.history or any(result.error for result in history.history[-1].result):
+            return False
+
+        session = agent.browser_session
+        url = history.history[-1].state.url
+        storage_state = None
+        try:
+            url = (await session.get_current_page()).url
+            storage_state = await session.browser_context.storage_state()
+        except Exception as e:
+            print(f"擷取瀏覽器狀態失敗，檢查點不含 cookie: {e}")
+
+        # agent 在步驟結束的 hook 完成前不會繼續執行，在執行緒中序列化不會讀到修改中的狀態
+        await asyncio.to_thread(self._write, agent, task, url, storage_state, restored_steps)
+        return True
+
+    def _write(self, agent, task: str, url: str, storage_state: Optional[Dict], restored_steps: int):
+        if self._position is None:
+            self._position = self._start(restored_steps)
+        position = self._position
+        history = agent.state.history.history
+        items = agent.state.message_manager_state.agent_history_items
+        lines = [dumps({'history': _slim_history_item(item)}) for item in history[position['steps']:]]
+        lines += [dumps({'item': item.model_dump(mode='json')}) for item in items[position['items']:]]
+        record = {
+            'task': task,
+            'steps': len(history),
+            'items': len(items),
+            'url': url,
+            # 狀態訊息（頁面元素與截圖）每步重建，不寫入
+            'agent_state': agent.state.model_dump(mode='json', exclude=AGENT_STATE_EXCLUDE),
+            'storage_state': storage_state,
+            'saved_at': time.time(),
+        }
+        position['offset'] = self.store.save(self.key, record, lines, position['offset'])
+        position['steps'], position['items'] = len(history), len(items)
+
+
+def restore_agent_state(checkpoint: Dict) -> 'AgentState':
+    """由檢查點建立 injected_agent_state（步驟紀錄需等 Agent 建立後以 restore_history 還原）"""
+    from browser_use.agent.views import AgentState
+
+    state = AgentState.model_validate(checkpoint['agent_state'])
+    state.consecutive_failures = 0
+    return state
+
+
+def restore_history(agent, checkpoint: Dict):
+    """還原步驟紀錄；動作需以該 Agent 的動作模型解析，才能保留自訂動作的參數"""
+    from browser_use.agent.views import AgentHistoryList
+
+    data = copy.deepcopy(checkpoint['history'])
+    for item in data['history']:
+        if item['model_output']:
+            item['model_output'] = agent.AgentOutput.model_validate(item['model_output'])
+    agent.state.history = AgentHistoryList.model_validate(data)
@@ -0,0 +1,246 @@
+"""
+LLM 上下文壓縮模組
+長任務每次呼叫 LLM 都帶著完整的步驟紀錄（<agent_history>），輸入 token 與延遲隨步驟數成長；
+這裡在 Agent 與 LLM 之間保留最近 K 個步驟的原文，較早的步驟壓成每步一行的目標與結果摘要，
+移除過時的截圖，並在超過每次呼叫的 token 上限時逐步縮減
+"""
+
+import asyncio
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from llm_cache import ChatModelWrapper, estimate_tokens
+
+_HISTORY_PATTERN = re.compile(r'<agent_history>\n(.*?)\n</agent_history>', re.DOTALL)
+_ITEM_PATTERN = re.compile(r'<(step_\w+|sys)>\n?(.*?)\n?</\1>', re.DOTALL)
+_BROWSER_STATE_PATTERN = re.compile(r'(<browser_state>\n)(.*?)(\n</browser_state>)', re.DOTALL)
+
+PREVIOUS_SCREENSHOT_LABEL = 'Previous screenshot:'
+SUMMARY_NOTE = 'Older steps condensed to their goal and outcome; their memory and extracted page content were dropped.'
+TRUNCATED_MARK = '\n... [truncated to fit the context budget] ...\n'
+
+
+def _clip(text: str, limit: int) -> str:
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+
+def summarize_step(name: str, body: str, limit: int) -> str:
+    """單一步驟的一行摘要：評估結果、目標與動作結果（不含 memory 與擷取的頁面內容全文）"""
+    if name == 'sys':
+        return _clip(body, limit)
+    fields = {}
+    results: Optional[List[str]] = None
+    for line in body.split('\n'):
+        if results is not None:
+            results.append(line)
+        elif line == 'Action Results:':
+            results = []
+        else:
+            for label, key in (('Evaluation of Previous Step:', 'eval'), ('Memory:', 'memory'), ('Next Goal:', 'goal')):
+                if line.startswith(label):
+                    fields[key] = line[len(label):].strip()
+                    break
+    if not fields and not results:
+        return _clip(f'{name}: error: {body}', limit)  # 出錯的步驟只有錯誤訊息
+    parts = []
+    if fields.get('eval'):
+        parts.append(f"eval: {_clip(fields['eval'], limit // 4)}")
+    if fields.get('goal'):
+        parts.append(f"goal: {_clip(fields['goal'], limit // 3)}")
+    if results:
+        parts.append(f"outcome: {' '.join(results)}")
+    return _clip(f"{name}: {' | '.join(parts)}", limit)
+
+
+class ContextCompactor:
+    """
+    單一任務的上下文壓縮
+
+    Args:
+        keep_steps: 保留原文的最近步驟數
+        max_tokens: 每次呼叫的估計輸入 token 上限（0 為不限）；超過時依序減少保留的步驟、
+                    省略最舊的摘要、截斷頁面元素清單
+        summary_chars: 每個被壓縮步驟的摘要長度上限
+        enabled: False 時不修改訊息，只統計 token
+    """
+
+    def __init__(self, keep_steps: Optional[int] = None, max_tokens: Optional[int] = None,
+                 summary_chars: Optional[int] = None, enabled: Optional[bool] = None):
+        self.keep_steps = max(1, keep_steps if keep_steps is not None else int(os.getenv('CONTEXT_KEEP_STEPS', '6')))
+        self.max_tokens = max_tokens if max_tokens is not None else int(os.getenv('CONTEXT_MAX_TOKENS', '32000'))
+        self.summary_chars = summary_chars or int(os.getenv('CONTEXT_SUMMARY_CHARS', '200'))
+        self.enabled = enabled if enabled is not None else os.getenv('CONTEXT_COMPACTION', 'true').lower() == 'true'
+        self._stats = {
+            'calls': 0, 'compacted_calls': 0, 'compacted_steps': 0, 'dropped_images': 0, 'over_budget': 0,
+            'tokens_before': 0, 'tokens_after': 0, 'peak_tokens_after': 0, 'processing_seconds': 0.0,
+        }
+
+    def wrap(self, llm) -> 'CompactingChatModel':
+        return CompactingChatModel(llm, self)
+
+    def process(self, messages: List[Any]) -> List[Any]:
+        """回傳壓縮後的訊息（有修改的訊息會複製一份，不修改 Agent 保存的原訊息）"""
+        start = time.perf_counter()
+        before = estimate_tokens(messages)
+        self._stats['calls'] += 1
+        self._stats['tokens_before'] += before
+        if self.enabled:
+            messages = self._compact(messages)
+        after = estimate_tokens(messages)
+        self._stats['tokens_after'] += after
+        self._stats['peak_tokens_after'] = max(self._stats['peak_tokens_after'], after)
+        if self.max_tokens and after > self.max_tokens:
+            self._stats['over_budget'] += 1
+        self._stats['processing_seconds'] += time.perf_counter() - start
+        return messages
+
+    def _compact(self, messages: List[Any]) -> List[Any]:
+        # 最後一則含 <agent_history> 的訊息是這一步的狀態訊息
+        index = next((i for i in range(len(messages) - 1, -1, -1) if _HISTORY_PATTERN.search(_text_of(messages[i]))), None)
+        if index is None:
+            return messages
+        messages = list(messages)
+        for i, message in enumerate(messages):
+            messages[i] = self._drop_stale_images(message, keep_last=(i == index))
+
+        state = messages[index]
+        others = estimate_tokens(messages[:index] + messages[index + 1:])
+        keep, summary_lines, browser_limit = self.keep_steps, None, None
+        while True:
+            compacted, steps = self._rewrite(state, keep, summary_lines, browser_limit)
+            if not self.max_tokens or others + estimate_tokens([compacted]) <= self.max_tokens:
+                break
+            # 依序縮減：保留的步驟 → 最舊的摘要 → 頁面元素清單
+            if keep > 1:
+                keep -= 1
+            elif summary_lines is None or summary_lines > 0:
+                summary_lines = 8 if summary_lines is None else summary_lines // 2
+            else:
+                if browser_limit is None:
+                    match = _BROWSER_STATE_PATTERN.search(_text_of(state))
+                    browser_limit = len(match.group(2)) if match else 0
+                browser_limit //= 2
+                if browser_limit < 2000:
+                    break
+        if steps:
+            self._stats['compacted_calls'] += 1
+            self._stats['compacted_steps'] = max(self._stats['compacted_steps'], steps)
+        messages[index] = compacted
+        return messages
+
+    def _drop_stale_images(self, message, keep_last: bool):
+        """狀態訊息只保留最後一張（目前的）截圖，其他訊息中的截圖都移除"""
+        content = getattr(message, 'content', None)
+        if not isinstance(content, list):
+            return message
+        images = [i for i, part in enumerate(content) if getattr(part, 'type', None) == 'image_url']
+        stale = set(images[:-1] if keep_last else images)
+        if not stale:
+            return message
+        kept = []
+        for i, part in enumerate(content):
+            if i in stale:
+                # 連同前面的「Previous screenshot:」標籤一起移除
+                if kept and getattr(kept[-1], 'text', None) == PREVIOUS_SCREENSHOT_LABEL:
+                    kept.pop()
+                continue
+            kept.append(part)
+        self._stats['dropped_images'] += len(stale)
+        return message.model_copy(update={'content': kept})
+
+    def _rewrite(self, message, keep: int, summary_lines: Optional[int], browser_limit: Optional[int]) -> Tuple[Any, int]:
+        compacted_steps = 0
+
+        def rewrite_text(text: str) -> str:
+            nonlocal compacted_steps
+            match = _HISTORY_PATTERN.search(text)
+            if match:
+                history, compacted_steps = self._compact_history(match.group(1), keep, summary_lines)
+                text = text[:match.start(1)] + history + text[match.end(1):]
+            if browser_limit is not None:
+                text = _BROWSER_STATE_PATTERN.sub(
+                    lambda m: m.group(1) + _truncate_middle(m.group(2), browser_limit) + m.group(3), text, count=1
+                )
+            return text
+
+        content = message.content
+        if isinstance(content, str):
+            return message.model_copy(update={'content': rewrite_text(content)}), compacted_steps
+        parts = [
+            part.model_copy(update={'text': rewrite_text(part.text)}) if getattr(part, 'type', None) == 'text' else part
+            for part in content
+        ]
+        return message.model_copy(update={'content': parts}), compacted_steps
+
+    def _compact_history(self, history: str, keep: int, summary_lines: Optional[int]) -> Tuple[str, int]:
+        items = list(_ITEM_PATTERN.finditer(history))
+        if '\n'.join(item.group(0) for item in items) != history:
+            return history, 0  # 無法完整解析的格式不修改
+        steps = [i for i, item in enumerate(items) if item.group(1).startswith('step_')]
+        if len(steps) <= keep:
+            return history, 0
+        cutoff = steps[-keep]
+        old, recent = items[:cutoff], items[cutoff:]
+        lines = [summarize_step(item.group(1), item.group(2), self.summary_chars) for item in old]
+        if summary_lines is not None and len(lines) > summary_lines:
+            omitted = len(lines) - summary_lines
+            lines = [f'[{omitted} earlier steps omitted]'] + (lines[-summary_lines:] if summary_lines else [])
+        numbers = [item.group(1)[5:] for item in old if item.group(1).startswith('step_')]
+        summary = (
+            f'<compacted_history steps="{numbers[0]}-{numbers[-1]}">\n{SUMMARY_NOTE}\n'
+            + '\n'.join(lines) + '\n</compacted_history>'
+        )
+        verbatim = '\n'.join(item.group(0) for item in recent)
+        return f'{summary}\n{verbatim}', len(numbers)
+
+    def report(self) -> Dict:
+        stats = self._stats
+        return {
+            'enabled': self.enabled,
+            'keep_steps': self.keep_steps,
+            'max_tokens': self.max_tokens,
+            'calls': stats['calls'],
+            'compacted_calls': stats['compacted_calls'],
+            'compacted_steps': stats['compacted_steps'],
+            'dropped_images': stats['dropped_images'],
+            'over_budget': stats['over_budget'],
+            'tokens_before': stats['tokens_before'],
+            'tokens_after': stats['tokens_after'],
+            'saved_tokens': stats['tokens_before'] - stats['tokens_after'],
+            'peak_tokens_after': stats['peak_tokens_after'],
+            'processing_ms': round(stats['processing_seconds'] * 1000, 1),
+        }
+
+
+def _text_of(message) -> str:
+    content = getattr(message, 'content', None)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return ''.join(getattr(part, 'text', '') or '' for part in content)
+    return ''
+
+
+def _truncate_middle(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    head = limit * 2 // 3
+    return text[:head] + TRUNCATED_MARK + text[-(limit - head):]
+
+
+class CompactingChatModel(ChatModelWrapper):
+    """
+    呼叫前先壓縮上下文的 LLM 包裝
+
+    包在截圖前處理與 LLMCallCache 的包裝外層。
+    """
+
+    def __init__(self, llm, compactor: ContextCompactor):
+        super().__init__(llm)
+        self._compactor = compactor
+
+    async def transform(self, messages: List[Any]) -> List[Any]:
+        return await asyncio.to_thread(self._compactor.process, messages)
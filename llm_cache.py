@@ -0,0 +1,444 @@
+"""
+LLM 呼叫快取模組
+包裝傳給 Agent 的 LLM：相同訊息與模型參數的回應存入 SQLite 重複使用，
+同時進行的相同呼叫只送出一次，並以全域併發數與每分鐘 token 上限避免 429；
+record / replay 模式可錄下真實回應後離線重播整個流程
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from retry_policy import parse_retry_after
+
+if TYPE_CHECKING:  # browser-use 匯入較慢，只在解碼快取的回應時才載入
+    from browser_use.llm.views import ChatInvokeCompletion
+
+# 快取模式
+LLM_CACHE_OFF = 'off'        # 不使用快取（仍套用限流）
+LLM_CACHE_ON = 'on'          # 讀取並寫入快取
+LLM_CACHE_RECORD = 'record'  # 一律呼叫模型並寫入快取
+LLM_CACHE_REPLAY = 'replay'  # 只讀取快取，不呼叫模型（忽略 TTL）
+
+# 納入快取鍵的模型參數
+MODEL_PARAM_FIELDS = ('temperature', 'top_p', 'seed', 'max_completion_tokens', 'reasoning_effort')
+
+# 估算 token 用：每張圖片約略的 token 數
+IMAGE_TOKEN_ESTIMATE = 1000
+
+
+class LLMReplayMiss(Exception):
+    """replay 模式下找不到錄製的回應"""
+
+
+@functools.lru_cache(maxsize=256)
+def _schema_digest(output_format: type) -> str:
+    """輸出格式的 JSON schema 雜湊（Agent 每次會動態建立 AgentOutput 類別）"""
+    schema = json.dumps(output_format.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(schema.encode('utf-8')).hexdigest()
+
+
+def make_call_key(messages: List[Any], output_format: Optional[type], model: str, params: Dict) -> str:
+    """以訊息內容、輸出格式與模型參數計算快取鍵"""
+    digest = hashlib.sha256()
+    header = {
+        'model': model,
+        'params': params,
+        'output_format': _schema_digest(output_format) if output_format is not None else None,
+    }
+    digest.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+    for message in messages:
+        # cache 欄位只是提供者端的快取提示，不影響回應
+        digest.update(message.model_dump_json(exclude={'cache'}).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def estimate_tokens(messages: List[Any]) -> int:
+    """約略估算訊息的 token 數（每 4 個字元約 1 token，圖片以固定值計，low detail 的圖片固定 85）"""
+    chars, image_tokens = 0, 0
+    for message in messages:
+        content = getattr(message, 'content', None)
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if getattr(part, 'type', None) == 'image_url':
+                    image_tokens += 85 if part.image_url.detail == 'low' else IMAGE_TOKEN_ESTIMATE
+                else:
+                    chars += len(getattr(part, 'text', '') or '')
+    return chars // 4 + image_tokens
+
+
+class SQLiteLLMStore:
+    """
+    以 SQLite 保存 LLM 回應
+
+    每次讀取更新 last_used，超過總大小上限時依最久未使用順序刪除。
+    """
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_calls ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_last_used ON llm_calls (last_used)")
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: str, max_age: Optional[float] = None) -> Optional[Dict]:
+        async with self._lock:
+            return await asyncio.to_thread(self._get, key, max_age)
+
+    def _get(self, key: str, max_age: Optional[float]) -> Optional[Dict]:
+        row = self._conn.execute("SELECT created_at, data FROM llm_calls WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if max_age is not None and now - row[0] > max_age:
+            self._conn.execute("DELETE FROM llm_calls WHERE key = ?", (key,))
+            self._conn.commit()
+            return None
+        self._conn.execute("UPDATE llm_calls SET last_used = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        return json.loads(row[1])
+
+    async def put(self, key: str, model: str, record: Dict):
+        data = json.dumps(record, ensure_ascii=False)
+        async with self._lock:
+            await asyncio.to_thread(self._put, key, model, data)
+
+    def _put(self, key: str, model: str, data: str):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO llm_calls (key, model, created_at, last_used, size, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, now, now, len(data), data)
+        )
+        if self.max_bytes:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_calls").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute("SELECT key, size FROM llm_calls ORDER BY last_used").fetchall()
+                doomed = []
+                for old_key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((old_key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM llm_calls WHERE key = ?", doomed)
+        self._conn.commit()
+
+    async def stats(self) -> Dict:
+        async with self._lock:
+            count, size = await asyncio.to_thread(
+                lambda: self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_calls").fetchone()
+            )
+        return {'entries': count, 'bytes': size}
+
+    async def close(self):
+        self._conn.close()
+
+
+class TokenRateLimiter:
+    """
+    全域 LLM 限流：併發上限 + 每分鐘 token 數（token bucket）
+
+    呼叫前以估算值扣除額度，完成後依實際用量補扣或退回；
+    供應商回傳 429 時暫停所有呼叫直到 Retry-After 結束，避免其他 agent 繼續撞上限流。
+    """
+
+    def __init__(self, max_concurrency: int, tokens_per_minute: int = 0):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._waiting = 0
+        self._paused_until = 0.0
+        self.total_wait = 0.0
+        self.pauses = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._updated) * self.tokens_per_minute / 60)
+        self._updated = now
+
+    async def acquire(self, tokens: int):
+        start = time.monotonic()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+            try:
+                while self._paused_until > time.monotonic():
+                    await asyncio.sleep(self._paused_until - time.monotonic())
+            except BaseException:
+                self._semaphore.release()
+                raise
+            if self.tokens_per_minute:
+                # 單次呼叫超過整個額度時只要求補滿，避免永遠等不到
+                tokens = min(tokens, self.tokens_per_minute)
+                try:
+                    self._refill()
+                    while self._tokens < tokens:
+                        await asyncio.sleep((tokens - self._tokens) * 60 / self.tokens_per_minute)
+                        self._refill()
+                except BaseException:
+                    self._semaphore.release()
+                    raise
+                self._tokens -= tokens
+        finally:
+            self._waiting -= 1
+            self.total_wait += time.monotonic() - start
+
+    def release(self, estimated: int, actual: Optional[int]):
+        self._semaphore.release()
+        if self.tokens_per_minute and actual is not None:
+            self._refill()
+            self._tokens -= actual - min(estimated, self.tokens_per_minute)
+
+    def pause(self, seconds: float):
+        """暫停所有呼叫 seconds 秒（已暫停得更久時不縮短）"""
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self.pauses += 1
+
+    def get_metrics(self) -> Dict:
+        if self.tokens_per_minute:
+            self._refill()
+        return {
+            'max_concurrency': self.max_concurrency,
+            'tokens_per_minute': self.tokens_per_minute or None,
+            'available_tokens': int(self._tokens) if self.tokens_per_minute else None,
+            'waiting': self._waiting,
+            'total_wait_seconds': round(self.total_wait, 3),
+            'paused_seconds': round(max(0.0, self._paused_until - time.monotonic()), 3),
+            'pauses': self.pauses,
+        }
+
+
+class LLMCallCache:
+    """
+    所有 Agent 共用的 LLM 呼叫快取、合併與限流狀態
+
+    Args:
+        mode: off / on / record / replay
+        store: 回應儲存；未提供時依 LLM_CACHE_DB_PATH 建立 SQLite
+        ttl: 回應有效秒數（replay 模式忽略）
+        limiter: 全域限流
+    """
+
+    def __init__(
+        self,
+        mode: Optional[str] = None,
+        store: Optional[SQLiteLLMStore] = None,
+        ttl: Optional[float] = None,
+        limiter: Optional[TokenRateLimiter] = None,
+    ):
+        self.mode = mode or os.getenv('LLM_CACHE_MODE', LLM_CACHE_OFF)
+        if self.mode not in (LLM_CACHE_OFF, LLM_CACHE_ON, LLM_CACHE_RECORD, LLM_CACHE_REPLAY):
+            raise ValueError(f"不支援的 LLM 快取模式: {self.mode}")
+        self.ttl = ttl if ttl is not None else float(os.getenv('LLM_CACHE_TTL', '86400'))
+        if store is None and self.mode != LLM_CACHE_OFF:
+            store = SQLiteLLMStore(
+                os.getenv('LLM_CACHE_DB_PATH', 'llm_cache.db'),
+                max_bytes=int(float(os.getenv('LLM_CACHE_MAX_MB', '512')) * 1024 * 1024),
+            )
+        self.store = store
+        self.limiter = limiter or TokenRateLimiter(
+            max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '8')),
+            tokens_per_minute=int(os.getenv('LLM_TOKENS_PER_MINUTE', '0')),
+        )
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {'calls': 0, 'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0, 'tokens_saved': 0}
+
+    def wrap(self, llm) -> 'CachedChatModel':
+        """包裝 LLM 供單一 Agent 使用"""
+        return CachedChatModel(llm, self)
+
+    async def invoke(self, llm, messages: List[Any], output_format: Optional[type] = None) -> 'ChatInvokeCompletion':
+        self._stats['calls'] += 1
+        if self.mode == LLM_CACHE_OFF:
+            return await self._call(llm, messages, output_format)
+
+        params = {name: getattr(llm, name) for name in MODEL_PARAM_FIELDS if getattr(llm, name, None) is not None}
+        key = make_call_key(messages, output_format, llm.model, params)
+
+        if self.mode in (LLM_CACHE_ON, LLM_CACHE_REPLAY):
+            max_age = None if self.mode == LLM_CACHE_REPLAY else self.ttl
+            record = await self.store.get(key, max_age)
+            if record is not None:
+                self._stats['hits'] += 1
+                self._stats['tokens_saved'] += (record.get('usage') or {}).get('total_tokens', 0)
+                return self._decode(record, output_format)
+            self._stats['misses'] += 1
+            if self.mode == LLM_CACHE_REPLAY:
+                raise LLMReplayMiss(f"replay 模式找不到錄製的 LLM 回應: {key}")
+
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                self._stats['coalesced'] += 1
+                try:
+                    record = await asyncio.shield(inflight)
+                    return self._decode(record, output_format)
+                except asyncio.CancelledError:
+                    # 自己被取消時往上拋；若是領頭的呼叫被取消，改由自己呼叫
+                    if not inflight.cancelled():
+                        raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await self._call(llm, messages, output_format)
+            record = self._encode(response)
+            await self.store.put(key, llm.model, record)
+            future.set_result(record)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def _call(self, llm, messages: List[Any], output_format: Optional[type]) -> 'ChatInvokeCompletion':
+        estimated = estimate_tokens(messages)
+        await self.limiter.acquire(estimated)
+        actual = None
+        try:
+            response = await llm.ainvoke(messages, output_format)
+            actual = response.usage.total_tokens if response.usage else None
+            return response
+        except Exception as e:
+            self._stats['errors'] += 1
+            retry_after = parse_retry_after(e)
+            if retry_after is None and getattr(e, 'status_code', None) == 429:
+                retry_after = 1.0
+            if retry_after:
+                self.limiter.pause(retry_after)
+            raise
+        finally:
+            self.limiter.release(estimated, actual)
+
+    def _encode(self, response: 'ChatInvokeCompletion') -> Dict:
+        completion = response.completion
+        return {
+            'completion': completion if isinstance(completion, str) else completion.model_dump(mode='json'),
+            'thinking': response.thinking,
+            'redacted_thinking': response.redacted_thinking,
+            'usage': response.usage.model_dump() if response.usage else None,
+        }
+
+    def _decode(self, record: Dict, output_format: Optional[type]) -> 'ChatInvokeCompletion':
+        from browser_use.llm.views import ChatInvokeCompletion
+
+        completion = record['completion']
+        if output_format is not None:
+            completion = output_format.model_validate(completion)
+        # 快取命中沒有實際花費 token，不回報用量
+        return ChatInvokeCompletion(
+            completion=completion,
+            thinking=record.get('thinking'),
+            redacted_thinking=record.get('redacted_thinking'),
+            usage=None,
+        )
+
+    async def get_metrics(self) -> Dict:
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            'mode': self.mode,
+            'ttl': self.ttl,
+            'inflight': len(self._inflight),
+            'hit_rate': round(self._stats['hits'] / lookups, 3) if lookups else None,
+            **self._stats,
+            'store': await self.store.stats() if self.store else None,
+            'limiter': self.limiter.get_metrics(),
+        }
+
+    async def close(self):
+        if self.store:
+            await self.store.close()
+
+
+class ChatModelWrapper:
+    """
+    符合 browser-use BaseChatModel 介面的 LLM 包裝基底
+
+    子類別覆寫 transform() 在呼叫前改寫訊息；其他屬性（例如 temperature）沿用內層的 LLM。
+    """
+
+    _verified_api_keys: bool = False
+
+    def __init__(self, llm):
+        self._llm = llm
+        self._verified_api_keys = getattr(llm, '_verified_api_keys', False)
+
+    @property
+    def model(self) -> str:
+        return self._llm.model
+
+    @property
+    def provider(self) -> str:
+        return self._llm.provider
+
+    @property
+    def name(self) -> str:
+        return self._llm.name
+
+    @property
+    def model_name(self) -> str:
+        return self._llm.model
+
+    async def transform(self, messages: List[Any]) -> List[Any]:
+        """呼叫前改寫訊息（預設不修改）"""
+        return messages
+
+    async def ainvoke(self, messages: List[Any], output_format: Optional[type] = None) -> 'ChatInvokeCompletion':
+        return await self._llm.ainvoke(await self.transform(messages), output_format)
+
+    def __getattr__(self, name: str):
+        if name.startswith('__') or name == '_llm':
+            raise AttributeError(name)
+        return getattr(self._llm, name)
+
+
+class CachedChatModel(ChatModelWrapper):
+    """
+    經過 LLMCallCache 的 LLM 包裝
+
+    每個 Agent 使用各自的包裝實例（Agent 會替傳入的 LLM 掛上用量統計），
+    快取、合併與限流狀態則由 LLMCallCache 共用。
+    """
+
+    def __init__(self, llm, cache: LLMCallCache):
+        super().__init__(llm)
+        self._cache = cache
+        # 這個 Agent 的每次呼叫（開始的 Unix 時間, 耗時秒數）與實際 token 用量（快取命中不計 token）
+        self.calls: List[tuple] = []
+        self.usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+
+    async def ainvoke(self, messages: List[Any], output_format: Optional[type] = None) -> 'ChatInvokeCompletion':
+        messages = await self.transform(messages)
+        started_at, start = time.time(), time.perf_counter()
+        response = await self._cache.invoke(self._llm, messages, output_format)
+        self.calls.append((started_at, time.perf_counter() - start))
+        if response.usage:
+            self.usage['prompt_tokens'] += response.usage.prompt_tokens
+            self.usage['completion_tokens'] += response.usage.completion_tokens
+            self.usage['total_tokens'] += response.usage.total_tokens
+        return response
@@ -0,0 +1,280 @@
+"""
+服務指標模組
+輕量的 Counter / Gauge / Histogram 與 Prometheus 文字格式、OpenMetrics 格式輸出（GET /metrics）。
+記錄一筆數值只做一次字典查詢與數值累加；佇列深度、瀏覽器數、記憶體等狀態以函數在擷取時計算，
+平常不花任何成本。
+"""
+
+import math
+import os
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import psutil
+except ImportError:  # psutil 為選用依賴，未安裝時改讀 /proc/self/statm
+    psutil = None
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# 各階段耗時（秒）的 bucket，涵蓋毫秒級的序列化到數分鐘的整個任務
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: Optional['Registry'] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self.labels()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        """取得某組標籤值的子指標（熱路徑上可先取得後重複使用）"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要標籤 {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """只增不減的計數（名稱不含 _total，輸出時自動加上）"""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [
+            f'{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value)}'
+            for values, child in self._children.items()
+        ]
+
+
+class _GaugeChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    """
+    目前狀態
+
+    set_function 設定的函數在擷取時才呼叫；有標籤時函數回傳 {標籤值 tuple: 數值}，
+    沒有標籤時回傳數值，回傳 None 表示目前沒有資料。
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable] = None
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable):
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is None:
+            values = {labels: child.value for labels, child in self._children.items()}
+        else:
+            try:
+                result = self._function()
+            except Exception as e:
+                print(f"計算指標 {self.name} 失敗: {e}")
+                return []
+            if result is None:
+                return []
+            values = result if isinstance(result, dict) else {(): result}
+        return [
+            f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(float(value))}'
+            for labels, value in values.items() if value is not None
+        ]
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """數值分布（bucket 上限含等於，與 Prometheus 相同）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = PHASE_BUCKETS, registry: Optional['Registry'] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(child.sum)}')
+            lines.append(f'{self.name}_count{labels} {child.count}')
+        return lines
+
+
+class Registry:
+    """已註冊指標的集合"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"指標名稱重複: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self, openmetrics: bool = False) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            name = metric.name if openmetrics or metric.kind != 'counter' else f'{metric.name}_total'
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            lines.extend(metric.samples())
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def process_rss() -> Optional[int]:
+    """本行程的常駐記憶體（bytes）"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# 任務生命週期
+PHASE_SECONDS = Histogram(
+    'agent_phase_seconds',
+    '任務各階段耗時（pacing、admission_wait、browser_launch、llm_call、step、serialize、callback_delivery、attempt、task）',
+    ['phase'],
+)
+TASKS = Counter('agent_tasks', '完成的任務數（依最終狀態）', ['status'])
+ATTEMPTS = Counter('agent_attempts', '執行的嘗試次數')
+ATTEMPT_FAILURES = Counter('agent_attempt_failures', '失敗的嘗試次數（依失敗類型）', ['failure'])
+RETRIES = Counter('agent_retries', '實際進行的重試次數（依失敗類型）', ['failure'])
+STEPS = Counter('agent_steps', '執行的 agent 步驟數')
+
+# LLM
+LLM_CALLS = Counter('llm_calls', 'agent 送出的 LLM 呼叫數（含快取命中）')
+LLM_TOKENS = Counter('llm_tokens', 'LLM 實際用量（依 token 種類，快取命中不計）', ['kind'])
+VISION_IMAGES = Counter('llm_vision_images', '送進 LLM 前處理的截圖數（依結果：sent、deduped）', ['outcome'])
+VISION_SAVINGS = Counter('llm_vision_savings', '截圖前處理省下的量（依種類：bytes、image_tokens）', ['kind'])
+LLM_CONTEXT = Counter('llm_context_tokens', '上下文壓縮前後送進 LLM 的估計輸入 token 數（依階段：before、after）', ['stage'])
+TASK_LLM_TOKENS = Histogram('agent_run_llm_tokens', '每次執行的 LLM 總 token 數', buckets=TOKEN_BUCKETS)
+
+# 回調
+CALLBACK_DELIVERIES = Counter('callback_delivery_attempts', '回調派送嘗試數（依結果：delivered、failed）', ['outcome'])
+CALLBACK_DEAD_LETTERS = Counter('callback_dead_letters', '重試用盡後寫入 dead letter 的回調數')
+
+# 狀態（擷取時計算，由 agent_api 設定函數）
+ACTIVE_BROWSERS = Gauge('browser_pool_browsers', '瀏覽器池中的瀏覽器數（依狀態）', ['state'])
+RUNNING_AGENTS = Gauge('agent_running', '正在執行的 agent 數（每個佔用一個瀏覽器或 context）')
+QUEUE_DEPTH = Gauge('queue_depth', '等待中的項目數（依佇列）', ['queue'])
+PROCESS_MEMORY = Gauge('process_resident_memory_bytes', 'API 主行程的常駐記憶體')
+AVAILABLE_MEMORY = Gauge('system_available_memory_bytes', '系統（或容器）可用記憶體')
+PROCESS_MEMORY.set_function(process_rss)
+
+# 瀏覽器記憶體監控
+BROWSER_MEMORY = Gauge('browser_resident_memory_bytes', '池中各瀏覽器行程樹的 RSS（最近一次取樣）', ['browser'])
+BROWSER_FDS = Gauge('browser_open_fds', '池中各瀏覽器行程樹的檔案描述元數（最近一次取樣）', ['browser'])
+BROWSER_RECYCLES = Counter('browser_recycles', '瀏覽器池回收的瀏覽器數（依原因：max_tasks、crashed、rss、fds、leak）', ['reason'])
+BROWSER_ORPHANS_KILLED = Counter('browser_orphan_processes_killed', '強制結束的孤兒瀏覽器行程數')
+
+# 服務啟動
+STARTUP_PHASE_SECONDS = Gauge('startup_phase_seconds', '服務啟動各階段的耗時', ['phase'])
+SERVICE_READY = Gauge('service_ready', '服務是否已就緒（1 為就緒）')
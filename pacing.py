@@ -0,0 +1,155 @@
+"""
+執行節奏模組
+依任務的 execution_profile 決定瀏覽器的 slow_mo 與每個網站的操作速率上限：
+以網站為單位限速（paced 另在任務自己的步驟之間隨機間隔），取代每次嘗試前固定的隨機等待，
+並統計每個任務花在等待上的時間
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+from state_cache import site_of
+
+# rate: 每個網站每秒最多幾個 agent 步驟（None 為不限）；burst: 可連續執行而不等待的步驟數；
+# jitter: 任務自己的步驟之間以 delay_range 隨機間隔（不與其他任務共用）；slow_mo: 冷啟動瀏覽器每個操作的延遲（毫秒）
+PROFILES: Dict[str, Dict] = {
+    'fast': {'rate': None, 'burst': 1, 'jitter': False, 'slow_mo': 0},
+    'balanced': {'rate': 2.0, 'burst': 5, 'jitter': False, 'slow_mo': 0},
+    'paced': {'rate': None, 'burst': 1, 'jitter': True, 'slow_mo': (50, 150)},
+}
+
+
+def resolve_profile(profile: Optional[str]) -> str:
+    """未指定時為 balanced；paced 只在明確指定時使用"""
+    if profile is None:
+        return 'balanced'
+    if profile not in PROFILES:
+        raise ValueError(f"不支援的執行節奏: {profile}")
+    return profile
+
+
+def slow_mo_for(profile: str) -> int:
+    slow_mo = PROFILES[profile]['slow_mo']
+    return random.randint(*slow_mo) if isinstance(slow_mo, tuple) else slow_mo
+
+
+def _parse_site_rates(value: str) -> Dict[str, float]:
+    """PACING_SITE_RATES 格式：example.com=5,slow.example.org=0.2（0 為不限）"""
+    rates = {}
+    for item in value.split(','):
+        site, _, rate = item.partition('=')
+        if site.strip() and rate.strip():
+            rates[site_of(site.strip())] = float(rate)
+    return rates
+
+
+class SiteRateLimiter:
+    """
+    每個網站的操作速率上限（GCRA，同一行程內所有任務共用）
+
+    每次呼叫只做一次字典查詢與計算，不建立背景工作；等待的時段在呼叫時就先保留，
+    同時到達的任務依序排開而不會一起醒來。
+
+    Args:
+        site_rates: 個別網站的速率上限（每秒步驟數），優先於 profile 的預設值，所有 profile 都適用
+    """
+
+    def __init__(self, site_rates: Optional[Dict[str, float]] = None):
+        self.site_rates = site_rates if site_rates is not None else _parse_site_rates(os.getenv('PACING_SITE_RATES', ''))
+        self._tat: Dict[str, float] = {}
+        self._stats = {'waits': 0, 'wait_seconds': 0.0}
+
+    def reserve(self, site: str, interval: float, burst: int = 1) -> float:
+        """
+        保留下一個可執行的時間點
+
+        Args:
+            interval: 兩個步驟之間的最短間隔（秒），0 表示不限
+            burst: 可連續執行的步驟數
+
+        Returns:
+            需要等待的秒數
+        """
+        if site in self.site_rates:
+            rate = self.site_rates[site]
+            interval = 1 / rate if rate > 0 else 0.0
+        if interval <= 0:
+            return 0.0
+        now = time.monotonic()
+        tat = max(self._tat.get(site, now), now)
+        delay = max(0.0, tat - interval * (burst - 1) - now)
+        self._tat[site] = tat + interval
+        if len(self._tat) > 4096:
+            self._tat = {key: value for key, value in self._tat.items() if value > now}
+        if delay:
+            self._stats['waits'] += 1
+            self._stats['wait_seconds'] += delay
+        return delay
+
+    def get_metrics(self) -> Dict:
+        return {
+            'site_rates': self.site_rates,
+            'tracked_sites': len(self._tat),
+            'waits': self._stats['waits'],
+            'wait_seconds': round(self._stats['wait_seconds'], 3),
+        }
+
+
+class Pacer:
+    """
+    單一任務的執行節奏：每個 agent 步驟開始前依目前頁面所在的網站等待
+
+    Args:
+        profile: fast / balanced / paced
+        limiter: 共用的 SiteRateLimiter
+        delay_range: paced 時這個任務每步間隔的隨機範圍（秒）
+        sites: 任務描述中提到的網站，第一個步驟還在空白頁時以第一個網站計算
+    """
+
+    def __init__(self, profile: str, limiter: SiteRateLimiter, delay_range: Tuple[float, float] = (1, 3),
+                 sites: Iterable[str] = ()):
+        self.profile = profile
+        self.limiter = limiter
+        self.delay_range = delay_range
+        self.default_site = next(iter(sites), None)
+        self.waited: Dict[str, float] = defaultdict(float)
+        self.waits = 0
+        self._next_step: Optional[float] = None
+
+    def _jitter(self) -> float:
+        """paced：距離這個任務上一個步驟至少 delay_range 內的隨機秒數，第一個步驟不等待"""
+        now = time.monotonic()
+        delay = max(0.0, self._next_step - now) if self._next_step is not None else 0.0
+        self._next_step = now + delay + random.uniform(*self.delay_range)
+        return delay
+
+    async def before_step(self, url: Optional[str]) -> float:
+        """依網站的速率上限（paced 為任務自己的步驟間隔）等待，回傳等待的秒數"""
+        host = urlsplit(url).hostname if url else None
+        site = site_of(host) if host else self.default_site
+        if site is None:
+            return 0.0
+        settings = PROFILES[self.profile]
+        if settings['jitter']:
+            # 網站額度只在 PACING_SITE_RATES 有設定時才限制 paced 任務
+            delay = max(self._jitter(), self.limiter.reserve(site, 0.0))
+        else:
+            delay = self.limiter.reserve(site, 1 / settings['rate'] if settings['rate'] else 0.0, settings['burst'])
+        if delay:
+            self.waits += 1
+            self.waited[site] += delay
+            await asyncio.sleep(delay)
+        return delay
+
+    def report(self) -> Dict:
+        return {
+            'profile': self.profile,
+            'paced_seconds': round(sum(self.waited.values(), 0.0), 3),
+            'waits': self.waits,
+            'by_site': {site: round(seconds, 3) for site, seconds in self.waited.items()},
+        }
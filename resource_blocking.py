@@ -0,0 +1,239 @@
+"""
+資源攔截模組
+依任務選擇的 profile 在 BrowserContext 上攔截不需要的請求（圖片、影音、字型、廣告與分析追蹤），
+加快頁面載入並節省頻寬；同時統計放行/攔截的請求與位元組數以及頁面載入時間
+"""
+
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+# 各 profile 攔截的資源類型（Playwright 的 request.resource_type）與是否攔截廣告/追蹤網域；
+# text-only 保留樣式表，避免 agent 判斷元素是否可見時出錯
+PROFILES: Dict[str, Dict] = {
+    'full': {'types': frozenset(), 'trackers': False},
+    'no-media': {'types': frozenset({'image', 'media'}), 'trackers': True},
+    'text-only': {'types': frozenset({'image', 'media', 'font', 'ping'}), 'trackers': True},
+}
+
+# 常見的廣告與分析追蹤網域（含子網域）
+TRACKER_DOMAINS = (
+    'google-analytics.com', 'googletagmanager.com', 'googletagservices.com', 'doubleclick.net',
+    'googlesyndication.com', 'googleadservices.com', 'adservice.google.com', 'connect.facebook.net',
+    'hotjar.com', 'clarity.ms', 'segment.io', 'cdn.segment.com', 'mixpanel.com', 'amplitude.com',
+    'scorecardresearch.com', 'criteo.com', 'criteo.net', 'taboola.com', 'outbrain.com', 'adnxs.com',
+    'ads-twitter.com', 'analytics.tiktok.com', 'bat.bing.com', 'nr-data.net', 'mc.yandex.ru',
+)
+
+# 自架在第一方網域上的追蹤腳本（Network.setBlockedURLs 的萬用字元樣式）
+TRACKER_URL_PATTERNS = ('*/gtag/js*', '*/analytics.js*', '*/fbevents.js*', '*/collect?v=*')
+
+# Playwright 的資源類型對應到 CDP 的 Network.ResourceType
+CDP_RESOURCE_TYPES = {'image': 'Image', 'media': 'Media', 'font': 'Font', 'ping': 'Ping'}
+
+
+def domain_patterns(domains: Iterable[str]) -> List[str]:
+    """網域（含子網域）對應的 Network.setBlockedURLs 網址樣式"""
+    patterns = []
+    for domain in domains:
+        domain = domain.lower().strip().strip('.')
+        if domain:
+            patterns += [f'*://{domain}/*', f'*://*.{domain}/*']
+    return patterns
+
+
+_tracker_patterns: Optional[List[str]] = None
+
+
+def _default_patterns() -> List[str]:
+    """內建與 RESOURCE_BLOCK_DOMAINS 追加的追蹤網域及網址樣式（所有任務共用，只建立一次）"""
+    global _tracker_patterns
+    if _tracker_patterns is None:
+        extra = [domain.strip() for domain in os.getenv('RESOURCE_BLOCK_DOMAINS', '').split(',') if domain.strip()]
+        _tracker_patterns = domain_patterns(TRACKER_DOMAINS + tuple(extra)) + list(TRACKER_URL_PATTERNS)
+    return _tracker_patterns
+
+
+class ResourceBlocker:
+    """
+    單一任務的請求攔截與用量統計
+
+    Args:
+        profile: full / no-media / text-only
+        block_domains: 任務額外指定要攔截的網域
+        track_usage: 是否統計放行的請求與位元組（未指定時依 RESOURCE_STATS，預設 true）；
+                     不統計且不需攔截時完全不安裝
+    """
+
+    def __init__(self, profile: str = 'full', block_domains: Iterable[str] = (), track_usage: Optional[bool] = None):
+        if profile not in PROFILES:
+            raise ValueError(f"不支援的資源 profile: {profile}")
+        self.profile = profile
+        self.track_usage = (
+            track_usage if track_usage is not None else os.getenv('RESOURCE_STATS', 'true').lower() == 'true'
+        )
+        self.block_types = PROFILES[profile]['types']
+        self.url_patterns = (list(_default_patterns()) if PROFILES[profile]['trackers'] else []) + domain_patterns(block_domains)
+
+        self.blocked: Dict[str, int] = defaultdict(int)
+        self.allowed: Dict[str, int] = defaultdict(int)
+        self.allowed_bytes: Dict[str, int] = defaultdict(int)
+        self.load_times = []
+        self._navigated_at: Dict[int, float] = {}
+        self._response_types: Dict[str, str] = {}  # CDP requestId -> 資源類型，收到回應到載入完成之間
+
+    @property
+    def intercepts(self) -> bool:
+        """是否需要攔截請求（full 且沒有自訂網域時只統計、不攔截）"""
+        return bool(self.block_types or self.url_patterns)
+
+    async def install(self, context):
+        """
+        在 BrowserContext 上安裝攔截與統計（需在第一次導航之前呼叫）
+
+        context 還沒有頁面時（瀏覽器池借出的新 context）先開一個頁面並等攔截安裝完成，
+        browser-use 會沿用這個頁面，第一次導航的請求也會被攔截
+        """
+        if not (self.intercepts or self.track_usage):
+            return
+        pages = list(context.pages) or [await context.new_page()]
+        context.on('page', self._on_page)
+        for page in pages:
+            await self._attach(page)
+
+    async def _on_page(self, page):
+        try:
+            await self._attach(page)
+        except Exception as e:
+            print(f"新頁面安裝資源攔截失敗: {e}")
+
+    async def _attach(self, page):
+        """
+        以頁面的 CDP session 攔截與統計：網域與網址樣式交給 Network.setBlockedURLs 在瀏覽器內比對，
+        只有要攔截類型的請求經由 Fetch 回到 Python；放行的請求數與位元組取自 Network 事件，
+        不逐一向 Playwright 查詢，也不像 context.route 會讓 Playwright 關閉瀏覽器的 HTTP 快取
+        """
+        if self.track_usage:
+            self._watch_page(page)
+        session = await page.context.new_cdp_session(page)
+        if self.url_patterns or self.track_usage:
+            session.on('Network.loadingFailed', self._on_loading_failed)
+            if self.track_usage:
+                session.on('Network.responseReceived', self._on_response_received)
+                session.on('Network.loadingFinished', self._on_loading_finished)
+            await session.send('Network.enable')
+        if self.url_patterns:
+            await session.send('Network.setBlockedURLs', {'urls': self.url_patterns})
+        if self.block_types:
+            session.on('Fetch.requestPaused', lambda event: self._fail_request(session, event))
+            await session.send('Fetch.enable', {'patterns': [
+                {'urlPattern': '*', 'resourceType': CDP_RESOURCE_TYPES[resource_type], 'requestStage': 'Request'}
+                for resource_type in sorted(self.block_types)
+            ]})
+
+    def _on_loading_failed(self, event):
+        self._response_types.pop(event.get('requestId'), None)
+        # blockedReason 為 inspector 表示被 setBlockedURLs 攔截；要攔截的類型由 _fail_request 計算
+        resource_type = event.get('type', 'Other').lower()
+        if event.get('blockedReason') == 'inspector' and resource_type not in self.block_types:
+            self.blocked[resource_type] += 1
+
+    async def _fail_request(self, session, event):
+        self.blocked[event.get('resourceType', 'Other').lower()] += 1
+        try:
+            await session.send('Fetch.failRequest', {'requestId': event['requestId'], 'errorReason': 'BlockedByClient'})
+        except Exception:
+            pass  # 頁面已關閉
+
+    def _on_response_received(self, event):
+        resource_type = event.get('type', 'Other').lower()
+        self.allowed[resource_type] += 1
+        self._response_types[event['requestId']] = resource_type
+
+    def _on_loading_finished(self, event):
+        # encodedDataLength 為實際傳輸的大小（chunked 或壓縮的回應沒有可用的 content-length）
+        resource_type = self._response_types.pop(event['requestId'], None)
+        if resource_type is not None:
+            self.allowed_bytes[resource_type] += max(0, int(event.get('encodedDataLength', 0)))
+
+    def _watch_page(self, page):
+        def on_navigated(frame):
+            if frame == page.main_frame:
+                self._navigated_at[id(page)] = time.monotonic()
+
+        def on_load(_):
+            started = self._navigated_at.pop(id(page), None)
+            if started is not None:
+                self.load_times.append(time.monotonic() - started)
+
+        page.on('framenavigated', on_navigated)
+        page.on('load', on_load)
+
+    def report(self) -> Dict:
+        return {
+            'profile': self.profile,
+            'blocked_requests': sum(self.blocked.values()),
+            'blocked_by_type': dict(self.blocked),
+            'allowed_requests': sum(self.allowed.values()),
+            'allowed_bytes': sum(self.allowed_bytes.values()),
+            'allowed_by_type': {
+                resource_type: {'requests': count, 'bytes': self.allowed_bytes[resource_type]}
+                for resource_type, count in self.allowed.items()
+            },
+            'page_loads': len(self.load_times),
+            'avg_load_ms': round(sum(self.load_times) / len(self.load_times) * 1000, 1) if self.load_times else None,
+        }
+
+
+class ResourceStats:
+    """
+    跨任務的資源用量統計，用於估計攔截省下的位元組數與載入時間
+
+    被攔截的請求沒有實際下載，其大小以 full profile 任務中同類型資源的平均大小估計；
+    載入時間的節省以 full profile 的平均頁面載入時間為基準。
+    """
+
+    def __init__(self):
+        self._type_bytes: Dict[str, list] = defaultdict(lambda: [0, 0])  # 類型 -> [請求數, 位元組]
+        self._loads: Dict[str, list] = defaultdict(lambda: [0, 0.0])  # profile -> [頁面數, 總毫秒]
+        self._totals: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def annotate(self, report: Dict) -> Dict:
+        """為單一任務的報告加上估計節省量，並納入統計"""
+        estimated_bytes = 0
+        for resource_type, count in report['blocked_by_type'].items():
+            requests, total = self._type_bytes.get(resource_type, (0, 0))
+            if requests:
+                estimated_bytes += round(total / requests * count)
+
+        baseline_requests, baseline_ms = self._loads.get('full', (0, 0.0))
+        saved_ms = None
+        if baseline_requests and report['avg_load_ms'] is not None and report['profile'] != 'full':
+            saved_ms = round(baseline_ms / baseline_requests - report['avg_load_ms'], 1)
+
+        if report['profile'] == 'full':
+            for resource_type, usage in report['allowed_by_type'].items():
+                self._type_bytes[resource_type][0] += usage['requests']
+                self._type_bytes[resource_type][1] += usage['bytes']
+        if report['avg_load_ms'] is not None:
+            self._loads[report['profile']][0] += report['page_loads']
+            self._loads[report['profile']][1] += report['avg_load_ms'] * report['page_loads']
+        totals = self._totals[report['profile']]
+        totals['tasks'] += 1
+        totals['blocked_requests'] += report['blocked_requests']
+        totals['allowed_bytes'] += report['allowed_bytes']
+        totals['estimated_blocked_bytes'] += estimated_bytes
+
+        return {**report, 'estimated_blocked_bytes': estimated_bytes, 'estimated_load_ms_saved': saved_ms}
+
+    def get_metrics(self) -> Dict:
+        return {
+            profile: {
+                **totals,
+                'avg_load_ms': (
+                    round(self._loads[profile][1] / self._loads[profile][0], 1) if self._loads[profile][0] else None
+                ),
+            }
+            for profile, totals in self._totals.items()
+        }
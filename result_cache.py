@@ -0,0 +1,169 @@
+"""
+任務結果快取模組
+相同任務（正規化後的任務描述 + 相關設定）在有效期限內直接回傳先前的結果，
+同時進行中的相同任務只執行一次，其餘請求共用成功的結果
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from result_serializer import dumps
+
+# 快取模式
+CACHE_BYPASS = 'bypass'    # 不使用快取（不讀取也不寫入）
+CACHE_REFRESH = 'refresh'  # 不讀取快取，執行後以成功結果覆寫
+CACHE_PREFER = 'prefer'    # 優先使用快取，未命中才執行
+CACHE_ONLY = 'only'        # 只讀取快取，未命中時不執行
+
+# 結果來源
+SOURCE_RUN = 'run'
+SOURCE_HIT = 'hit'
+SOURCE_COALESCED = 'coalesced'
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class CacheMiss(Exception):
+    """cache=only 且快取中沒有結果"""
+
+
+def normalize_task(task: str) -> str:
+    """正規化任務描述：Unicode 全半形統一、合併空白、去除首尾空白"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', task)).strip()
+
+
+def make_cache_key(task: str, fields: Dict[str, Any]) -> str:
+    """以正規化任務描述與影響結果的設定欄位計算快取鍵"""
+    payload = json.dumps(
+        {'task': normalize_task(task), **fields},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    有 TTL 與容量上限的 LRU 結果快取，並合併同時進行的相同任務
+
+    Args:
+        ttl: 結果有效秒數
+        max_entries: 最多保存筆數
+        max_bytes: 所有結果的總大小上限
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv('RESULT_CACHE_TTL', '600'))
+        self.max_entries = max_entries or int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1000'))
+        self.max_bytes = max_bytes or int(float(os.getenv('RESULT_CACHE_MAX_MB', '256')) * 1024 * 1024)
+
+        # key -> (到期時間, 大小, 結果)
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict]]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'stores': 0, 'evictions': 0, 'expired': 0}
+
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.time():
+            self._remove(key)
+            self._stats['expired'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Dict):
+        size = len(dumps(value))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time() + self.ttl, size, value)
+        self._bytes += size
+        self._stats['stores'] += 1
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats['evictions'] += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_run(
+        self,
+        key: str,
+        mode: str,
+        runner: Callable[[], Awaitable[Dict]],
+    ) -> Tuple[Dict, str]:
+        """
+        依快取模式取得結果
+
+        Returns:
+            (結果, 來源)；來源為 run / hit / coalesced
+        """
+        if mode in (CACHE_PREFER, CACHE_ONLY):
+            cached = self.get(key)
+            if cached is not None:
+                self._stats['hits'] += 1
+                return cached, SOURCE_HIT
+            self._stats['misses'] += 1
+            if mode == CACHE_ONLY:
+                raise CacheMiss(key)
+
+            # 只共用成功的結果；領頭的執行失敗、被取消或逾時時改由自己執行
+            awaited = set()
+            while (inflight := self._inflight.get(key)) is not None and inflight not in awaited:
+                awaited.add(inflight)
+                try:
+                    result = await asyncio.shield(inflight)
+                except asyncio.CancelledError:
+                    # 自己被取消時往上拋
+                    if not inflight.cancelled():
+                        raise
+                    continue
+                except Exception:
+                    continue
+                if result.get('status') == 'success':
+                    self._stats['coalesced'] += 1
+                    return result, SOURCE_COALESCED
+
+        future = asyncio.get_running_loop().create_future()
+        if mode != CACHE_BYPASS:
+            self._inflight[key] = future
+        try:
+            result = await runner()
+            if mode != CACHE_BYPASS and result.get('status') == 'success':
+                self.put(key, result)
+            future.set_result(result)
+            return result, SOURCE_RUN
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免沒有其他等待者時出現 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def get_metrics(self) -> Dict:
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'inflight': len(self._inflight),
+            'hit_rate': round(self._stats['hits'] / lookups, 3) if lookups else None,
+            **self._stats,
+        }
@@ -0,0 +1,188 @@
+"""
+任務結果序列化模組
+取代逐層遞迴 __dict__ 的舊序列化方式：具備循環參照偵測、深度與大小上限、
+欄位投影（例如不輸出 DOM 或截圖），大型二進位資料改存到外部並以參照取代
+"""
+
+import base64
+import binascii
+import dataclasses
+import enum
+import hashlib
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:  # orjson 為選用依賴，未安裝時退回標準 json
+    orjson = None
+
+# 預設視為二進位資料（base64）的欄位
+DEFAULT_BLOB_FIELDS = ('screenshot',)
+
+# result_exclude 可用的預設組合
+EXCLUDE_PRESETS = {
+    'no_screenshots': ('screenshot',),
+    'no_dom': ('interacted_element', 'element_tree', 'selector_map', 'dom_state'),
+    'steps': ('screenshot', 'interacted_element', 'element_tree', 'selector_map', 'dom_state', 'tabs'),
+}
+
+_SCALAR_TYPES = frozenset((int, float, bool, type(None)))
+
+CYCLE_MARKER = '<循環參照>'
+DEPTH_MARKER = '<超過深度上限>'
+SIZE_MARKER = '<超過大小上限，已截斷>'
+
+
+def dumps(data: Any) -> bytes:
+    """以最快可用的 JSON 編碼器輸出 UTF-8 bytes"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(data, ensure_ascii=False, default=str).encode('utf-8')
+
+
+class ResultSerializer:
+    """
+    有界的結果序列化器
+
+    Args:
+        max_depth: 最大巢狀深度，超過的部分以標記取代
+        max_bytes: 輸出內容的約略大小上限，超過後其餘欄位以標記取代
+        max_string: 單一字串長度上限
+        exclude: 不輸出的欄位名稱（任何層級）
+        blob_fields: 視為 base64 二進位資料的欄位名稱
+        blob_sink: 接收 (bytes, 欄位名) 並回傳參照的函數；未提供時只輸出摘要
+    """
+
+    def __init__(
+        self,
+        max_depth: int = 20,
+        max_bytes: int = 20 * 1024 * 1024,
+        max_string: int = 200_000,
+        exclude: Iterable[str] = (),
+        blob_fields: Iterable[str] = DEFAULT_BLOB_FIELDS,
+        blob_sink: Optional[Callable[[bytes, str], Dict]] = None,
+    ):
+        self.max_depth = max_depth
+        self.max_bytes = max_bytes
+        self.max_string = max_string
+        self.exclude = frozenset(exclude)
+        self.blob_fields = frozenset(blob_fields)
+        self.blob_sink = blob_sink
+
+    def serialize(self, obj: Any) -> Any:
+        self._budget = self.max_bytes
+        self._path_ids: set = set()
+        return self._convert(obj, 0, None)
+
+    def _convert(self, obj: Any, depth: int, field: Optional[str]) -> Any:
+        cls = type(obj)
+        if cls is str:
+            if field in self.blob_fields:
+                return self._blob(obj, field)
+            return self._string(obj)
+        if cls in _SCALAR_TYPES:
+            self._budget -= 8
+            return obj
+
+        if self._budget <= 0:
+            return SIZE_MARKER
+        if depth >= self.max_depth:
+            return DEPTH_MARKER
+
+        if cls is dict or cls is list or cls is tuple:
+            container = True
+        elif isinstance(obj, str):
+            return self._string(str(obj))
+        elif isinstance(obj, (bool, int, float)):
+            self._budget -= 8
+            return obj
+        elif isinstance(obj, (bytes, bytearray, memoryview)):
+            return self._blob(bytes(obj), field)
+        elif isinstance(obj, enum.Enum):
+            return self._convert(obj.value, depth, field)
+        elif isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        else:
+            container = False
+
+        # 只需追蹤目前路徑上的容器即可偵測循環參照
+        obj_id = id(obj)
+        if obj_id in self._path_ids:
+            return CYCLE_MARKER
+        self._path_ids.add(obj_id)
+        try:
+            if container or isinstance(obj, (dict, list, tuple, set, frozenset)):
+                if isinstance(obj, dict):
+                    return self._mapping(obj.items(), depth)
+                return [self._convert(item, depth + 1, None) for item in obj]
+            if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+                return self._mapping(((f.name, getattr(obj, f.name)) for f in dataclasses.fields(obj)), depth)
+            if hasattr(obj, '__dict__'):
+                return self._mapping(vars(obj).items(), depth)
+            return self._string(str(obj))
+        finally:
+            self._path_ids.discard(obj_id)
+
+    def _mapping(self, items, depth: int) -> Dict:
+        result = {}
+        for key, value in items:
+            key = key if isinstance(key, str) else str(key)
+            if key in self.exclude:
+                continue
+            if self._budget <= 0:
+                result[key] = SIZE_MARKER
+                break
+            self._budget -= len(key) + 4
+            result[key] = self._convert(value, depth + 1, key)
+        return result
+
+    def _string(self, value: str) -> str:
+        if len(value) > self.max_string:
+            value = value[:self.max_string] + f'...<已截斷，原長度 {len(value)}>'
+        self._budget -= len(value) + 2
+        return value
+
+    def _blob(self, value, field: Optional[str]) -> Any:
+        """二進位資料改存外部，結果中只保留參照"""
+        if isinstance(value, str):
+            try:
+                data = base64.b64decode(value, validate=True)
+            except (binascii.Error, ValueError):
+                return self._string(value)
+        else:
+            data = value
+
+        if self.blob_sink is not None:
+            try:
+                reference = self.blob_sink(data, field or 'blob')
+                self._budget -= 100
+                return reference
+            except Exception as e:
+                print(f"寫出二進位資料失敗: {e}")
+
+        self._budget -= 100
+        return {'$blob': f'sha256:{hashlib.sha256(data).hexdigest()}', 'size': len(data), 'stored': False}
+
+
+def resolve_exclude(names: Iterable[str]) -> set:
+    """展開 result_exclude 中的預設組合名稱"""
+    fields = set()
+    for name in names or ():
+        fields.update(EXCLUDE_PRESETS.get(name, (name,)))
+    return fields
+
+
+def serialize_result(obj: Any, exclude: Iterable[str] = (), blob_sink: Optional[Callable[[bytes, str], Dict]] = None, **options) -> Any:
+    """
+    將複雜對象序列化為可JSON化的格式
+
+    Args:
+        obj: 要序列化的對象（例如 browser-use 的 AgentHistoryList）
+        exclude: 不輸出的欄位名稱或預設組合（no_screenshots / no_dom / steps）
+        blob_sink: 二進位資料的外部儲存
+        **options: 傳給 ResultSerializer 的其他上限設定
+    """
+    serializer = ResultSerializer(exclude=resolve_exclude(exclude), blob_sink=blob_sink, **options)
+    return serializer.serialize(obj)
@@ -0,0 +1,256 @@
+"""
+重試策略模組
+依失敗類型（瀏覽器崩潰、導航逾時、LLM 限流、LLM 5xx、任務本身失敗、設定錯誤）套用不同的重試規則，
+以帶抖動的指數退避取代固定的 5/10/15 秒等待，並尊重 LLM 回傳的 Retry-After；
+全服務共用的重試預算避免在外部服務故障時重試量反而放大流量
+"""
+
+import os
+import random
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+# 失敗類型
+FAILURE_BROWSER_CRASH = 'browser_crash'
+FAILURE_NAVIGATION_TIMEOUT = 'navigation_timeout'
+FAILURE_LLM_RATE_LIMIT = 'llm_rate_limit'
+FAILURE_LLM_SERVER_ERROR = 'llm_server_error'
+FAILURE_TASK = 'task_failure'
+FAILURE_CONFIG = 'config_error'
+FAILURE_BUSY = 'busy'
+FAILURE_UNKNOWN = 'unknown'
+
+
+class RetryRule:
+    """
+    單一失敗類型的重試規則
+
+    Args:
+        max_attempts: 含第一次在內的最多嘗試次數（仍受請求的 max_retries 限制）
+        base_delay: 第一次重試的基準等待秒數，之後每次加倍
+        max_delay: 等待秒數上限
+        resume: 重試時是否從上次成功的頁面繼續
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float = 0, max_delay: float = 0, resume: bool = False):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.resume = resume
+
+    def delay(self, retry_number: int, retry_after: Optional[float] = None) -> float:
+        """第 retry_number 次重試前的等待秒數（equal jitter：一半固定、一半隨機）"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (retry_number - 1))
+        delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+DEFAULT_RULES: Dict[str, RetryRule] = {
+    FAILURE_BROWSER_CRASH: RetryRule(3, base_delay=2, max_delay=30, resume=True),
+    FAILURE_NAVIGATION_TIMEOUT: RetryRule(3, base_delay=5, max_delay=60, resume=True),
+    FAILURE_LLM_RATE_LIMIT: RetryRule(4, base_delay=10, max_delay=120, resume=True),
+    FAILURE_LLM_SERVER_ERROR: RetryRule(3, base_delay=5, max_delay=60, resume=True),
+    # 任務本身失敗（agent 連續失敗後放棄）時重新開始，換一條路徑嘗試
+    FAILURE_TASK: RetryRule(2, base_delay=5, max_delay=30),
+    FAILURE_CONFIG: RetryRule(1),
+    FAILURE_BUSY: RetryRule(3, base_delay=5, max_delay=60),
+    FAILURE_UNKNOWN: RetryRule(3, base_delay=5, max_delay=60, resume=True),
+}
+
+# 依錯誤訊息判斷失敗類型，依序比對（設定錯誤的例外類型另在 classify 中判斷，不比對訊息中的類型名稱）
+_MESSAGE_PATTERNS: Tuple[Tuple[str, re.Pattern], ...] = (
+    (FAILURE_LLM_RATE_LIMIT, re.compile(r'rate.?limit|\b429\b|too many requests|tokens per minute|retry after', re.I)),
+    (FAILURE_LLM_SERVER_ERROR, re.compile(r'\b50[0-4]\b|internal server error|service unavailable|bad gateway|overloaded', re.I)),
+    (FAILURE_BROWSER_CRASH, re.compile(
+        r'target (page, context or browser )?(has been )?closed|browser has been closed|browser closed|'
+        r'connection closed|crash|WorkerCrashed|disconnected', re.I)),
+    (FAILURE_NAVIGATION_TIMEOUT, re.compile(r'net::ERR_|navigation|timeout|timed out', re.I)),
+    (FAILURE_BUSY, re.compile(r'AdmissionRejected|PoolExhaustedError|WorkerUnavailable', re.I)),
+    (FAILURE_CONFIG, re.compile(r'validation error|不支援', re.I)),
+)
+
+# 視為設定錯誤、不重試的例外類型
+_CONFIG_ERROR_TYPES = frozenset({'ValidationError', 'TypeError', 'ValueError', 'KeyError'})
+
+_RETRY_AFTER = re.compile(r'retry after (\d+(?:\.\d+)?)\s*(ms|milliseconds?|s|seconds?)?', re.I)
+
+
+class AttemptFailed(Exception):
+    """
+    單次嘗試失敗，附上失敗類型判斷所需的資訊與可接續的進度
+
+    Args:
+        error_type: 原始錯誤的類型名稱
+        message: 錯誤訊息
+        resume: 可接續的進度（最後成功的網址與已完成的步驟摘要），沒有時為 None
+        retry_after: LLM 要求的等待秒數
+    """
+
+    def __init__(
+        self,
+        error_type: str,
+        message: str,
+        resume: Optional[Dict] = None,
+        retry_after: Optional[float] = None,
+        status_code: Optional[int] = None,
+    ):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+        self.message = message
+        self.resume = resume
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+    @property
+    def details(self) -> Dict:
+        """跨行程傳遞用（見 worker_pool）"""
+        return {'resume': self.resume, 'retry_after': self.retry_after, 'status_code': self.status_code}
+
+
+def classify(error: BaseException) -> str:
+    """判斷失敗類型"""
+    if isinstance(error, AttemptFailed):
+        error_type, message = error.error_type, error.message
+    else:
+        error_type, message = type(error).__name__, str(error)
+
+    status_code = getattr(error, 'status_code', None)
+    if status_code == 429:
+        return FAILURE_LLM_RATE_LIMIT
+    if isinstance(status_code, int) and status_code >= 500:
+        return FAILURE_LLM_SERVER_ERROR
+    if error_type == 'AgentGaveUp':
+        # agent 連續失敗後放棄：依最後一個錯誤判斷，無法判斷時視為任務本身失敗
+        kind = _match(message)
+        return kind if kind not in (None, FAILURE_CONFIG) else FAILURE_TASK
+    if error_type in _CONFIG_ERROR_TYPES:
+        return FAILURE_CONFIG
+    return _match(f"{error_type}: {message}") or FAILURE_UNKNOWN
+
+
+def _match(text: str) -> Optional[str]:
+    for kind, pattern in _MESSAGE_PATTERNS:
+        if pattern.search(text):
+            return kind
+    return None
+
+
+def parse_retry_after(error: BaseException) -> Optional[float]:
+    """
+    取得 LLM 要求的等待秒數
+
+    例外本身帶 retry_after（AttemptFailed、AdmissionRejected）時直接使用；
+    否則讀取原始 HTTP 回應的 retry-after-ms / retry-after 標頭（browser-use 會把 openai 例外包成
+    ModelProviderError，原始例外在 __cause__），否則從訊息中的 "retry after N seconds" 解析。
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if isinstance(retry_after, (int, float)):
+        return float(retry_after)
+
+    current: Optional[BaseException] = error
+    while current is not None:
+        response = getattr(current, 'response', None)
+        headers = getattr(response, 'headers', None)
+        if headers:
+            try:
+                if headers.get('retry-after-ms'):
+                    return float(headers['retry-after-ms']) / 1000
+                if headers.get('retry-after'):
+                    return float(headers['retry-after'])
+            except ValueError:
+                pass
+        current = current.__cause__
+
+    match = _RETRY_AFTER.search(str(error))
+    if match:
+        value = float(match.group(1))
+        unit = (match.group(2) or 's').lower()
+        return value / 1000 if unit.startswith('m') else value
+    return None
+
+
+def build_resume_point(history, max_summary: int = 20) -> Optional[Dict]:
+    """
+    由 agent 執行紀錄整理可接續的進度
+
+    Returns:
+        {'url': 最後一個成功步驟所在的網址, 'steps': 成功步驟數, 'summary': 各步驟的動作摘要}；
+        沒有可接續的頁面時回傳 None
+    """
+    url = None
+    completed = []
+    for item in getattr(history, 'history', None) or []:
+        if any(getattr(result, 'error', None) for result in getattr(item, 'result', None) or []):
+            continue
+        step_url = getattr(getattr(item, 'state', None), 'url', None)
+        actions = []
+        for action in getattr(getattr(item, 'model_output', None), 'action', None) or []:
+            data = action.model_dump(exclude_unset=True) if hasattr(action, 'model_dump') else {}
+            actions.extend(name for name, params in data.items() if params is not None)
+        if step_url and not step_url.startswith('about:'):
+            url = step_url
+        completed.append(f"{', '.join(actions) or '（無動作）'} @ {step_url or '?'}")
+    if url is None:
+        return None
+    return {'url': url, 'steps': len(completed), 'summary': completed[-max_summary:]}
+
+
+class RetryBudget:
+    """
+    全服務共用的重試預算（token bucket）
+
+    每個新任務存入 ratio 個 token，另外每分鐘固定補充 min_per_minute 個；每次重試花費 1 個。
+    外部服務大規模故障時重試量最多約為正常流量的 ratio 倍，不會把故障放大。
+
+    Args:
+        ratio: 每個新任務可換得的重試額度
+        min_per_minute: 流量很低時每分鐘仍可重試的次數
+        capacity: token 上限
+    """
+
+    def __init__(self, ratio: Optional[float] = None, min_per_minute: Optional[float] = None, capacity: Optional[float] = None):
+        self.ratio = ratio if ratio is not None else float(os.getenv('RETRY_BUDGET_RATIO', '0.2'))
+        self.min_per_minute = min_per_minute if min_per_minute is not None else float(os.getenv('RETRY_BUDGET_MIN_PER_MINUTE', '6'))
+        self.capacity = capacity or float(os.getenv('RETRY_BUDGET_CAPACITY', '20'))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._stats = {'deposits': 0, 'retries_allowed': 0, 'retries_denied': 0}
+        self._failures: Dict[str, int] = {}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.min_per_minute / 60)
+        self._updated = now
+
+    def record_request(self):
+        """新任務開始時存入重試額度"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + self.ratio)
+        self._stats['deposits'] += 1
+
+    def record_failure(self, kind: str):
+        self._failures[kind] = self._failures.get(kind, 0) + 1
+
+    def try_spend(self) -> bool:
+        """取得一次重試額度，預算用完時回傳 False"""
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            self._stats['retries_allowed'] += 1
+            return True
+        self._stats['retries_denied'] += 1
+        return False
+
+    def get_metrics(self) -> Dict:
+        self._refill()
+        return {
+            'available': round(self._tokens, 2),
+            'capacity': self.capacity,
+            'ratio': self.ratio,
+            'min_per_minute': self.min_per_minute,
+            **self._stats,
+            'failures': dict(self._failures),
+        }
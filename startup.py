@@ -0,0 +1,106 @@
+"""
+服務啟動模組
+記錄啟動各階段的耗時（匯入、LLM 客戶端建立、瀏覽器預熱…），並提供 /livez、/readyz 使用的就緒狀態：
+預熱開啟時，需 LLM 客戶端建立成功且實際啟動過瀏覽器才視為就緒
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+from metrics import STARTUP_PHASE_SECONDS
+
+try:
+    import psutil
+except ImportError:  # psutil 為選用依賴，未安裝時改讀 /proc/self/stat
+    psutil = None
+
+CHECK_PENDING = 'pending'
+CHECK_OK = 'ok'
+
+
+def process_age() -> Optional[float]:
+    """目前行程已存在的秒數（含直譯器啟動與匯入），無法取得時回傳 None"""
+    try:
+        if psutil is not None:
+            return time.time() - psutil.Process().create_time()
+        with open('/proc/self/stat') as f:
+            started_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - started_ticks / os.sysconf('SC_CLK_TCK')
+    except Exception:
+        return None
+
+
+class StartupReport:
+    """
+    啟動階段耗時與就緒檢查
+
+    建立時記下行程已存在的時間（直譯器啟動）；之後以 phase() 量測各階段，
+    以 check() 記錄就緒條件的結果，所有 required 的檢查都成功才算就緒。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        interpreter = process_age()
+        if interpreter is not None:
+            self._record('interpreter', interpreter)
+        self.checks: Dict[str, str] = {}
+        self.ready_seconds: Optional[float] = None
+        self.shutting_down = False
+
+    def _record(self, name: str, seconds: float):
+        self.phases[name] = round(seconds, 3)
+        STARTUP_PHASE_SECONDS.labels(name).set(seconds)
+        print(f"啟動階段 {name}: {seconds:.3f} 秒")
+
+    def mark(self, name: str):
+        """記錄從建立到現在的時間（例如模組匯入完成）"""
+        self._record(name, time.perf_counter() - self.started)
+
+    @contextmanager
+    def phase(self, name: str):
+        """量測一個啟動階段（失敗時也會記錄耗時）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def require(self, names: Iterable[str]):
+        """設定就緒前必須成功的檢查（沒有任何檢查時立即就緒）"""
+        self.checks = {name: CHECK_PENDING for name in names}
+        self.ready_seconds = None
+        self._update()
+
+    def check(self, name: str, error: Optional[str] = None):
+        """記錄檢查結果（error 只保留第一行）；全部成功時記下從行程啟動到就緒的時間"""
+        self.checks[name] = CHECK_OK if error is None else (error.strip().splitlines() or ['未知錯誤'])[0]
+        if error is not None:
+            print(f"就緒檢查 {name} 失敗: {self.checks[name]}")
+        self._update()
+
+    def shutdown(self):
+        """服務開始關閉，之後回報未就緒，讓負載平衡不再導入流量"""
+        self.shutting_down = True
+
+    def _update(self):
+        if self.ready and self.ready_seconds is None:
+            self.ready_seconds = time.perf_counter() - self.started + self.phases.get('interpreter', 0.0)
+            print(f"服務已就緒，自行程啟動共 {self.ready_seconds:.3f} 秒")
+
+    @property
+    def ready(self) -> bool:
+        return not self.shutting_down and all(status == CHECK_OK for status in self.checks.values())
+
+    def report(self) -> Dict:
+        return {
+            'ready': self.ready,
+            'shutting_down': self.shutting_down,
+            'checks': dict(self.checks),
+            'phases': dict(self.phases),
+            'seconds_to_ready': round(self.ready_seconds, 3) if self.ready_seconds is not None else None,
+        }
@@ -0,0 +1,241 @@
+"""
+瀏覽器狀態快取模組
+依 state_profile（租戶或自訂鍵）分開保存各網站的 cookie 與 localStorage，以及冷啟動瀏覽器的使用者資料目錄
+（含 HTTP 磁碟快取）；重複稽核同一網站時注入這些狀態，省去同意橫幅、登入流程與靜態資源的重複下載
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from result_serializer import dumps
+
+_PROFILE_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+_HOST_PATTERN = re.compile(r'(?:https?://)?((?:[a-z0-9-]+\.)+[a-z]{2,})', re.I)
+# 這些第二層網域底下才是可註冊的網域，例如 example.com.tw
+_SECOND_LEVEL_LABELS = {'com', 'co', 'org', 'net', 'gov', 'edu', 'ac', 'or', 'ne', 'go'}
+
+# 累計頁面的傳輸量與由 HTTP 快取提供的位元組數（只計算上次呼叫之後的新項目）
+NETWORK_USAGE_SCRIPT = """() => {
+    const entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+    const start = window.__stateCacheCounted || 0;
+    let transferred = 0, cached = 0;
+    for (const entry of entries.slice(start)) {
+        transferred += entry.transferSize || 0;
+        if (!entry.transferSize && entry.decodedBodySize) cached += entry.decodedBodySize;
+    }
+    window.__stateCacheCounted = entries.length;
+    return [transferred, cached];
+}"""
+
+
+def site_of(host: str) -> str:
+    """主機名稱對應的網站（可註冊網域），同一網站的子網域共用狀態"""
+    host = host.lower().lstrip('.')
+    if re.fullmatch(r'[\d.]+|\[[0-9a-f:]+\]', host):
+        return host
+    labels = host.split('.')
+    if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in _SECOND_LEVEL_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def sites_in_task(task: str) -> List[str]:
+    """任務描述中提到的網站"""
+    return sorted({site_of(host) for host in _HOST_PATTERN.findall(task)})
+
+
+class BrowserStateCache:
+    """
+    依 state_profile 與網站分開保存的瀏覽器狀態
+
+    目錄結構：<root>/<profile>/state/<網站>.json 為該網站的 cookie 與 localStorage，
+    <root>/<profile>/user_data/ 為冷啟動瀏覽器的使用者資料目錄（含 HTTP 磁碟快取）。
+
+    Args:
+        root: 存放目錄
+        ttl: 每個網站狀態的有效秒數
+        max_bytes: 總大小上限，超過時刪除最久未使用的 profile 的使用者資料目錄
+    """
+
+    def __init__(self, root: Optional[str] = None, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        self.root = root or os.getenv('STATE_CACHE_DIR', 'browser_state')
+        self.ttl = ttl or float(os.getenv('STATE_CACHE_TTL_HOURS', '24')) * 3600
+        self.max_bytes = max_bytes or int(float(os.getenv('STATE_CACHE_MAX_MB', '1024')) * 1024 * 1024)
+        os.makedirs(self.root, exist_ok=True)
+        self._stats = {'evicted': 0}
+        self._runs = {'cold': [], 'warm': []}
+        # 已交給本行程中某個任務使用、瀏覽器可能還沒建立 SingletonLock 的使用者資料目錄
+        self._lock = threading.Lock()
+        self._reserved = set()
+
+    def _profile_dir(self, profile: str) -> str:
+        if not _PROFILE_PATTERN.match(profile) or profile.startswith('.'):
+            raise ValueError(f"不合法的 state_profile: {profile}")
+        return os.path.join(self.root, profile)
+
+    def prepare(self, profile: str, task: str, persistent: bool = True) -> Dict:
+        """
+        取得要注入的狀態
+
+        Args:
+            persistent: 是否由冷啟動的瀏覽器執行；預熱池的瀏覽器無法使用使用者資料目錄，
+                        此時不保留目錄，warm 也只依 cookie 與 localStorage 判斷
+
+        Returns:
+            {'storage_state': 合併後的 cookie 與 localStorage（沒有時為 None），
+             'user_data_dir': 冷啟動瀏覽器可用的使用者資料目錄（另一個瀏覽器或任務正在使用時為 None），
+             'warm': 是否有可沿用的狀態}
+
+        取得 user_data_dir 時會保留給這個任務，任務結束後需呼叫 release()
+        """
+        state_dir = os.path.join(self._profile_dir(profile), 'state')
+        wanted = set(sites_in_task(task))
+        cookies, origins = [], []
+        now = time.time()
+        if os.path.isdir(state_dir):
+            for entry in os.scandir(state_dir):
+                site = entry.name[:-len('.json')]
+                if not entry.name.endswith('.json') or (wanted and site not in wanted):
+                    continue
+                if now - entry.stat().st_mtime > self.ttl:
+                    continue
+                try:
+                    with open(entry.path, encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                cookies.extend(data.get('cookies', []))
+                origins.extend(data.get('origins', []))
+
+        storage_state = {'cookies': cookies, 'origins': origins} if cookies or origins else None
+        if not persistent:
+            return {'storage_state': storage_state, 'user_data_dir': None, 'warm': storage_state is not None}
+
+        user_data_dir = os.path.join(self._profile_dir(profile), 'user_data')
+        # Chromium 執行中會在使用者資料目錄建立 SingletonLock，同一目錄不能同時給兩個瀏覽器使用；
+        # 瀏覽器啟動前還沒有 SingletonLock，同時冷啟動的任務改以行程內的保留判斷
+        with self._lock:
+            in_use = user_data_dir in self._reserved or os.path.lexists(os.path.join(user_data_dir, 'SingletonLock'))
+            if not in_use:
+                self._reserved.add(user_data_dir)
+        reused_cache = not in_use and os.path.isdir(user_data_dir) and bool(os.listdir(user_data_dir))
+        if not in_use:
+            os.makedirs(user_data_dir, exist_ok=True)
+            os.utime(self._profile_dir(profile))
+        return {
+            'storage_state': storage_state,
+            'user_data_dir': None if in_use else user_data_dir,
+            'warm': storage_state is not None or reused_cache,
+        }
+
+    def release(self, user_data_dir: Optional[str]):
+        """任務結束，釋放 prepare() 保留的使用者資料目錄"""
+        with self._lock:
+            self._reserved.discard(user_data_dir)
+
+    def save(self, profile: str, storage_state: Dict):
+        """依網站拆開保存 cookie 與 localStorage，只覆寫這次有狀態的網站"""
+        sites: Dict[str, Dict] = {}
+        for cookie in storage_state.get('cookies', []):
+            site = site_of(cookie.get('domain', ''))
+            sites.setdefault(site, {'cookies': [], 'origins': []})['cookies'].append(cookie)
+        for origin in storage_state.get('origins', []):
+            host = urlparse(origin.get('origin', '')).hostname
+            if host:
+                sites.setdefault(site_of(host), {'cookies': [], 'origins': []})['origins'].append(origin)
+
+        state_dir = os.path.join(self._profile_dir(profile), 'state')
+        os.makedirs(state_dir, exist_ok=True)
+        for site, data in sites.items():
+            if not _PROFILE_PATTERN.match(site):
+                continue
+            path = os.path.join(state_dir, f"{site}.json")
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, 'wb') as f:
+                f.write(dumps(data))
+            os.replace(temp, path)
+
+    def record_run(self, warm: bool, steps: int, transferred_bytes: int, cached_bytes: int):
+        """記錄一次執行的步驟數與傳輸量，用於比較有無沿用狀態的差異"""
+        runs = self._runs['warm' if warm else 'cold']
+        runs.append((steps, transferred_bytes, cached_bytes))
+        del runs[:-200]
+
+    def evict(self) -> int:
+        """刪除過期的網站狀態，總大小超過上限時依最久未使用順序刪除 profile 的使用者資料目錄"""
+        now = time.time()
+        removed = 0
+        profiles = []
+        for profile in os.scandir(self.root):
+            if not profile.is_dir():
+                continue
+            state_dir = os.path.join(profile.path, 'state')
+            if os.path.isdir(state_dir):
+                for entry in os.scandir(state_dir):
+                    if now - entry.stat().st_mtime > self.ttl:
+                        os.remove(entry.path)
+                        removed += 1
+            user_data_dir = os.path.join(profile.path, 'user_data')
+            with self._lock:
+                in_use = user_data_dir in self._reserved
+            if os.path.isdir(user_data_dir) and not in_use and not os.path.lexists(os.path.join(user_data_dir, 'SingletonLock')):
+                profiles.append((profile.stat().st_mtime, _dir_size(user_data_dir), user_data_dir))
+
+        total = _dir_size(self.root)
+        for mtime, size, user_data_dir in sorted(profiles):
+            if now - mtime <= self.ttl and total <= self.max_bytes:
+                continue
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+            total -= size
+            removed += 1
+        self._stats['evicted'] += removed
+        return removed
+
+    def get_metrics(self) -> Dict:
+        profiles = [entry for entry in os.scandir(self.root) if entry.is_dir()]
+        sites = sum(
+            len(os.listdir(os.path.join(entry.path, 'state')))
+            for entry in profiles if os.path.isdir(os.path.join(entry.path, 'state'))
+        )
+        cold, warm = _averages(self._runs['cold']), _averages(self._runs['warm'])
+        return {
+            'profiles': len(profiles),
+            'sites': sites,
+            'bytes': _dir_size(self.root),
+            **self._stats,
+            'cold_runs': cold,
+            'warm_runs': warm,
+            'steps_saved_per_run': round(cold['avg_steps'] - warm['avg_steps'], 2) if cold['runs'] and warm['runs'] else None,
+            'bytes_saved_per_run': (
+                round(cold['avg_transferred_bytes'] - warm['avg_transferred_bytes']) if cold['runs'] and warm['runs'] else None
+            ),
+        }
+
+
+def _averages(runs: Iterable) -> Dict:
+    runs = list(runs)
+    if not runs:
+        return {'runs': 0, 'avg_steps': None, 'avg_transferred_bytes': None, 'avg_cached_bytes': None}
+    return {
+        'runs': len(runs),
+        'avg_steps': round(sum(run[0] for run in runs) / len(runs), 2),
+        'avg_transferred_bytes': round(sum(run[1] for run in runs) / len(runs)),
+        'avg_cached_bytes': round(sum(run[2] for run in runs) / len(runs)),
+    }
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
@@ -5,8 +5,19 @@
 
 import random
 import asyncio
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import os
+from browser_watchdog import owner_args
+
+# Chromium 行程模型：single 為單一行程（--single-process，記憶體較少，但任一頁面崩潰會帶走整個瀏覽器）、
+# multi 為一般的多行程（renderer 各自獨立，數量以 BROWSER_RENDERER_LIMIT 限制）
+PROCESS_MODELS = ('single', 'multi')
+
+def browser_process_model() -> str:
+    model = os.getenv('BROWSER_PROCESS_MODEL', 'single').lower()
+    if model not in PROCESS_MODELS:
+        raise ValueError(f"不支援的 BROWSER_PROCESS_MODEL: {model}")
+    return model
 
 class StealthConfig:
     """瀏覽器隱身配置類"""
@@ -68,9 +79,9 @@ class StealthConfig:
             '--disable-translate',
             '--disable-logging',
             '--disable-permissions-api',
-            '--single-process',  # 重要：單進程模式，在 Docker 中更穩定
             '--max_old_space_size=4096',  # 增加內存限制
-            f'--user-agent={StealthConfig.get_random_user_agent()}'
+            f'--user-agent={StealthConfig.get_random_user_agent()}',
+            *owner_args()  # 標記啟動者，供記憶體監控清除孤兒行程
         ]
         
         # 檢查是否在 Docker 環境中運行
@@ -83,15 +94,20 @@ class StealthConfig:
                 '--virtual-time-budget=5000'
             ])
         
+        if browser_process_model() == 'single':
+            base_args.append('--single-process')  # 重要：單進程模式，在 Docker 中更穩定
+        else:
+            base_args.append(f"--renderer-process-limit={os.getenv('BROWSER_RENDERER_LIMIT', '4')}")
+        
         return base_args
     
     @staticmethod
-    def get_browser_config(headless: bool = False) -> Dict:
-        """獲取完整的瀏覽器配置"""
+    def get_browser_config(headless: bool = False, slow_mo: Optional[int] = None) -> Dict:
+        """獲取完整的瀏覽器配置（slow_mo 未指定時隨機 50–150 毫秒）"""
         return {
             'headless': headless,
             'args': StealthConfig.get_stealth_args(),
-            'slow_mo': random.randint(50, 150),  # 隨機慢速模式
+            'slow_mo': random.randint(50, 150) if slow_mo is None else slow_mo,  # 隨機慢速模式
             'viewport': {'width': 1920, 'height': 1080},
             'locale': 'zh-TW',
             'timezone_id': 'Asia/Taipei',
@@ -163,9 +179,21 @@ class ProxyConfig:
         return [proxy.strip() for proxy in proxy_list if proxy.strip()]
 
 # 使用範例
-def get_enhanced_config(use_proxy: bool = False, headless: bool = False) -> Dict:
-    """獲取增強的配置"""
-    config = StealthConfig.get_browser_config(headless=headless)
+def get_enhanced_config(
+    use_proxy: bool = False,
+    headless: bool = False,
+    storage_state: Optional[Dict] = None,
+    user_data_dir: Optional[str] = None,
+    slow_mo: Optional[int] = None
+) -> Dict:
+    """
+    獲取增強的配置
+    
+    storage_state 為要注入 context 的 cookie 與 localStorage；
+    user_data_dir 為冷啟動瀏覽器的使用者資料目錄（保留 HTTP 磁碟快取），預熱池的瀏覽器不適用；
+    slow_mo 由任務的執行節奏決定（見 pacing.py）
+    """
+    config = StealthConfig.get_browser_config(headless=headless, slow_mo=slow_mo)
     
     if use_proxy:
         proxies = ProxyConfig.get_residential_proxies()
@@ -176,4 +204,28 @@ def get_enhanced_config(use_proxy: bool = False, headless: bool = False) -> Dict
     # 添加隨機視窗大小
     config['viewport'] = HumanBehavior.get_random_viewport()
     
-    return config 
\ No newline at end of file
+    if storage_state:
+        config['storage_state'] = storage_state
+    if user_data_dir:
+        config['user_data_dir'] = user_data_dir
+    
+    return config
+
+# 屬於瀏覽器啟動層級的參數，其餘參數都可套用在單一 BrowserContext 上
+LAUNCH_OPTION_KEYS = ('headless', 'args', 'slow_mo', 'user_data_dir')
+
+def split_browser_config(config: Dict) -> Tuple[Dict, Dict]:
+    """
+    將完整配置拆成 (啟動參數, context 參數)
+    
+    預熱池中的瀏覽器已經啟動，任務只能套用 context 層級的設定；
+    隨機 User-Agent 從啟動參數中取出，改為每個 context 各自設定。
+    """
+    launch_options = {key: config[key] for key in LAUNCH_OPTION_KEYS if key in config}
+    context_options = {key: value for key, value in config.items() if key not in LAUNCH_OPTION_KEYS}
+    
+    for arg in launch_options.get('args', []):
+        if arg.startswith('--user-agent='):
+            context_options['user_agent'] = arg.split('=', 1)[1]
+    
+    return launch_options, context_options 
\ No newline at end of file
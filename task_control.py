@@ -0,0 +1,184 @@
+"""
+任務取消與時間預算模組
+每個執行中的任務有一個 TaskControl：可由 API 取消，或在超過 max_duration 時自動中止；
+中止時取消正在執行的 agent 協程（釋放瀏覽器 context 與執行名額），並記錄清理耗時
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Dict, Optional
+
+from batch_runner import percentile
+
+# 中止原因
+REASON_CANCELLED = 'cancelled'
+REASON_MAX_DURATION = 'max_duration'
+REASON_MAX_STEPS = 'max_steps'
+
+
+class TaskInterrupted(Exception):
+    """任務被取消或超過時間預算"""
+
+    def __init__(self, reason: str, partial: Optional[Dict] = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.partial = partial
+
+
+class TaskControl:
+    """
+    單一任務的取消與時間預算控制
+
+    Args:
+        task_id: 任務 ID（可為 None，例如同步 API 的任務）
+        max_duration: 整個任務（含所有重試）的時間上限秒數
+        registry: 所屬的 TaskControlRegistry，用於統計
+    """
+
+    def __init__(self, task_id: Optional[str], max_duration: Optional[float], registry: 'TaskControlRegistry'):
+        self.task_id = task_id
+        self.deadline = time.monotonic() + max_duration if max_duration else None
+        self.reason: Optional[str] = None
+        self.cleanup_seconds: Optional[float] = None
+        self.response: Optional[Dict] = None
+        self.finished = asyncio.Event()
+        # 沒有執行中的嘗試時（等待結果快取或共用進行中的結果）取消時要中止的協程
+        self.waiter: Optional[asyncio.Task] = None
+        self._registry = registry
+        self._job: Optional[asyncio.Task] = None
+        self._interrupted = asyncio.Event()
+        self._interrupted_at: Optional[float] = None
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self, reason: str = REASON_CANCELLED) -> bool:
+        """要求中止任務；已在中止中則回傳 False"""
+        if self.reason is not None or self.finished.is_set():
+            return False
+        self.reason = reason
+        self._interrupted_at = time.monotonic()
+        self._interrupted.set()
+        if self._job is not None and not self._job.done():
+            self._job.cancel()
+        elif self.waiter is not None and not self.waiter.done():
+            self.waiter.cancel()
+        return True
+
+    def waiter_cancelled(self) -> bool:
+        """等待結果時被 cancel() 中止（而非呼叫端自己被取消），並記錄清理耗時"""
+        if self.reason is None or self.finished.is_set():
+            return False
+        if self.waiter is not None:
+            self.waiter.uncancel()  # 已處理這次取消，之後的清理（事件與回調）照常執行
+        self.cleanup_seconds = time.monotonic() - self._interrupted_at
+        self._registry.record_cleanup(self.cleanup_seconds)
+        return True
+
+    async def run(self, coro: Awaitable[Dict]) -> Dict:
+        """
+        在可取消的子任務中執行一次嘗試
+
+        coro 被取消時應盡量回傳帶 interrupted=True 的部分結果；
+        中止時拋出 TaskInterrupted，其中附上部分結果。
+        """
+        if self.reason is None and self.remaining() == 0:
+            self.cancel(REASON_MAX_DURATION)
+        if self.reason is not None:
+            coro.close()
+            raise TaskInterrupted(self.reason)
+
+        loop = asyncio.get_running_loop()
+        self._job = asyncio.ensure_future(coro)
+        watchdog = loop.call_later(self.remaining(), self.cancel, REASON_MAX_DURATION) if self.deadline else None
+        try:
+            try:
+                result = await asyncio.shield(self._job)
+            except asyncio.CancelledError:
+                if self._job.done() and not self._job.cancelled():
+                    raise
+                # 呼叫端被取消（例如串流客戶端斷線），視為取消任務並等待子任務清理完畢
+                self.cancel(REASON_CANCELLED)
+                await asyncio.wait([self._job])
+                result = None
+
+            if self.reason is None:
+                return result
+
+            if result is None and self._job.done() and not self._job.cancelled() and self._job.exception() is None:
+                result = self._job.result()
+            self.cleanup_seconds = time.monotonic() - self._interrupted_at
+            self._registry.record_cleanup(self.cleanup_seconds)
+            partial = result if isinstance(result, dict) and result.get('interrupted') else None
+            raise TaskInterrupted(self.reason, partial)
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            self._job = None
+
+    async def sleep(self, seconds: float) -> bool:
+        """可被中止的等待（重試間隔），中止或超過時間預算時回傳 True"""
+        remaining = self.remaining()
+        timeout = seconds if remaining is None else min(seconds, remaining)
+        try:
+            await asyncio.wait_for(self._interrupted.wait(), timeout)
+        except asyncio.TimeoutError:
+            if self.remaining() == 0:
+                self.cancel(REASON_MAX_DURATION)
+        except asyncio.CancelledError:
+            self.cancel(REASON_CANCELLED)
+        if self.reason is not None and self.cleanup_seconds is None:
+            self.cleanup_seconds = time.monotonic() - self._interrupted_at
+        return self.reason is not None
+
+
+class TaskControlRegistry:
+    """執行中任務的 TaskControl 登錄表與取消統計"""
+
+    def __init__(self):
+        self._controls: Dict[str, TaskControl] = {}
+        self._cleanup_latencies: deque = deque(maxlen=500)
+        self._stats = {'cancelled': 0, 'timeouts': 0, 'step_budget_exhausted': 0}
+
+    def register(self, task_id: Optional[str], max_duration: Optional[float]) -> TaskControl:
+        """登錄任務；同一任務已登錄（例如佇列取出任務時先登錄）且尚未結束時沿用同一個 TaskControl"""
+        control = self._controls.get(task_id) if task_id else None
+        if control is not None and not control.finished.is_set():
+            return control
+        control = TaskControl(task_id, max_duration, self)
+        if task_id:
+            self._controls[task_id] = control
+        return control
+
+    def unregister(self, control: TaskControl, response: Optional[Dict] = None):
+        control.response = response
+        control.finished.set()
+        if response is not None:
+            reason = response.get('reason')
+            if reason == REASON_CANCELLED:
+                self._stats['cancelled'] += 1
+            elif reason == REASON_MAX_DURATION:
+                self._stats['timeouts'] += 1
+            elif reason == REASON_MAX_STEPS:
+                self._stats['step_budget_exhausted'] += 1
+        if control.task_id and self._controls.get(control.task_id) is control:
+            del self._controls[control.task_id]
+
+    def get(self, task_id: str) -> Optional[TaskControl]:
+        return self._controls.get(task_id)
+
+    def record_cleanup(self, seconds: float):
+        self._cleanup_latencies.append(seconds)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        latencies = list(self._cleanup_latencies)
+        return {
+            'running': len(self._controls),
+            'cleanup_seconds_p50': round(percentile(latencies, 50), 3) if latencies else None,
+            'cleanup_seconds_p95': round(percentile(latencies, 95), 3) if latencies else None,
+            'cleanup_seconds_max': round(max(latencies), 3) if latencies else None,
+            **self._stats,
+        }
@@ -0,0 +1,167 @@
+"""
+任務進度事件模組
+agent 每完成一個步驟就發佈事件，訂閱者（SSE 串流）可即時收到進度，
+不必等待整個任務結束後才取得結果
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, Optional
+
+
+class TaskChannel:
+    """單一任務的事件頻道"""
+
+    def __init__(self, history_size: int):
+        self.events: deque = deque(maxlen=history_size)
+        self.subscribers: set = set()
+        self.seq = 0
+        self.closed = False
+        self.closed_at: Optional[float] = None
+
+
+class TaskEventBus:
+    """
+    任務事件匯流排
+
+    保留每個任務最近的事件，讓較晚連線的訂閱者也能補收先前的步驟；
+    任務結束後頻道保留 retention 秒，之後自動清除。
+    """
+
+    def __init__(self, history_size: int = 200, retention: float = 300):
+        self.history_size = history_size
+        self.retention = retention
+        self._channels: Dict[str, TaskChannel] = {}
+
+    def _channel(self, task_id: str) -> TaskChannel:
+        channel = self._channels.get(task_id)
+        if channel is None:
+            self._purge_expired()
+            channel = TaskChannel(self.history_size)
+            self._channels[task_id] = channel
+        return channel
+
+    def publish(self, task_id: str, event_type: str, data: Dict):
+        """發佈事件給所有訂閱者"""
+        channel = self._channel(task_id)
+        channel.seq += 1
+        event = {'id': channel.seq, 'event': event_type, 'data': data}
+        channel.events.append(event)
+        for queue in channel.subscribers:
+            queue.put_nowait(event)
+
+    def close(self, task_id: str):
+        """任務結束，通知訂閱者串流結束"""
+        channel = self._channel(task_id)
+        channel.closed = True
+        channel.closed_at = time.time()
+        for queue in channel.subscribers:
+            queue.put_nowait(None)
+
+    def is_closed(self, task_id: str) -> bool:
+        """任務的事件頻道是否已結束"""
+        channel = self._channels.get(task_id)
+        return channel is not None and channel.closed
+
+    async def subscribe(self, task_id: str, keepalive: float = 15) -> AsyncIterator[Optional[Dict]]:
+        """
+        訂閱任務事件，先補送已保留的事件，再即時推送新事件
+
+        等待超過 keepalive 秒沒有事件時產出 None，供呼叫端送出心跳。
+        """
+        channel = self._channel(task_id)
+        backlog = list(channel.events)
+        if channel.closed:
+            for event in backlog:
+                yield event
+            return
+
+        queue: asyncio.Queue = asyncio.Queue()
+        channel.subscribers.add(queue)
+        try:
+            for event in backlog:
+                yield event
+            last_id = backlog[-1]['id'] if backlog else 0
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                if event['id'] > last_id:
+                    yield event
+        finally:
+            channel.subscribers.discard(queue)
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [
+            task_id for task_id, channel in self._channels.items()
+            if channel.closed and not channel.subscribers and now - channel.closed_at > self.retention
+        ]
+        for task_id in expired:
+            del self._channels[task_id]
+
+
+def format_sse(event: Optional[Dict]) -> str:
+    """將事件轉成 Server-Sent Events 格式，None 轉成心跳註解"""
+    if event is None:
+        return ": keepalive\n\n"
+    data = json.dumps(event['data'], ensure_ascii=False, default=str)
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {data}\n\n"
+
+
+def build_step_event(task_id: str, history_item) -> Dict:
+    """
+    從 browser-use 的 AgentHistory 建立步驟事件
+
+    事件只包含動作、URL 與耗時；截圖由呼叫端存入產出物儲存後填入參照。
+    """
+    model_output = getattr(history_item, 'model_output', None)
+    state = getattr(history_item, 'state', None)
+    metadata = getattr(history_item, 'metadata', None)
+    results = getattr(history_item, 'result', None) or []
+
+    actions = []
+    if model_output is not None:
+        for action in getattr(model_output, 'action', None) or []:
+            try:
+                actions.append(action.model_dump(exclude_unset=True))
+            except Exception:
+                actions.append(str(action))
+
+    step = getattr(metadata, 'step_number', None)
+    event = {
+        'task_id': task_id,
+        'step': step,
+        'actions': actions,
+        'url': getattr(state, 'url', None),
+        'title': getattr(state, 'title', None),
+        'errors': [r.error for r in results if getattr(r, 'error', None)],
+        'is_done': any(getattr(r, 'is_done', False) for r in results),
+        'screenshot': None,
+    }
+    if metadata is not None:
+        event['started_at'] = metadata.step_start_time
+        event['duration'] = round(metadata.step_end_time - metadata.step_start_time, 3)
+    return event
+
+
+def build_result_event(task_id: str, result) -> Dict:
+    """建立任務完成事件，只含摘要；各步驟細節已透過步驟事件送出"""
+    event = {'task_id': task_id, 'status': 'success'}
+    for name in ('final_result', 'is_done', 'is_successful', 'total_duration_seconds'):
+        method = getattr(result, name, None)
+        if callable(method):
+            try:
+                event[name] = method()
+            except Exception:
+                event[name] = None
+    history = getattr(result, 'history', None)
+    if isinstance(history, list):
+        event['steps'] = len(history)
+    return event
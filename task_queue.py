@@ -0,0 +1,261 @@
+"""
+非同步任務佇列模組
+POST 只負責排入佇列並回傳 task_id，由背景 worker 以有上限的並行度執行任務
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# 任務狀態
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCESS = 'success'
+STATUS_ERROR = 'error'
+STATUS_CANCELLED = 'cancelled'
+STATUS_TIMEOUT = 'timeout'
+
+FINISHED_STATUSES = (STATUS_SUCCESS, STATUS_ERROR, STATUS_CANCELLED, STATUS_TIMEOUT)
+
+
+class QueueFullError(Exception):
+    """任務佇列已滿"""
+
+
+class MemoryTaskStore:
+    """以記憶體保存任務紀錄，服務重啟後紀錄會消失"""
+
+    def __init__(self, max_records: int = 10000):
+        self.max_records = max_records
+        self._records: Dict[str, Dict] = {}
+
+    async def save(self, record: Dict):
+        self._records[record['task_id']] = record
+        if len(self._records) > self.max_records:
+            self._evict_finished()
+
+    async def get(self, task_id: str) -> Optional[Dict]:
+        return self._records.get(task_id)
+
+    async def list_unfinished(self) -> List[Dict]:
+        return [r for r in self._records.values() if r['status'] not in FINISHED_STATUSES]
+
+    async def close(self):
+        pass
+
+    def _evict_finished(self):
+        """移除最舊的已完成紀錄"""
+        finished = sorted(
+            (r for r in self._records.values() if r['status'] in FINISHED_STATUSES),
+            key=lambda r: r['created_at']
+        )
+        for record in finished[:len(self._records) - self.max_records]:
+            self._records.pop(record['task_id'], None)
+
+
+class SQLiteTaskStore:
+    """
+    以 SQLite 保存任務紀錄
+
+    作為 Redis 等外部佇列的本地替代品，服務重啟後未完成的任務會重新排入佇列。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " task_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status)")
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+
+    async def save(self, record: Dict):
+        data = json.dumps(record, ensure_ascii=False, default=str)
+        async with self._lock:
+            await asyncio.to_thread(self._save, record, data)
+
+    def _save(self, record: Dict, data: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO tasks (task_id, status, created_at, data) VALUES (?, ?, ?, ?)",
+            (record['task_id'], record['status'], record['created_at'], data)
+        )
+        self._conn.commit()
+
+    async def get(self, task_id: str) -> Optional[Dict]:
+        async with self._lock:
+            row = await asyncio.to_thread(
+                lambda: self._conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            )
+        return json.loads(row[0]) if row else None
+
+    async def list_unfinished(self) -> List[Dict]:
+        placeholders = ','.join('?' for _ in FINISHED_STATUSES)
+        async with self._lock:
+            rows = await asyncio.to_thread(
+                lambda: self._conn.execute(
+                    f"SELECT data FROM tasks WHERE status NOT IN ({placeholders}) ORDER BY created_at",
+                    FINISHED_STATUSES
+                ).fetchall()
+            )
+        return [json.loads(row[0]) for row in rows]
+
+    async def close(self):
+        self._conn.close()
+
+
+def create_task_store(backend: Optional[str] = None):
+    """依環境變數建立任務紀錄儲存後端"""
+    backend = backend or os.getenv('TASK_QUEUE_BACKEND', 'memory')
+    if backend == 'sqlite':
+        return SQLiteTaskStore(os.getenv('TASK_QUEUE_DB_PATH', 'tasks.db'))
+    if backend == 'memory':
+        return MemoryTaskStore()
+    raise ValueError(f"不支援的任務佇列後端: {backend}")
+
+
+class TaskQueue:
+    """
+    任務佇列與 worker 協程
+
+    Args:
+        executor: 執行單一任務的協程函數，接收 (task_id, request) 並回傳結果字典
+        store: 任務紀錄儲存後端
+        workers: worker 協程數量（即最大並行任務數）
+        max_size: 佇列中最多可排隊的任務數
+        on_start: 取出任務、標記為執行中之前呼叫的函數，接收 (task_id, request)
+    """
+
+    def __init__(
+        self,
+        executor: Callable[[str, Dict], Awaitable[Dict]],
+        store=None,
+        workers: Optional[int] = None,
+        max_size: Optional[int] = None,
+        on_start: Optional[Callable[[str, Dict], Any]] = None,
+    ):
+        self.executor = executor
+        self.on_start = on_start
+        self.store = store or create_task_store()
+        self.workers = workers or int(os.getenv('TASK_QUEUE_WORKERS', '2'))
+        self.max_size = max_size or int(os.getenv('TASK_QUEUE_MAX_SIZE', '100'))
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running = 0
+
+    async def start(self):
+        """啟動 worker，並把上次未完成的任務重新排入佇列"""
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        for record in await self.store.list_unfinished():
+            if self._queue.full():
+                break
+            record['status'] = STATUS_QUEUED
+            await self.store.save(record)
+            self._queue.put_nowait(record['task_id'])
+            print(f"重新排入未完成的任務: {record['task_id']}")
+
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+        print(f"任務佇列已啟動: {self.workers} 個 worker")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        await self.store.close()
+
+    async def submit(self, request: Dict) -> Dict:
+        """
+        將任務排入佇列
+
+        Returns:
+            新建立的任務紀錄
+        """
+        if self._queue is None or self._queue.full():
+            raise QueueFullError(f"任務佇列已滿 ({self.max_size})")
+
+        record = {
+            'task_id': uuid.uuid4().hex,
+            'status': STATUS_QUEUED,
+            'request': request,
+            'result': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+        }
+        await self.store.save(record)
+        self._queue.put_nowait(record['task_id'])
+        return record
+
+    async def get(self, task_id: str) -> Optional[Dict]:
+        return await self.store.get(task_id)
+
+    async def cancel(self, task_id: str) -> Optional[Dict]:
+        """
+        取消尚未開始執行的任務；執行中的任務需由執行端中止
+
+        Returns:
+            任務紀錄（不存在時為 None），只有排隊中的任務會被改為 cancelled
+        """
+        record = await self.store.get(task_id)
+        if record is None or record['status'] != STATUS_QUEUED:
+            return record
+        record['status'] = STATUS_CANCELLED
+        record['result'] = {'task_id': task_id, 'status': STATUS_CANCELLED, 'message': '任務在開始執行前已取消'}
+        record['finished_at'] = time.time()
+        await self.store.save(record)
+        return record
+
+    def get_metrics(self) -> Dict:
+        return {
+            'workers': self.workers,
+            'queued': self._queue.qsize() if self._queue else 0,
+            'running': self._running,
+            'max_size': self.max_size,
+        }
+
+    async def _worker(self, index: int):
+        while True:
+            task_id = await self._queue.get()
+            try:
+                await self._run(task_id)
+            except Exception as e:
+                print(f"worker {index} 執行任務 {task_id} 時發生未預期錯誤: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, task_id: str):
+        record = await self.store.get(task_id)
+        if record is None or record['status'] != STATUS_QUEUED:
+            # 已在排隊期間被取消
+            return
+
+        if self.on_start is not None:
+            # 標記為執行中之前呼叫（不經過 await），讓取消 API 看到 running 時一定找得到任務
+            self.on_start(task_id, record['request'])
+        record['status'] = STATUS_RUNNING
+        record['started_at'] = time.time()
+        await self.store.save(record)
+
+        self._running += 1
+        try:
+            result: Dict[str, Any] = await self.executor(task_id, record['request'])
+        except Exception as e:
+            result = {'status': STATUS_ERROR, 'message': str(e)}
+        finally:
+            self._running -= 1
+
+        record['status'] = result.get('status', STATUS_ERROR)
+        record['result'] = result
+        record['finished_at'] = time.time()
+        await self.store.save(record)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+截圖前處理測試
+
+以 Pillow 產生的 PNG 截圖走完整的縮圖、壓縮與去重流程；需要 Pillow
+
+用法:
+    python -m pytest test_vision.py
+"""
+
+import base64
+import io
+from types import SimpleNamespace
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from browser_use.llm.messages import ContentPartImageParam, ContentPartTextParam, ImageURL, UserMessage
+
+from vision import UNCHANGED_TEXT, VisionPipeline
+
+
+def screenshot(color=(255, 255, 255), size=(1280, 1100)) -> str:
+    """寬螢幕上置中的頁面：兩側為白色背景，中間是文字區塊與一張照片"""
+    image = Image.new('RGB', size, (255, 255, 255))
+    content = Image.new('RGB', (800, size[1]), color)
+    for row in range(0, size[1], 40):
+        content.paste((30, 30, 30), (40, row, 600, row + 12))
+    content.paste(Image.effect_noise((720, 400), 60).convert('RGB'), (40, 300))  # 頁面中的照片
+    image.paste(content, ((size[0] - 800) // 2, 0))
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return base64.b64encode(output.getvalue()).decode()
+
+
+def state_message(data: str) -> UserMessage:
+    image = ContentPartImageParam(image_url=ImageURL(url=f'data:image/png;base64,{data}', media_type='image/png'))
+    return UserMessage(content=[ContentPartTextParam(text='Current screenshot:'), image])
+
+
+def sent_image(messages):
+    part = messages[0].content[1]
+    return part if part.type == 'image_url' else None
+
+
+def step_result(error=None):
+    return SimpleNamespace(result=[SimpleNamespace(error=error)])
+
+
+def test_resizes_and_encodes_screenshot():
+    pipeline = VisionPipeline('low', image_format='jpeg', crop=True)
+    data = screenshot()
+    part = sent_image(pipeline.process([state_message(data)]))
+
+    assert part.image_url.media_type == 'image/jpeg'
+    assert part.image_url.detail == 'low'
+    encoded = base64.b64decode(part.image_url.url.split(';base64,', 1)[1])
+    image = Image.open(io.BytesIO(encoded))
+    assert image.format == 'JPEG'
+    assert max(image.size) <= 512
+    assert image.width < image.height  # 兩側空白已裁掉
+
+    report = pipeline.report()
+    assert report['resized'] is True
+    assert report['sent'] == 1 and report['deduped'] == 0
+    assert report['bytes_after'] < report['bytes_before']
+    assert report['tokens_after'] == 85
+
+
+def test_dedupe_is_opt_in(monkeypatch):
+    monkeypatch.delenv('VISION_DEDUPE_DISTANCE', raising=False)
+    pipeline = VisionPipeline('auto')
+    data = screenshot()
+    for _ in range(3):
+        assert sent_image(pipeline.process([state_message(data)])) is not None
+        pipeline.observe_step(step_result())
+    assert pipeline.report()['deduped'] == 0
+
+
+def test_dedupe_compares_with_last_sent_screenshot():
+    pipeline = VisionPipeline('auto', dedupe_distance=0)
+    same = screenshot()
+
+    assert sent_image(pipeline.process([state_message(same)])) is not None
+    # 同一步驟重試的呼叫不與自己比較
+    assert sent_image(pipeline.process([state_message(same)])) is not None
+    pipeline.observe_step(step_result())
+
+    # 靜態頁面連續幾步都略過，不會送出/略過交替
+    for _ in range(2):
+        messages = pipeline.process([state_message(same)])
+        assert sent_image(messages) is None
+        assert messages[0].content[1].text == UNCHANGED_TEXT
+        pipeline.observe_step(step_result())
+
+    assert sent_image(pipeline.process([state_message(screenshot(color=(200, 220, 255)))])) is not None
+    assert pipeline.report()['deduped'] == 2
+
+
+def test_error_step_sends_high_detail():
+    pipeline = VisionPipeline('auto', dedupe_distance=0)
+    data = screenshot()
+    pipeline.process([state_message(data)])
+    pipeline.observe_step(step_result(error='Element not found'))
+
+    part = sent_image(pipeline.process([state_message(data)]))
+    assert part is not None
+    assert part.image_url.detail == 'high'
+    assert pipeline.report()['high_detail'] == 1
@@ -0,0 +1,430 @@
+"""
+任務追蹤與效能剖析模組
+記錄每個任務的 span 樹（任務 → 嘗試 → 准入等待 → 網站限速等待 / agent 步驟 → LLM 呼叫 / 瀏覽器動作 → 序列化 → 回調），
+彙整成回應中的 timings，並可匯出為 OpenTelemetry（OTLP/JSON）格式寫入本地檔案或送到 collector；
+另提供單一任務的取樣式（類似 py-spy）與 cProfile 效能剖析
+"""
+
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+SERVICE_NAME = 'autopageaudit-browseruse'
+
+_current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """單一 span，時間以 Unix 奈秒記錄"""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start', 'end', 'attributes', 'error', '_token')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], start: int, attributes: Dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = start
+        self.end: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.end is None:
+            self.end = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Trace:
+    """
+    單一任務的 span 集合
+
+    多行程模式下 worker 以相同的 trace_id 與父 span 建立自己的 Trace，
+    結束時以 export_spans() 帶回主行程，再以 merge() 併入。
+
+    Args:
+        trace_id: 沿用的 trace ID（未指定時產生新的）
+        parent_id: 沒有進行中的 span 時使用的父 span
+    """
+
+    def __init__(self, trace_id: Optional[str] = None, parent_id: Optional[str] = None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.parent_id = parent_id
+        self.spans: List[Span] = []
+
+    def _parent(self) -> Optional[str]:
+        current = _current_span.get()
+        if current is not None and current.trace.trace_id == self.trace_id:
+            return current.span_id
+        return self.parent_id
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """開始 span 並設為目前的 span，需以 finish() 結束（結束時恢復原本的目前 span）"""
+        span = Span(self, name, self._parent(), time.time_ns(), attributes)
+        span._token = _current_span.set(span)
+        self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(e)
+            raise
+        span.finish()
+
+    def add_span(self, name: str, start: float, end: float, parent_id: Optional[str] = None, **attributes) -> Span:
+        """加入已知起迄時間（Unix 秒）的 span，例如 agent 步驟內的各階段"""
+        span = Span(self, name, parent_id or self._parent(), int(start * 1e9), attributes)
+        span.end = int(end * 1e9)
+        self.spans.append(span)
+        return span
+
+    def export_spans(self) -> List[Dict]:
+        return [span.to_dict() for span in self.spans]
+
+    def merge(self, spans: List[Dict]):
+        for data in spans:
+            span = Span(self, data['name'], data['parent_id'], data['start'], data['attributes'])
+            span.span_id, span.end, span.error = data['span_id'], data['end'], data['error']
+            self.spans.append(span)
+
+    def timings(self) -> Dict:
+        """
+        各 span 名稱的次數與總耗時，以及依 span 路徑彙整的自身耗時（可直接轉成 flamegraph 的 folded 格式）
+        尚未結束的 span 以目前時間計算
+        """
+        now = time.time_ns()
+        by_id = {span.span_id: span for span in self.spans}
+        child_ns: Dict[str, int] = defaultdict(int)
+        for span in self.spans:
+            if span.parent_id in by_id:
+                child_ns[span.parent_id] += (span.end or now) - span.start
+
+        phases: Dict[str, Dict] = {}
+        stacks: Dict[str, float] = defaultdict(float)
+        for span in self.spans:
+            duration = (span.end or now) - span.start
+            phase = phases.setdefault(span.name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            phase['count'] += 1
+            phase['total_ms'] += duration / 1e6
+            phase['max_ms'] = max(phase['max_ms'], duration / 1e6)
+
+            path, parent = [span.name], by_id.get(span.parent_id)
+            while parent is not None:
+                path.append(parent.name)
+                parent = by_id.get(parent.parent_id)
+            stacks[';'.join(reversed(path))] += max(0, duration - child_ns[span.span_id]) / 1e6
+
+        roots = [span for span in self.spans if span.parent_id not in by_id]
+        return {
+            'total_ms': round(sum((span.end or now) - span.start for span in roots) / 1e6, 1),
+            'phases': {
+                name: {'count': phase['count'], 'total_ms': round(phase['total_ms'], 1), 'max_ms': round(phase['max_ms'], 1)}
+                for name, phase in phases.items()
+            },
+            'stacks': {path: round(ms, 1) for path, ms in stacks.items()},
+        }
+
+    def to_otlp(self) -> Dict:
+        """OTLP/JSON 格式（POST /v1/traces 的內容）"""
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [_attribute('service.name', SERVICE_NAME)]},
+                'scopeSpans': [{
+                    'scope': {'name': 'tracing'},
+                    'spans': [
+                        {
+                            'traceId': self.trace_id,
+                            'spanId': span.span_id,
+                            **({'parentSpanId': span.parent_id} if span.parent_id else {}),
+                            'name': span.name,
+                            'kind': 1,
+                            'startTimeUnixNano': str(span.start),
+                            'endTimeUnixNano': str(span.end or time.time_ns()),
+                            'attributes': [_attribute(key, value) for key, value in span.attributes.items()],
+                            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+                        }
+                        for span in self.spans
+                    ],
+                }],
+            }],
+        }
+
+
+def _attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def activate(trace: Trace):
+    """把 trace 設為目前任務的 trace，回傳供 deactivate 使用的 token"""
+    return _current_trace.set(trace)
+
+
+def deactivate(token):
+    _current_trace.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def current_context() -> Optional[Dict]:
+    """跨行程傳遞用的 trace 資訊（trace_id 與目前的 span）"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    span = _current_span.get()
+    return {'trace_id': trace.trace_id, 'parent_id': span.span_id if span is not None else trace.parent_id}
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """在目前任務的 trace 中記錄 span；沒有進行中的 trace 時不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attributes) as current:
+        yield current
+
+
+def record_span(name: str, start: float, end: float, parent_id: Optional[str] = None, **attributes) -> Optional[Span]:
+    """在目前任務的 trace 中加入已知起迄時間（Unix 秒）的 span；沒有進行中的 trace 時回傳 None"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    return trace.add_span(name, start, end, parent_id, **attributes)
+
+
+class TraceExporter:
+    """
+    把 trace 寫入本地目錄（每個 trace 一個 OTLP/JSON 檔），並可同時送到 OTLP/HTTP collector
+
+    Args:
+        root: 存放目錄
+        endpoint: collector 的 /v1/traces 網址，未設定時只寫檔
+    """
+
+    def __init__(self, root: Optional[str] = None, endpoint: Optional[str] = None):
+        self.root = root or os.getenv('TRACE_DIR', 'traces')
+        self.endpoint = endpoint if endpoint is not None else os.getenv('TRACE_EXPORT_URL', '')
+        self.sample_rate = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+        self._pending: set = set()
+        self._stats = {'exported': 0, 'export_errors': 0}
+
+    def path(self, trace_id: str) -> str:
+        if not trace_id.isalnum():
+            raise ValueError(f"不合法的 trace ID: {trace_id}")
+        return os.path.join(self.root, f"{trace_id}.json")
+
+    def submit(self, trace: Trace):
+        """在背景匯出，不延遲回應"""
+        task = asyncio.create_task(self.export(trace))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def export(self, trace: Trace):
+        payload = trace.to_otlp()
+        try:
+            await asyncio.to_thread(self._write, trace.trace_id, payload)
+            if self.endpoint:
+                async with httpx.AsyncClient(timeout=5) as client:
+                    response = await client.post(self.endpoint, json=payload)
+                    response.raise_for_status()
+            self._stats['exported'] += 1
+        except Exception as e:
+            self._stats['export_errors'] += 1
+            print(f"匯出追蹤失敗 {trace.trace_id}: {e}")
+
+    def _write(self, trace_id: str, payload: Dict):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(trace_id)
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(temp, path)
+
+    def load(self, trace_id: str) -> Optional[Dict]:
+        try:
+            with open(self.path(trace_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    async def close(self):
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def get_metrics(self) -> Dict:
+        return {'root': self.root, 'endpoint': self.endpoint or None, 'sample_rate': self.sample_rate, **self._stats}
+
+
+# 取樣時視為閒置的最內層函數（等待 I/O 或工作），不計入剖析結果
+_IDLE_FRAMES = {('selectors.py', 'select'), ('threading.py', 'wait'), ('thread.py', '_worker'), ('queue.py', 'get')}
+
+
+class SamplingProfiler:
+    """
+    取樣式效能剖析（類似 py-spy）：背景執行緒定期讀取所有執行緒的呼叫堆疊並累計次數
+
+    同一行程中其他任務的堆疊也會被取樣；包含 asyncio.to_thread 執行緒中的序列化與 DOM 處理。
+
+    Args:
+        interval: 取樣間隔秒數
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='sampling-profiler')
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self._stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        """flamegraph.pl / speedscope 可讀取的 folded 格式"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def top(self, limit: int = 20) -> List[Dict]:
+        """依自身取樣數排序的函數"""
+        own = Counter()
+        for stack, count in self._stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        return [
+            {'function': function, 'samples': count, 'percent': round(count / self.samples * 100, 1)}
+            for function, count in own.most_common(limit)
+        ]
+
+
+_cprofile_lock = threading.Lock()
+
+
+class TaskProfiler:
+    """
+    單一任務的效能剖析，結果寫入 PROFILE_DIR
+
+    Args:
+        mode: sampling（取樣，輸出 .folded）或 cprofile（輸出 pstats 的 .prof）
+        name: 檔名（通常為 trace ID）
+    """
+
+    def __init__(self, mode: str, name: str, root: Optional[str] = None):
+        if mode not in ('sampling', 'cprofile'):
+            raise ValueError(f"不支援的剖析模式: {mode}")
+        self.mode = mode
+        self.name = name
+        self.root = root or os.getenv('PROFILE_DIR', 'profiles')
+        self._sampler: Optional[SamplingProfiler] = None
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._started = 0.0
+        self.error: Optional[str] = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == 'sampling':
+            self._sampler = SamplingProfiler(float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005')))
+            self._sampler.start()
+        elif _cprofile_lock.acquire(blocking=False):
+            # 同一執行緒同時只能有一個 cProfile；事件迴圈中同時執行的其他任務也會被記錄
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self.error = "另一個任務正在以 cProfile 剖析"
+
+    def stop(self) -> Dict:
+        """停止剖析並寫入檔案，回傳摘要"""
+        summary = {'mode': self.mode, 'duration_s': round(time.perf_counter() - self._started, 3)}
+        if self.error:
+            return {**summary, 'error': self.error}
+        os.makedirs(self.root, exist_ok=True)
+        if self._sampler is not None:
+            self._sampler.stop()
+            path = os.path.join(self.root, f"{self.name}.folded")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self._sampler.folded())
+            return {**summary, 'file': path, 'samples': self._sampler.samples, 'top': self._sampler.top()}
+
+        self._cprofile.disable()
+        _cprofile_lock.release()
+        path = os.path.join(self.root, f"{self.name}.prof")
+        self._cprofile.dump_stats(path)
+        stats = pstats.Stats(self._cprofile)
+        ranked = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:20]
+        return {
+            **summary,
+            'file': path,
+            'top': [
+                {
+                    'function': f"{function} ({os.path.basename(filename)}:{line})",
+                    'calls': calls,
+                    'own_ms': round(own * 1000, 1),
+                    'cumulative_ms': round(cumulative * 1000, 1),
+                }
+                for (filename, line, function), (_, calls, own, cumulative, _) in ranked
+            ],
+        }
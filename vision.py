@@ -0,0 +1,267 @@
+"""
+截圖前處理模組
+截圖送進 LLM 之前依任務的 vision 模式縮小解析度、裁掉頁面兩側的空白並轉成 JPEG/WebP；
+與上一步的畫面相同（感知雜湊相近）時不再重送，並統計每個任務省下的位元組與影像 token
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import math
+import os
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from llm_cache import IMAGE_TOKEN_ESTIMATE, ChatModelWrapper
+
+try:
+    from PIL import Image, ImageChops
+except ImportError:  # Pillow 為選用依賴，未安裝時不縮圖，只調整 detail
+    Image = None
+
+VISION_OFF = 'off'
+VISION_LOW = 'low'
+VISION_HIGH = 'high'
+VISION_AUTO = 'auto'
+VISION_MODES = (VISION_OFF, VISION_LOW, VISION_HIGH, VISION_AUTO)
+
+# max_size: 等比例縮小後的長寬上限；quality: JPEG/WebP 品質；detail: 傳給模型的 detail 等級
+# （low detail 時模型端一律縮到 512x512 以內，先縮好可省下上傳量）
+VISION_PROFILES: Dict[str, Dict] = {
+    VISION_LOW: {'max_size': (512, 512), 'quality': 60, 'detail': 'low'},
+    VISION_HIGH: {'max_size': (1280, 1280), 'quality': 80, 'detail': 'high'},
+}
+
+MEDIA_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+# 略過重送時代替截圖的文字
+UNCHANGED_TEXT = '[Screenshot omitted: the page looks the same as in the previous step.]'
+
+_DATA_URL_PREFIX = 'data:'
+
+
+def resolve_vision_mode(mode: Optional[str]) -> str:
+    """未指定時使用 VISION_MODE（預設 auto）"""
+    mode = mode or os.getenv('VISION_MODE', VISION_AUTO)
+    if mode not in VISION_MODES:
+        raise ValueError(f"不支援的 vision 模式: {mode}")
+    return mode
+
+
+def image_tokens(width: int, height: int, detail: str) -> int:
+    """
+    OpenAI 影像 token 計算：low 固定 85；high 先縮到 2048x2048 以內、短邊 768，
+    再以 512x512 的區塊計算（每塊 170，另加 85）
+    """
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _png_size(data: bytes) -> Optional[Tuple[int, int]]:
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    return None
+
+
+def perceptual_hash(image, hash_size: int = 16) -> int:
+    """difference hash：縮成灰階小圖後比較相鄰像素的明暗，畫面細微變化（例如游標閃爍）不影響結果"""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def trim_margins(image, min_saving: float = 0.1):
+    """裁掉與左上角同色的四周空白（例如寬螢幕上置中的頁面兩側），省下不到 min_saving 的面積時不裁"""
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    bbox = ImageChops.difference(image, background).getbbox()
+    if not bbox:
+        return image
+    area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+    if area > image.width * image.height * (1 - min_saving):
+        return image
+    return image.crop(bbox)
+
+
+class VisionPipeline:
+    """
+    單一任務的截圖前處理
+
+    每次 LLM 呼叫前處理訊息中的截圖；auto 模式平時以 low 傳送，
+    上一個步驟出錯時下一張截圖改以 high 傳送，讓模型看清楚畫面。
+
+    Args:
+        mode: off / low / high / auto
+        image_format: jpeg 或 webp
+        crop: 是否裁掉頁面四周的空白
+        dedupe_distance: 與前幾步最後送出的截圖感知雜湊相差不超過此位元數時不重送（-1 為不略過，預設）；
+                         browser-use 每步只送目前的截圖，略過時該步模型看不到任何截圖，因此需明確啟用
+    """
+
+    def __init__(self, mode: str, image_format: Optional[str] = None, crop: Optional[bool] = None,
+                 dedupe_distance: Optional[int] = None):
+        self.mode = mode
+        self.image_format = (image_format or os.getenv('VISION_FORMAT', 'jpeg')).lower()
+        if self.image_format not in MEDIA_TYPES:
+            raise ValueError(f"不支援的截圖格式: {self.image_format}")
+        self.crop = crop if crop is not None else os.getenv('VISION_CROP', 'true').lower() == 'true'
+        self.dedupe_distance = (
+            dedupe_distance if dedupe_distance is not None else int(os.getenv('VISION_DEDUPE_DISTANCE', '-1'))
+        )
+        self.escalate = False
+        self._step = 0
+        self._previous: Optional[Tuple[int, int]] = None  # 最後送出的截圖：(步驟, 感知雜湊)
+        self._stats = {
+            'images': 0, 'sent': 0, 'deduped': 0, 'high_detail': 0,
+            'bytes_before': 0, 'bytes_after': 0, 'tokens_before': 0, 'tokens_after': 0, 'processing_seconds': 0.0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != VISION_OFF
+
+    def wrap(self, llm) -> 'VisionChatModel':
+        return VisionChatModel(llm, self)
+
+    def observe_step(self, item):
+        """步驟結束時呼叫：auto 模式下步驟出錯則下一張截圖改送 high"""
+        self.escalate = any(result.error for result in (item.result or []))
+        self._step += 1
+
+    def _profile(self) -> Dict:
+        if self.mode == VISION_AUTO:
+            return VISION_PROFILES[VISION_HIGH if self.escalate else VISION_LOW]
+        return VISION_PROFILES[self.mode]
+
+    def process(self, messages: List[Any]) -> List[Any]:
+        """回傳處理後的訊息（有截圖的訊息會複製一份，不修改 Agent 保存的原訊息）"""
+        start = time.perf_counter()
+        processed = []
+        for message in messages:
+            content = getattr(message, 'content', None)
+            if isinstance(content, list) and any(getattr(part, 'type', None) == 'image_url' for part in content):
+                message = message.model_copy(update={'content': [self._process_part(part) for part in content]})
+            processed.append(message)
+        self._stats['processing_seconds'] += time.perf_counter() - start
+        return processed
+
+    def _process_part(self, part):
+        if getattr(part, 'type', None) != 'image_url':
+            return part
+        url = part.image_url.url
+        if not url.startswith(_DATA_URL_PREFIX) or ';base64,' not in url:
+            return part
+        try:
+            data = base64.b64decode(url.split(';base64,', 1)[1])
+        except (binascii.Error, ValueError):
+            return part
+
+        profile = self._profile()
+        self._stats['images'] += 1
+        self._stats['bytes_before'] += len(data)
+        size = _png_size(data)
+        # detail 為 auto 時模型對大圖以 high 計算
+        detail = 'low' if part.image_url.detail == 'low' else 'high'
+        tokens_before = image_tokens(*size, detail) if size else IMAGE_TOKEN_ESTIMATE
+        self._stats['tokens_before'] += tokens_before
+
+        if Image is not None:
+            try:
+                encoded, size, fingerprint = self._encode(data, profile)
+                media_type = MEDIA_TYPES[self.image_format]
+            except Exception as e:
+                print(f"截圖前處理失敗，改送原圖: {e}")
+                encoded, fingerprint, media_type = data, None, part.image_url.media_type
+        else:
+            # 沒有 Pillow 時無法縮圖，只比對內容是否完全相同
+            encoded, media_type = data, part.image_url.media_type
+            fingerprint = int.from_bytes(hashlib.sha1(data).digest()[:8], 'big')
+
+        if self._unchanged(fingerprint):
+            self._stats['deduped'] += 1
+            from browser_use.llm.messages import ContentPartTextParam
+            return ContentPartTextParam(text=UNCHANGED_TEXT)
+
+        if fingerprint is not None:
+            self._previous = (self._step, fingerprint)
+        tokens_after = image_tokens(*size, profile['detail']) if size else tokens_before
+        self._stats['sent'] += 1
+        self._stats['high_detail'] += profile['detail'] == 'high'
+        self._stats['bytes_after'] += len(encoded)
+        self._stats['tokens_after'] += tokens_after
+        image_url = part.image_url.model_copy(update={
+            'url': f'data:{media_type};base64,{base64.b64encode(encoded).decode()}',
+            'media_type': media_type,
+            'detail': profile['detail'],
+        })
+        return part.model_copy(update={'image_url': image_url})
+
+    def _encode(self, data: bytes, profile: Dict) -> Tuple[bytes, Tuple[int, int], int]:
+        image = Image.open(io.BytesIO(data))
+        image = image.convert('RGB')
+        fingerprint = perceptual_hash(image)
+        if self.crop:
+            image = trim_margins(image)
+        image.thumbnail(profile['max_size'], Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format=self.image_format.upper(), quality=profile['quality'])
+        return output.getvalue(), image.size, fingerprint
+
+    def _unchanged(self, fingerprint: Optional[int]) -> bool:
+        """
+        是否與先前步驟最後實際送出的截圖相同；要改送 high 的截圖一律送出。
+        只與模型看過的截圖比較（略過的截圖不更新比較對象），同一步驟內重試的呼叫也不與自己比較
+        """
+        if self.escalate or fingerprint is None or self._previous is None or self.dedupe_distance < 0:
+            return False
+        step, previous = self._previous
+        if step == self._step:
+            return False
+        return bin(fingerprint ^ previous).count('1') <= self.dedupe_distance
+
+    def report(self) -> Dict:
+        stats = self._stats
+        return {
+            'mode': self.mode,
+            'images': stats['images'],
+            'sent': stats['sent'],
+            'deduped': stats['deduped'],
+            'high_detail': stats['high_detail'],
+            'bytes_before': stats['bytes_before'],
+            'bytes_after': stats['bytes_after'],
+            'saved_bytes': stats['bytes_before'] - stats['bytes_after'],
+            'tokens_before': stats['tokens_before'],
+            'tokens_after': stats['tokens_after'],
+            'saved_tokens': stats['tokens_before'] - stats['tokens_after'],
+            'processing_ms': round(stats['processing_seconds'] * 1000, 1),
+            'resized': Image is not None,
+        }
+
+
+class VisionChatModel(ChatModelWrapper):
+    """
+    呼叫前先處理訊息中截圖的 LLM 包裝
+
+    包在 LLMCallCache 的包裝外層，快取鍵以處理後的截圖計算。
+    """
+
+    def __init__(self, llm, pipeline: VisionPipeline):
+        super().__init__(llm)
+        self._pipeline = pipeline
+
+    async def transform(self, messages: List[Any]) -> List[Any]:
+        if any(isinstance(getattr(message, 'content', None), list) for message in messages):
+            messages = await asyncio.to_thread(self._pipeline.process, messages)
+        return messages
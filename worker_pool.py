@@ -0,0 +1,380 @@
+"""
+多行程 worker 模組
+由主服務（supervisor）啟動 N 個 worker 行程，每個 worker 有自己的事件迴圈、瀏覽器池與 LLM 客戶端，
+任務交給執行中任務最少的 worker；worker 崩潰時自動重啟，關閉服務時等待執行中的任務完成。
+
+supervisor 與 worker 之間以 stdin/stdout 上的 JSON Lines 溝通，worker 內的 print 會改寫到 stderr。
+
+worker 行程的進入點:
+    python worker_pool.py --runner agent_api:run_in_worker --lifespan agent_api:worker_lifespan
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import sys
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from result_serializer import dumps
+
+# 每行訊息上限（結果中的截圖已改存產出物儲存，正常不會接近這個大小）
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+# 在 worker 之間平分的全域上限，各 worker 取 ceil(總量 / N)
+SHARED_LIMIT_ENV = ('BROWSER_POOL_SIZE', 'LLM_MAX_CONCURRENCY', 'LLM_TOKENS_PER_MINUTE')
+
+
+class WorkerCrashed(Exception):
+    """執行任務的 worker 行程意外結束"""
+
+
+class WorkerUnavailable(Exception):
+    """沒有可用的 worker（尚未啟動或正在關閉）"""
+
+
+class RemoteTaskError(Exception):
+    """worker 中的任務拋出例外，保留原始類型名稱與附帶資訊"""
+
+    def __init__(self, error_type: str, message: str, details: Optional[Dict] = None):
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+        self.message = message
+        self.details = details or {}
+
+
+class WorkerProcess:
+    """supervisor 端的單一 worker 行程"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.ready = False
+        self.startup: Optional[Dict] = None
+        self.started_at = 0.0
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.handlers: Dict[str, Callable] = {}
+        self.completed = 0
+        self.restarts = 0
+        self.reader_task: Optional[asyncio.Task] = None
+
+    @property
+    def load(self) -> int:
+        return len(self.pending)
+
+    def send(self, message: Dict):
+        self.process.stdin.write(dumps(message) + b"\n")
+
+
+class WorkerPool:
+    """
+    supervisor：管理 worker 行程並分派任務
+
+    Args:
+        workers: worker 行程數（0 表示不啟用，任務在主行程內執行）
+        runner: worker 中執行任務的函數（"模組:函數"）
+        lifespan: worker 啟動/關閉時的 async context manager 工廠（"模組:函數"，可省略）
+        drain_timeout: 關閉時等待執行中任務完成的秒數
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        runner: str = 'agent_api:run_in_worker',
+        lifespan: Optional[str] = 'agent_api:worker_lifespan',
+        drain_timeout: Optional[float] = None,
+    ):
+        self.size = workers if workers is not None else int(os.getenv('AGENT_WORKERS', '0'))
+        self.runner = runner
+        self.lifespan = lifespan
+        self.drain_timeout = drain_timeout or float(os.getenv('AGENT_WORKER_DRAIN_TIMEOUT', '60'))
+        self.cancel_timeout = float(os.getenv('AGENT_WORKER_CANCEL_TIMEOUT', '30'))
+
+        self._workers: List[WorkerProcess] = []
+        self._closing = False
+        self._changed: Optional[asyncio.Condition] = None
+        self._stats = {'dispatched': 0, 'completed': 0, 'failed': 0, 'crashes': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    async def start(self):
+        """啟動所有 worker 並等待就緒"""
+        if not self.enabled:
+            return
+        self._changed = asyncio.Condition()
+        self._workers = [WorkerProcess(i) for i in range(self.size)]
+        await asyncio.gather(*(self._spawn(worker) for worker in self._workers))
+        print(f"已啟動 {self.size} 個 worker 行程")
+
+    async def stop(self):
+        """停止接受新任務，等待執行中的任務完成後關閉 worker"""
+        if not self.enabled:
+            return
+        self._closing = True
+        busy = sum(worker.load for worker in self._workers)
+        if busy:
+            print(f"等待 {busy} 個執行中的任務完成（最多 {self.drain_timeout:.0f} 秒）...")
+            try:
+                async with self._changed:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: all(worker.load == 0 for worker in self._workers)),
+                        self.drain_timeout
+                    )
+            except asyncio.TimeoutError:
+                print("等待逾時，強制關閉 worker")
+
+        for worker in self._workers:
+            await self._shutdown(worker)
+        self._workers = []
+
+    async def run(self, payload: Dict, on_event: Optional[Callable[[str, Dict], None]] = None) -> Dict:
+        """
+        交給執行中任務最少的 worker 執行
+
+        Args:
+            payload: 傳給 worker runner 的資料（需可 JSON 化）
+            on_event: 收到 worker 轉發的事件時呼叫 (event_type, data)
+        """
+        if self._closing:
+            raise WorkerUnavailable("服務正在關閉，不接受新任務")
+        worker = self._pick()
+        job_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[job_id] = future
+        if on_event:
+            worker.handlers[job_id] = on_event
+        self._stats['dispatched'] += 1
+        try:
+            worker.send({'type': 'run', 'id': job_id, 'payload': payload})
+            await worker.process.stdin.drain()
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # 呼叫端取消（例如任務被取消或逾時），通知 worker 取消該任務，並等待它回傳部分結果
+            if worker.process and worker.process.returncode is None and not future.done():
+                try:
+                    worker.send({'type': 'cancel', 'id': job_id})
+                    return await asyncio.wait_for(asyncio.shield(future), self.cancel_timeout)
+                except Exception:
+                    pass
+            raise
+        finally:
+            self._finish(worker, job_id)
+
+    def get_metrics(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'workers': [
+                {
+                    'index': worker.index,
+                    'pid': worker.process.pid if worker.process else None,
+                    'ready': worker.ready,
+                    'startup': worker.startup,
+                    'load': worker.load,
+                    'completed': worker.completed,
+                    'restarts': worker.restarts,
+                    'uptime': round(time.time() - worker.started_at, 1) if worker.ready else None,
+                }
+                for worker in self._workers
+            ],
+            'closing': self._closing,
+            **self._stats,
+        }
+
+    def _pick(self) -> WorkerProcess:
+        candidates = [worker for worker in self._workers if worker.ready]
+        if not candidates:
+            raise WorkerUnavailable("沒有就緒的 worker")
+        return min(candidates, key=lambda worker: (worker.load, worker.completed))
+
+    def _finish(self, worker: WorkerProcess, job_id: str):
+        if worker.pending.pop(job_id, None) is not None:
+            worker.completed += 1
+        worker.handlers.pop(job_id, None)
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _worker_env(self, index: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env['AGENT_WORKERS'] = '0'
+        env['AGENT_WORKER_INDEX'] = str(index)
+        env['PYTHONUNBUFFERED'] = '1'
+        for name in SHARED_LIMIT_ENV:
+            value = os.getenv(name)
+            if value and value.isdigit() and int(value) > 0:
+                env[name] = str(math.ceil(int(value) / self.size))
+        return env
+
+    async def _spawn(self, worker: WorkerProcess):
+        command = [sys.executable, os.path.abspath(__file__), '--runner', self.runner]
+        if self.lifespan:
+            command += ['--lifespan', self.lifespan]
+        worker.process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=self._worker_env(worker.index),
+            cwd=os.getcwd(),
+            limit=MAX_MESSAGE_BYTES,
+        )
+        worker.ready = False
+        ready = asyncio.get_running_loop().create_future()
+        worker.reader_task = asyncio.create_task(self._read(worker, ready))
+        await ready
+        worker.started_at = time.time()
+
+    async def _read(self, worker: WorkerProcess, ready: asyncio.Future):
+        """讀取 worker 的訊息，行程結束時讓未完成的任務失敗並重啟"""
+        process = worker.process
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            kind = message.get('type')
+            if kind == 'ready':
+                worker.ready = True
+                worker.startup = message.get('startup')
+                if not ready.done():
+                    ready.set_result(None)
+            elif kind == 'event':
+                handler = worker.handlers.get(message['id'])
+                if handler:
+                    handler(message['event'], message['data'])
+            elif kind in ('result', 'error'):
+                future = worker.pending.get(message['id'])
+                if future is None or future.done():
+                    continue
+                if kind == 'result':
+                    self._stats['completed'] += 1
+                    future.set_result(message['data'])
+                else:
+                    self._stats['failed'] += 1
+                    future.set_exception(RemoteTaskError(
+                        message.get('error_type', 'RuntimeError'), message['message'], message.get('details')
+                    ))
+
+        returncode = await process.wait()
+        worker.ready = False
+        if not ready.done():
+            ready.set_exception(WorkerCrashed(f"worker {worker.index} 啟動失敗（結束碼 {returncode}）"))
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(WorkerCrashed(f"worker {worker.index} 意外結束（結束碼 {returncode}）"))
+        if self._closing:
+            return
+
+        self._stats['crashes'] += 1
+        worker.restarts += 1
+        print(f"worker {worker.index} 意外結束（結束碼 {returncode}），重新啟動...")
+        # 連續崩潰時拉長間隔，避免快速重啟循環
+        await asyncio.sleep(min(30, 2 ** min(worker.restarts, 5)))
+        if not self._closing:
+            try:
+                await self._spawn(worker)
+            except Exception as e:
+                print(f"worker {worker.index} 重新啟動失敗: {e}")
+
+    async def _shutdown(self, worker: WorkerProcess):
+        process = worker.process
+        if process is None or process.returncode is not None:
+            return
+        try:
+            worker.send({'type': 'shutdown'})
+            process.stdin.close()
+            await asyncio.wait_for(process.wait(), 30)
+        except (asyncio.TimeoutError, ConnectionError):
+            process.kill()
+            await process.wait()
+        if worker.reader_task:
+            await asyncio.gather(worker.reader_task, return_exceptions=True)
+
+
+def _load(spec: str):
+    module_name, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+
+async def worker_main(runner_spec: str, lifespan_spec: Optional[str], ipc_out):
+    """worker 行程主迴圈：從 stdin 讀取任務，結果與事件寫到 IPC 輸出"""
+    runner = _load(runner_spec)
+    lifespan = _load(lifespan_spec)() if lifespan_spec else None
+    loop = asyncio.get_running_loop()
+    tasks: Dict[str, asyncio.Task] = {}
+
+    def send(message: Dict):
+        ipc_out.write(dumps(message) + b"\n")
+        ipc_out.flush()
+
+    async def execute(job_id: str, payload: Dict):
+        def emit(event_type: str, data: Dict):
+            send({'type': 'event', 'id': job_id, 'event': event_type, 'data': data})
+        try:
+            send({'type': 'result', 'id': job_id, 'data': await runner(payload, emit)})
+        except asyncio.CancelledError:
+            send({'type': 'error', 'id': job_id, 'message': '任務已取消'})
+        except Exception as e:
+            send({
+                'type': 'error',
+                'id': job_id,
+                'error_type': getattr(e, 'error_type', type(e).__name__),
+                'message': getattr(e, 'message', str(e)),
+                'details': getattr(e, 'details', None),
+            })
+        finally:
+            tasks.pop(job_id, None)
+
+    reader = asyncio.StreamReader(limit=MAX_MESSAGE_BYTES)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    # lifespan 可回傳可序列化的啟動資訊（例如預熱結果），隨就緒訊息送回 supervisor
+    startup = await lifespan.__aenter__() if lifespan is not None else None
+    send({'type': 'ready', 'pid': os.getpid(), 'startup': startup})
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message['type'] == 'run':
+                tasks[message['id']] = asyncio.create_task(execute(message['id'], message['payload']))
+            elif message['type'] == 'cancel':
+                task = tasks.get(message['id'])
+                if task:
+                    task.cancel()
+            elif message['type'] == 'shutdown':
+                break
+        if tasks:
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+    finally:
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='agent worker 行程')
+    parser.add_argument('--runner', required=True, help='執行任務的 async 函數，格式為 模組:函數')
+    parser.add_argument('--lifespan', help='worker 啟動/關閉時的 async context manager，格式為 模組:函數')
+    args = parser.parse_args()
+
+    # stdout 保留給 IPC，其餘輸出（包含 print）改寫到 stderr
+    ipc_out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.path.insert(0, os.getcwd())
+
+    asyncio.run(worker_main(args.runner, args.lifespan, ipc_out))
+
+
+if __name__ == '__main__':
+    main()